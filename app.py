@@ -15,33 +15,72 @@ Version: 2.0.0
 from __future__ import annotations
 
 import os
-import sys
 import re
+import gc
+import hashlib
+import hmac
 import json
-from typing import TypedDict, List, Dict, Any, Optional, Literal
+import shutil
+import time
+import threading
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Annotated, TypedDict, List, Dict, Any, Optional, Literal
 from enum import Enum
 
-from flask import Flask, request, jsonify
+from flask import Flask, g, request, jsonify, send_file
 from flask_cors import CORS
 from collections import defaultdict
 import yaml
 
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_chroma import Chroma
-from langchain_core.documents import Document
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
-from langgraph.graph import StateGraph, END
+if TYPE_CHECKING:
+    from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+    from langchain_chroma import Chroma
+    from langchain_core.documents import Document
+    from vector_index import ShardedVectorIndex
+
+from caches import LRUCache
+from study_store import StudyStore, StudyItemTooLarge
+from sessions import SessionStore, extractive_summary, first_sentences, retrieval_key
+from entities import EntityResolver
+from ingest import ingest_corpus, source_paths
+from embedding_pipeline import BuildCheckpoint, EmbeddingPipeline, EmbeddingStore
+from summaries import LEVELS as SUMMARY_LEVELS, SummaryIndex
+from chunk_store import ChunkTable, ChunkTableBuilder
+from payloads import Compressor, FastJSONProvider, Payload
+from ratelimit import AdmissionController, ClientRateLimiter, Overloaded
+import tracing
+from profiling import MODES as PROFILE_MODES, RequestProfiler
+from querylog import QueryLog
+import bundle
+import leases
+
+
+def import_heavy_dependencies():
+    """
+    Import LangChain, LangGraph, Chroma and the OpenAI SDK on first use.
+
+    These take seconds to import, so they are bound as module globals from the
+    background initializer instead of at import time; the port is already
+    serving /healthz and /readyz by then.
+    """
+    global OpenAIEmbeddings, ChatOpenAI, Chroma, Document, ChatPromptTemplate, JsonOutputParser
+    global StateGraph, END, Send
+    global ShardedVectorIndex, chunk_ids, quantized_path, scale_path, chromadb
+
+    from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+    from langchain_chroma import Chroma
+    from langchain_core.documents import Document
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import JsonOutputParser
+    from langgraph.graph import StateGraph, END
+    from langgraph.types import Send
+    from vector_index import ShardedVectorIndex, chunk_ids, quantized_path, scale_path
+    import chromadb
 
 # ============================================================
 # CONFIGURATION
 # ============================================================
 
-section_hierarchy = None
-metadata_index = None
-docs = None
-
 
 def load_config() -> Dict[str, Any]:
     """Load config from YAML"""
@@ -73,25 +112,134 @@ CONFIG = load_config()
 
 PRODUCT_NAME = CONFIG['product']['name']
 PRODUCT_VERSION = CONFIG['product']['version']
-DATA_FILE = CONFIG['data']['source_file']
+DATA_CONFIG = CONFIG['data']
+DATA_FILE = DATA_CONFIG['source_file']
+# Bump when chunking or chunk metadata changes, so persisted vectors are rebuilt
+INGEST_SCHEMA_VERSION = "3"
+PERSIST_DIR = "./chroma_db_v2"  # One subdirectory per knowledge-base version
+INGEST_CACHE_FILE = os.path.join(PERSIST_DIR, "ingest_cache.json")
+SUMMARIES_FILE = os.path.join(PERSIST_DIR, "summaries.json")  # Built by `python build.py summaries`
+RELOAD_STAMP_FILE = os.path.join(PERSIST_DIR, "reload.stamp")
+EMBEDDING_STORE_FILE = os.path.join(PERSIST_DIR, "embeddings.sqlite")  # Shared by all versions
 
 OPENAI_CHAT_MODEL = os.environ.get("OPENAI_CHAT_MODEL", "gpt-4o-mini")
 OPENAI_EMBED_MODEL = os.environ.get("OPENAI_EMBED_MODEL", "text-embedding-3-small")
 
-print(f"[*] {PRODUCT_NAME} v{PRODUCT_VERSION} - Agentic RAG")
-print(f"[*] Data: {DATA_FILE}")
+# Canonical ids for states, certifications, aid programs and sections
+entity_resolver = EntityResolver(CONFIG.get('taxonomies', {}))
+VECTOR_INDEX_CONFIG = CONFIG.get('vector_index', {})
+EMBEDDING_CONFIG = CONFIG.get('embedding', {})
+RETRIEVAL_CONFIG = CONFIG.get('retrieval', {})
+SUMMARIES_CONFIG = CONFIG.get('summaries', {})
+HTTP_CONFIG = CONFIG.get('http', {})
+DEADLINE_CONFIG = CONFIG.get('deadlines', {})
+TRACING_CONFIG = CONFIG.get('tracing', {})
+PIPELINE_CONFIG = CONFIG.get('pipeline', {})
+COMPARISON_CONFIG = CONFIG.get('comparison', {})
+BUNDLE_CONFIG = CONFIG.get('bundle', {})
+tracing.configure(TRACING_CONFIG)
+PROFILING_CONFIG = CONFIG.get('profiling', {})
 
 # ============================================================
 # FLASK APP
 # ============================================================
 
 app = Flask(__name__)
+app.json = FastJSONProvider(app)  # orjson when installed (see payloads.py)
 CORS(app)
 
-# Global stores
-vector_store = None
-metadata_index = None  # For structured queries
-app_graph = None
+# Content-Encoding negotiation for large responses and prebuilt payloads
+compression_config = HTTP_CONFIG.get('compression', {})
+compressor = Compressor(
+    enabled=compression_config.get('enabled', True),
+    min_bytes=compression_config.get('min_bytes', 1024),
+    gzip_level=compression_config.get('gzip_level', 6),
+    brotli_quality=compression_config.get('brotli_quality', 5)
+)
+PAYLOAD_MAX_AGE = HTTP_CONFIG.get('cache_max_age_seconds', 0)
+
+# Current KnowledgeBase snapshot (chunks, metadata, vectors, graph).
+# Reloads build a new one and swap this reference in a single assignment.
+knowledge_base = None
+
+# Final /api/query responses, keyed by knowledge-base version
+answer_cache_config = CONFIG.get('cache', {}).get('answers', {})
+answer_cache = LRUCache(
+    max_entries=answer_cache_config.get('max_entries', 512) if answer_cache_config.get('enabled', True) else 0,
+    ttl_seconds=answer_cache_config.get('ttl_seconds')
+)
+
+# Ranked (row, score) hits per search query, below the answer cache
+retrieval_cache_config = CONFIG.get('cache', {}).get('retrieval', {})
+retrieval_cache = LRUCache(
+    max_entries=retrieval_cache_config.get('max_entries', 2048) if retrieval_cache_config.get('enabled', True) else 0,
+    ttl_seconds=retrieval_cache_config.get('ttl_seconds')
+)
+
+# Query embeddings by (model, query text); unlike the caches above they stay valid across reloads
+embedding_cache_config = CONFIG.get('cache', {}).get('embeddings', {})
+embedding_cache = LRUCache(
+    max_entries=embedding_cache_config.get('max_entries', 4096) if embedding_cache_config.get('enabled', True) else 0,
+    ttl_seconds=embedding_cache_config.get('ttl_seconds')
+)
+
+# Compact log of /api/query traffic; the cache warmer replays its most asked questions
+query_log_config = CONFIG.get('query_log', {})
+query_log = QueryLog(
+    path=query_log_config.get('path', './logs/queries.jsonl'),
+    max_bytes=query_log_config.get('max_file_bytes', 10 * 1024 * 1024),
+    backups=query_log_config.get('backups', 3)
+) if query_log_config.get('enabled', True) else None
+CACHE_WARMER_CONFIG = CONFIG.get('cache', {}).get('warmer', {})
+
+# Multi-turn conversation state for requests that send a session_id
+session_config = CONFIG.get('sessions', {})
+conversation_sessions = SessionStore(
+    max_sessions=session_config.get('max_sessions', 1000),
+    ttl_seconds=session_config.get('ttl_seconds', 1800)
+)
+
+# Admission control for endpoints that run the LLM pipeline (per process).
+# Cheap endpoints never wait behind these: requests beyond the cap and the
+# short queue are refused at once instead of holding server threads.
+admission_config = CONFIG.get('admission', {})
+admission = AdmissionController(
+    max_concurrent=admission_config.get('max_concurrent', 4) if admission_config.get('enabled', True) else None,
+    max_queue=admission_config.get('max_queue', 4),
+    max_queue_wait_seconds=admission_config.get('max_queue_wait_seconds', 2.0)
+)
+client_limit_config = admission_config.get('per_client', {})
+client_limiter = ClientRateLimiter(
+    requests_per_minute=client_limit_config.get('requests_per_minute', 30),
+    burst=client_limit_config.get('burst'),
+    max_clients=client_limit_config.get('max_clients', 10000)
+) if client_limit_config.get('enabled', False) else None
+
+# On-demand profiles of single admin requests (X-Profile header), see profiling.py
+request_profiler = RequestProfiler(
+    directory=PROFILING_CONFIG.get('directory', './logs/profiles'),
+    max_profiles=PROFILING_CONFIG.get('max_profiles', 50),
+    profiles_per_hour=PROFILING_CONFIG.get('profiles_per_hour', 30),
+    burst=PROFILING_CONFIG.get('burst', 3),
+    sample_interval_ms=PROFILING_CONFIG.get('sample_interval_ms', 5)
+) if PROFILING_CONFIG.get('enabled', True) else None
+
+# Startup progress, reported by /readyz
+startup_state = {
+    "ready": False,
+    "phase": "pending",
+    "error": None,
+    "timings_ms": {}
+}
+
+# The visibility blueprint must be registered before the first request is
+# served; its LLM and vector store are wired in later by initialize().
+try:
+    from visibility_module import visibility_bp, init_visibility
+    app.register_blueprint(visibility_bp)
+except ImportError as e:
+    init_visibility = None
+    print(f"[!] Visibility module not available: {e}")
 
 # ============================================================
 # QUERY TYPES AND STATE
@@ -109,11 +257,31 @@ class QueryType(str, Enum):
     RENEWAL = "renewal"  # "How do I renew my certification?"
 
 
+def merge_extracts(existing: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reducer for comparison_extracts: the per-item nodes each add their item,
+    and nodes that return the whole state write back what is already there
+    """
+    return {**(existing or {}), **(update or {})}
+
+
 class AgenticRAGState(TypedDict):
     """Complete state for the agentic workflow"""
     # Input
     question: str
     filters: Dict[str, str]  # From UI: state, certification, cost, duration
+    pipeline: str  # "full" (analyze → retrieve → generate → critique) or "fused" (one LLM call)
+    fused_fallback: str  # Why a fused answer was handed to the full pipeline ("" = accepted)
+    
+    # Conversation (multi-turn sessions)
+    session_id: str
+    conversation_summary: str  # Rolling, token-capped summary of earlier turns
+    prior_entities: Dict[str, Any]  # Entities resolved in earlier turns
+    previous_retrieval: Optional[Dict[str, Any]]  # Last turn's docs + scores, reused if entities match
+    
+    # Time budget (see remaining_budget)
+    deadline: float  # time.monotonic() by which the response must be ready; 0 = no deadline
+    degraded: List[str]  # Steps skipped or cut short to meet the deadline
     
     # Query Understanding
     query_type: str
@@ -121,7 +289,9 @@ class AgenticRAGState(TypedDict):
     search_queries: List[str]  # Reformulated queries for retrieval
     
     # Retrieval
+    comparison_extracts: Annotated[Dict[str, Dict[str, Any]], merge_extracts]  # Per compared item, see compare_item
     retrieved_docs: List[Document]
+    retrieval_scores: List[float]  # Relevance score of each retrieved doc
     retrieval_strategy: str
     
     # Generation
@@ -139,117 +309,158 @@ class AgenticRAGState(TypedDict):
     reasoning_trace: List[str]  # For debugging/transparency
     sources: List[str]
 
+# ============================================================
+# REQUEST DEADLINES
+# ============================================================
+
+
+def request_deadline(budget_seconds: Optional[float] = None) -> float:
+    """Deadline for a request starting now: its own budget (capped) or deadlines.default_seconds"""
+    if not DEADLINE_CONFIG.get('enabled', True):
+        return 0.0
+    max_seconds = DEADLINE_CONFIG.get('max_seconds', 60)
+    if budget_seconds is None:
+        budget_seconds = DEADLINE_CONFIG.get('default_seconds', 25)
+    return time.monotonic() + max(0.0, min(float(budget_seconds), max_seconds))
+
+
+def remaining_budget(state: AgenticRAGState) -> float:
+    """Seconds left before the request's deadline (infinite without one)"""
+    if not state.get("deadline"):
+        return float("inf")
+    return state["deadline"] - time.monotonic()
+
+
+def step_config(step: str) -> Dict[str, Any]:
+    return DEADLINE_CONFIG.get(step, {})
+
+
+def mark_degraded(state: AgenticRAGState, step: str, reason: str):
+    state["degraded"].append(step)
+    state["reasoning_trace"].append(f"   ⏱️ {step} degraded: {reason} ({max(remaining_budget(state), 0):.1f}s left)")
+
+
+def bounded_llm(llm: ChatOpenAI, state: AgenticRAGState, step: str, max_tokens: Optional[int] = None):
+    """
+    The LLM with a per-call timeout from the remaining budget, capped by the
+    step's timeout_seconds, and optionally a max_tokens limit.
+    """
+    remaining = remaining_budget(state)
+    cap = step_config(step).get('timeout_seconds')
+    timeout = min(remaining, cap) if cap else remaining
+    kwargs = {}
+    if timeout != float("inf"):
+        kwargs["timeout"] = max(timeout, DEADLINE_CONFIG.get('min_llm_timeout_seconds', 1.0))
+    if max_tokens:
+        kwargs["max_tokens"] = max_tokens
+    return llm.bind(**kwargs) if kwargs else llm
+
+
+def is_timeout(error: Exception) -> bool:
+    """Timeouts from the OpenAI SDK, httpx or the standard library"""
+    return isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower()
+
 # ============================================================
 # DOCUMENT LOADING WITH RICH METADATA
 # ============================================================
 
 
-def load_documents() -> tuple[List[Document], Dict[str, Any]]:
+def load_documents() -> tuple[ChunkTable, Dict[str, Any], str]:
     """
     Load markdown and extract both chunks and structured metadata.
-    Returns (documents, metadata_index)
+    Returns (chunk table, metadata_index, corpus fingerprint); see chunk_store.py
     """
     
-    filepath = os.path.join("./data", DATA_FILE)
-    with open(filepath, 'r', encoding='utf-8') as f:
-        content = f.read()
-    
-    # Split by headers for semantic chunking
-    headers_to_split_on = [
-        ("#", "state"),
-        ("##", "certification"),
-        ("###", "section"),
-    ]
-    
-    header_splitter = MarkdownHeaderTextSplitter(
-        headers_to_split_on=headers_to_split_on,
-        strip_headers=False
-    )
-    
-    header_docs = header_splitter.split_text(content)
-    
-    # Further split large chunks
-    text_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
-        separators=["\n\n", "\n", ". ", " "]
+    # Parse and chunk the sources (see ingest.py); unchanged ones come from the ingest cache
+    corpus = ingest_corpus(
+        source_paths("./data", DATA_FILE, DATA_CONFIG.get('source_dir')),
+        CONFIG.get('taxonomies', {}),
+        chunk_size=DATA_CONFIG.get('chunk_size', 1000),
+        chunk_overlap=DATA_CONFIG.get('chunk_overlap', 200),
+        cache_path=INGEST_CACHE_FILE,
+        schema_version=INGEST_SCHEMA_VERSION,
+        workers=DATA_CONFIG.get('ingest_workers', 0),
+        parallel_min_bytes=DATA_CONFIG.get('parallel_min_bytes', 2 * 1024 * 1024)
     )
     
-    all_docs = []
+    table = ChunkTableBuilder()
     metadata_index = {
         "states": set(),
         "certifications": set(),
         "state_certs": {},  # {state: [certs]}
-        "cert_details": {}  # {(state, cert): {cost, duration, requirements}}
+        "cert_details": {},  # {(state, cert): {cost, duration, requirements}}
+        # Canonical ids (see entities.py), the values metadata filters use
+        "state_ids": set(),
+        "cert_ids": set(),
+        "aid_ids": set(),
+        "section_ids": set(),
+        "state_cert_ids": {}  # {state_id: [cert_ids]}
     }
     
-    for doc in header_docs:
-        # Extract metadata from headers
-        state = doc.metadata.get("state", "").replace("# ", "").strip()
-        cert = doc.metadata.get("certification", "").replace("## ", "").strip()
-        section = doc.metadata.get("section", "").replace("### ", "").strip()
-        
-        # Build metadata index
-        if state:
-            metadata_index["states"].add(state)
-            if state not in metadata_index["state_certs"]:
-                metadata_index["state_certs"][state] = set()
-        
-        if cert and state:
-            metadata_index["certifications"].add(cert)
-            metadata_index["state_certs"][state].add(cert)
+    for segment in corpus.segments:
+        for parsed in segment.sections:
+            state = parsed["headers"]["state"]
+            cert = parsed["headers"]["certification"]
+            section = parsed["headers"]["section"]
+            ids = parsed["ids"]
             
-            # Extract structured data from content
-            key = (state, cert)
-            if key not in metadata_index["cert_details"]:
-                metadata_index["cert_details"][key] = {}
+            for field, value in (("state_ids", ids["state_id"]), ("cert_ids", ids["cert_id"]),
+                                 ("aid_ids", ids["aid_id"]), ("section_ids", ids["section_id"])):
+                if value:
+                    metadata_index[field].add(value)
+            if ids["state_id"]:
+                metadata_index["state_cert_ids"].setdefault(ids["state_id"], set())
+                if ids["cert_id"]:
+                    metadata_index["state_cert_ids"][ids["state_id"]].add(ids["cert_id"])
             
-            # Parse cost, duration from content
-            text = doc.page_content.lower()
+            # Build metadata index
+            if state:
+                metadata_index["states"].add(state)
+                if state not in metadata_index["state_certs"]:
+                    metadata_index["state_certs"][state] = set()
             
-            # Cost extraction
-            cost_match = re.search(r'\$[\d,]+(?:\s*-\s*\$[\d,]+)?', doc.page_content)
-            if cost_match:
-                metadata_index["cert_details"][key]["cost"] = cost_match.group()
+            if cert and state:
+                metadata_index["certifications"].add(cert)
+                metadata_index["state_certs"][state].add(cert)
+                # Cost and duration parsed from the section at ingest time
+                metadata_index["cert_details"].setdefault((state, cert), {}).update(parsed["details"])
             
-            # Duration extraction
-            duration_patterns = [
-                r'(\d+)\s*(?:to\s*\d+\s*)?(?:weeks?|months?|hours?)',
-                r'(\d+)-(\d+)\s*(?:weeks?|months?|hours?)'
-            ]
-            for pattern in duration_patterns:
-                duration_match = re.search(pattern, text)
-                if duration_match:
-                    metadata_index["cert_details"][key]["duration"] = duration_match.group()
-                    break
-        
-        # Enrich document metadata
-        doc.metadata.update({
-            "state": state,
-            "certification": cert,
-            "section": section,
-            "source": DATA_FILE
-        })
-        
-        # Split if too large
-        if len(doc.page_content) > 1000:
-            splits = text_splitter.split_documents([doc])
-            all_docs.extend(splits)
-        else:
-            all_docs.append(doc)
+            # Provenance: each chunk is file[byte_start:byte_end] as of source_mtime
+            table.add_section(
+                parsed["text"],
+                {
+                    "state": state,
+                    "certification": cert,
+                    "section": section,
+                    "source": os.path.basename(segment.path),
+                    "source_file": segment.name,
+                    "source_path": segment.path,
+                    **ids
+                },
+                source_start=segment.byte_start + parsed["byte_start"],
+                mtime=segment.mtime,
+                chunks=[(chunk["byte_start"] - parsed["byte_start"], chunk["byte_end"] - parsed["byte_start"],
+                         chunk["tokens"]) for chunk in parsed["chunks"]]
+            )
     
+    all_docs = table.build()
     # Convert sets to lists for JSON serialization
     metadata_index["states"] = list(metadata_index["states"])
     metadata_index["certifications"] = list(metadata_index["certifications"])
     metadata_index["state_certs"] = {k: list(v) for k, v in metadata_index["state_certs"].items()}
+    for field in ("state_ids", "cert_ids", "aid_ids", "section_ids"):
+        metadata_index[field] = sorted(metadata_index[field])
+    metadata_index["state_cert_ids"] = {k: sorted(v) for k, v in metadata_index["state_cert_ids"].items()}
     
     print(f"[*] Loaded {len(all_docs)} chunks")
     print(f"[*] Found {len(metadata_index['states'])} states, {len(metadata_index['certifications'])} cert types")
+    print(f"[*] Canonical ids: states={metadata_index['state_ids']}, certs={metadata_index['cert_ids']}, "
+          f"aid={metadata_index['aid_ids']}")
     
-    return all_docs, metadata_index
+    return all_docs, metadata_index, corpus.fingerprint
 
 
-def build_section_hierarchy(docs):
+def build_section_hierarchy(docs: ChunkTable):
     """
     Build a nested structure:
     {
@@ -262,10 +473,11 @@ def build_section_hierarchy(docs):
     """
     hierarchy = defaultdict(lambda: defaultdict(list))
 
-    for doc in docs:
-        state = doc.metadata.get("state")
-        cert = doc.metadata.get("certification")
-        section = doc.metadata.get("section")
+    # One entry per section rather than per chunk (see chunk_store.py)
+    for i in range(docs.section_count):
+        state = docs.section_value("state", i)
+        cert = docs.section_value("certification", i)
+        section = docs.section_value("section", i)
 
         if state and cert and section:
             clean_state = state.replace("#", "").strip()
@@ -278,37 +490,116 @@ def build_section_hierarchy(docs):
     return hierarchy
 
 
-def create_vectorstore(docs: List[Document]) -> Chroma:
-    """Create or load vectorstore with metadata filtering support"""
+def hnsw_metadata(hnsw_config: Dict[str, Any]) -> Dict[str, Any]:
+    """Chroma collection metadata: cosine space plus the HNSW parameters that are set"""
+    metadata = {"hnsw:space": "cosine"}
+    for key in ("M", "construction_ef", "search_ef"):
+        if hnsw_config.get(key) is not None:
+            metadata[f"hnsw:{key}"] = hnsw_config[key]
+    return metadata
+
+
+def create_vectorstore(docs: ChunkTable, persist_dir: str) -> Chroma:
+    """
+    Create, resume or load the vectorstore for a knowledge-base version.
+    
+    Chunks are streamed through the embedding pipeline (embedding_pipeline.py)
+    in batches, so a build that stops halfway resumes from its checkpoint.
+    Chunks whose text is unchanged since an earlier version reuse their
+    vectors from the shared embedding store instead of being embedded again.
+    """
     
     embeddings = OpenAIEmbeddings(model=OPENAI_EMBED_MODEL)
-    persist_dir = "./chroma_db_v2"
+    client = chromadb.PersistentClient(path=persist_dir)
+    collection_metadata = hnsw_metadata(VECTOR_INDEX_CONFIG.get('hnsw', {}))
+    collection = client.get_or_create_collection("langchain", metadata=collection_metadata)
+    vs = Chroma(
+        client=client,
+        collection_name="langchain",
+        embedding_function=embeddings,
+        collection_metadata=collection_metadata
+    )
     
-    # Always recreate for development - remove this in production
-    if os.path.exists(persist_dir):
+    checkpoint = BuildCheckpoint(os.path.join(persist_dir, "embed_checkpoint.json"), total=len(docs))
+    if not checkpoint.exists and collection.count() == len(docs):
+        # Built before checkpoints existed
+        checkpoint.save(len(docs), complete=True)
+    if checkpoint.complete:
         print("[*] Loading existing vectorstore")
-        vs = Chroma(
-            persist_directory=persist_dir,
-            embedding_function=embeddings,
-            collection_metadata={"hnsw:space": "cosine"}
-        )
-    else:
-        print(f"[*] Creating vectorstore with {len(docs)} documents")
-        vs = Chroma.from_documents(
-            documents=docs,
-            embedding=embeddings,
-            persist_directory=persist_dir,
-            collection_metadata={"hnsw:space": "cosine"}
-        )
+        return vs
+    
+    print(f"[*] Creating vectorstore with {len(docs)} documents")
+    store = None
+    if EMBEDDING_CONFIG.get('reuse_across_versions', True):
+        store = EmbeddingStore(EMBEDDING_STORE_FILE, OPENAI_EMBED_MODEL)
+    pipeline = EmbeddingPipeline(
+        embed=embeddings.embed_documents,
+        upsert=lambda ids, texts, metadatas, vectors: collection.upsert(
+            ids=ids, documents=texts, metadatas=metadatas, embeddings=vectors
+        ),
+        batch_size=EMBEDDING_CONFIG.get('batch_size', 64),
+        concurrency=EMBEDDING_CONFIG.get('concurrency', 4),
+        max_in_flight_batches=EMBEDDING_CONFIG.get('max_in_flight_batches', 8),
+        requests_per_minute=EMBEDDING_CONFIG.get('requests_per_minute'),
+        tokens_per_minute=EMBEDDING_CONFIG.get('tokens_per_minute'),
+        max_retries=EMBEDDING_CONFIG.get('max_retries', 5),
+        store=store
+    )
+    chunks = (
+        (chunk_id, doc.page_content, doc.metadata)
+        for chunk_id, doc in zip(chunk_ids(len(docs)), docs)
+    )
+    try:
+        pipeline.run(chunks, len(docs), checkpoint)
+    finally:
+        if store:
+            store.close()
     
     return vs
 
+
+def create_shared_index(docs: ChunkTable, vs: Chroma, persist_dir: str, version: str) -> ShardedVectorIndex:
+    """
+    Per-state memory-mapped serving copy of the Chroma vectors, shared by all
+    forked workers (with a quantized first-pass copy if configured). Shards
+    unchanged since an earlier version are linked from it, newest first.
+    """
+    earlier = []
+    for name in os.listdir(PERSIST_DIR):
+        try:
+            built_with = bundle.read_json(os.path.join(PERSIST_DIR, name, "version.json"))
+        except (OSError, ValueError):
+            continue
+        if name != version and built_with.get("embed_model") == OPENAI_EMBED_MODEL:
+            earlier.append(os.path.join(PERSIST_DIR, name))
+    earlier.sort(key=os.path.getmtime, reverse=True)
+    return ShardedVectorIndex.from_chroma(
+        vs, docs, persist_dir,
+        embedding_factory=lambda: OpenAIEmbeddings(model=OPENAI_EMBED_MODEL),
+        version=version,
+        max_workers=VECTOR_INDEX_CONFIG.get('max_parallel_shards', 4),
+        reuse_from=earlier,
+        embedding_cache=embedding_cache,
+        **quantization_settings()
+    )
+
+
+def quantization_settings() -> Dict[str, Any]:
+    """ShardedVectorIndex quantization arguments from vector_index.quantization"""
+    quantization_config = VECTOR_INDEX_CONFIG.get('quantization', {})
+    mode = quantization_config.get('mode', 'none')
+    return {
+        "quantization": None if mode in (None, 'none') else mode,
+        "rescore_factor": quantization_config.get('rescore_factor', 4),
+        "min_candidates": quantization_config.get('min_candidates', 32)
+    }
+
 # ============================================================
 # AGENT 1: QUERY ANALYZER
 # ============================================================
 
 
-def create_query_analyzer(llm: ChatOpenAI):
+def create_query_analyzer(llm: ChatOpenAI, metadata_index: Dict[str, Any]):
     """
     Analyzes the user's question to:
     1. Classify query type
@@ -327,6 +618,9 @@ Analyze the user's question and extract:
 Available states: {states}
 Available certifications: {certifications}
 
+If the question is a follow-up (e.g. "what about in West Virginia?"), use the
+conversation so far and the earlier entities to resolve what it refers to.
+
 Respond in JSON format:
 {{
     "query_type": "...",
@@ -340,26 +634,47 @@ Respond in JSON format:
     "search_queries": ["query1", "query2"],
     "reasoning": "brief explanation of your analysis"
 }}"""),
-        ("user", "Question: {question}\nUI Filters: {filters}")
+        ("user", "Conversation so far:\n{history}\nEarlier entities: {prior_entities}\n\n"
+                 "Question: {question}\nUI Filters: {filters}")
     ])
     
     def analyze(state: AgenticRAGState) -> AgenticRAGState:
         state["reasoning_trace"].append("🔍 Analyzing query...")
         
+        # Too little time left for an LLM round trip before the answer: search the question as asked
+        if remaining_budget(state) < step_config('analyze').get('skip_below_seconds', 10):
+            mark_degraded(state, "analyze", "skipped, searching the question as asked")
+            state["query_type"] = "general"
+            state["search_queries"] = [state["question"]]
+            state["extracted_entities"] = dict(state["prior_entities"])
+            for name in ("state", "certification"):
+                if state["filters"].get(name):
+                    state["extracted_entities"][name] = state["filters"][name]
+            return state
+        
         try:
-            chain = analyzer_prompt | llm | JsonOutputParser()
+            chain = analyzer_prompt | bounded_llm(llm, state, "analyze") | JsonOutputParser()
             
             result = chain.invoke({
                 "question": state["question"],
                 "filters": json.dumps(state["filters"]),
-                "states": ", ".join(metadata_index.get("states", [])),
-                "certifications": ", ".join(metadata_index.get("certifications", []))
+                "history": state["conversation_summary"] or "(none)",
+                "prior_entities": json.dumps(state["prior_entities"]),
+                "states": ", ".join(entity_resolver.value("state", s) for s in metadata_index.get("state_ids", [])),
+                "certifications": ", ".join(
+                    entity_resolver.value("cert", c) for c in metadata_index.get("cert_ids", [])
+                )
             })
             
             state["query_type"] = result.get("query_type", "general")
             state["extracted_entities"] = result.get("entities", {})
             state["search_queries"] = result.get("search_queries", [state["question"]])
             
+            # Follow-ups inherit what earlier turns resolved and this one left open
+            for name in ("state", "certification"):
+                if not state["extracted_entities"].get(name) and state["prior_entities"].get(name):
+                    state["extracted_entities"][name] = state["prior_entities"][name]
+            
             # Merge UI filters with extracted entities (UI takes precedence)
             if state["filters"].get("state"):
                 state["extracted_entities"]["state"] = state["filters"]["state"]
@@ -373,10 +688,13 @@ Respond in JSON format:
             
         except Exception as e:
             print(f"[!] Query analysis error: {e}")
+            tracing.record_error(e)
             state["query_type"] = "general"
             state["search_queries"] = [state["question"]]
-            state["extracted_entities"] = {}
+            state["extracted_entities"] = dict(state["prior_entities"])
             state["reasoning_trace"].append(f"   ⚠️ Analysis fallback: {e}")
+            if is_timeout(e):
+                mark_degraded(state, "analyze", "timed out")
         
         return state
     
@@ -387,14 +705,138 @@ Respond in JSON format:
 # ============================================================
 
 
-def create_smart_retriever(vs: Chroma):
+def entity_ids(kind: str, value: Any) -> List[str]:
+    """Canonical ids mentioned in an analyzer entity or UI filter (string or list)"""
+    if isinstance(value, (list, tuple)):
+        value = ", ".join(str(v) for v in value if v)
+    return entity_resolver.resolve_all(kind, value) if value else []
+
+
+def id_condition(field: str, ids: List[str]) -> Dict[str, Any]:
+    return {field: {"$eq": ids[0]}} if len(ids) == 1 else {field: {"$in": ids}}
+
+
+def cutoff_settings(query_type: str) -> Optional[Dict[str, Any]]:
+    """Adaptive-k score cutoff policy for a query type, or None to use the fixed k table"""
+    cutoff_config = RETRIEVAL_CONFIG.get('adaptive_k', {})
+    if not cutoff_config.get('enabled', False):
+        return None
+    settings = {"min_score": 0.25, "relative_drop": 0.25, "min_k": 2, "max_k": 8}
+    settings.update({key: cutoff_config[key] for key in settings if key in cutoff_config})
+    settings.update(cutoff_config.get('query_types', {}).get(query_type, {}))
+    return settings
+
+
+def mmr_settings(query_type: str) -> Optional[Dict[str, Any]]:
+    """MMR lambda, fetch_k and (optionally) k for a query type, or None when MMR is off"""
+    mmr_config = RETRIEVAL_CONFIG.get('mmr', {})
+    if not mmr_config.get('enabled', False):
+        return None
+    settings = {"lambda": 0.7, "fetch_k": 20}
+    settings.update(mmr_config.get('default', {}))
+    settings.update(mmr_config.get('query_types', {}).get(query_type, {}))
+    return settings
+
+
+def cached_search(vs: ShardedVectorIndex, query: str, k: int, where_filter: Optional[Dict[str, Any]],
+                  mmr: Optional[Dict[str, Any]] = None, cutoff: Optional[Dict[str, Any]] = None):
+    """
+    (Document, score) hits for one search, through the retrieval cache, which
+    holds ranked (row, score) pairs per (query, filter, k, index version)
+    """
+    key = (vs.version, normalize_question(query), json.dumps(where_filter, sort_keys=True), k,
+           json.dumps(mmr, sort_keys=True), json.dumps(cutoff, sort_keys=True))
+    with tracing.span("retrieval", query=query, k=k, mmr=mmr is not None, adaptive_k=cutoff is not None,
+                      filter=json.dumps(where_filter, sort_keys=True) if where_filter else None) as span:
+        hits = retrieval_cache.get(key)
+        if span:
+            span.set(cache_hit=hits is not None)
+        if hits is None:
+            if cutoff:
+                hits = vs.search_adaptive(
+                    query, cutoff["min_score"], cutoff["relative_drop"], cutoff["min_k"], cutoff["max_k"],
+                    where_filter,
+                    fetch_k=mmr["fetch_k"] if mmr else 0,
+                    lambda_mult=mmr["lambda"] if mmr else None
+                )
+            elif mmr:
+                hits = vs.search_mmr(query, k, mmr["fetch_k"], mmr["lambda"], where_filter)
+            else:
+                hits = vs.search(query, k, where_filter)
+            retrieval_cache.put(key, hits)
+        if span:
+            span.set(docs=len(hits))
+    return [(vs.docs.document(row), score) for row, score in hits]
+
+
+def entity_filter(state_ids: List[str], cert_ids: List[str]) -> Optional[Dict[str, Any]]:
+    """Chroma-style metadata filter for canonical state and certification ids (None if neither)"""
+    filter_conditions = []
+    if state_ids:
+        filter_conditions.append(id_condition("state_id", state_ids))
+    if cert_ids:
+        # State-wide guides (financial aid programs) have no cert_id and apply to every cert
+        filter_conditions.append({"$or": [id_condition("cert_id", cert_ids), {"cert_id": {"$eq": ""}}]})
+    
+    if len(filter_conditions) == 1:
+        return filter_conditions[0]
+    if len(filter_conditions) > 1:
+        return {"$and": filter_conditions}
+    return None
+
+
+def create_smart_retriever(vs: ShardedVectorIndex, summary_index: Optional[SummaryIndex] = None):
     """
     Multi-strategy retriever that adapts based on query type:
+    - Answers overview questions from the coarsest summary level that matches
+      (state, then program, then section), drilling down to chunks otherwise
     - Uses metadata filtering when state/cert is known
     - Uses multiple queries for comparison questions
     - Adjusts k based on query complexity
+    - Caches ranked results per (query, filter, k, index version), so
+      different questions that reformulate to the same search skip the
+      embedding call and the vector scan
     """
     
+    def summary_search(query: str, where_filter: Optional[Dict[str, Any]], state_ids: List[str],
+                       cert_ids: List[str]):
+        """
+        (level, hits) from the coarsest summary level that covers every
+        requested entity and whose best summary beats the best chunk by
+        summaries.min_margin, or None
+        """
+        min_score = SUMMARIES_CONFIG.get('min_score', 0.35)
+        min_margin = SUMMARIES_CONFIG.get('min_margin', 0.05)
+        max_results = SUMMARIES_CONFIG.get('max_results', 4)
+        # Nothing coarser than what the question names: a named certification starts at program level
+        levels = SUMMARY_LEVELS[1:] if cert_ids else SUMMARY_LEVELS
+        # Every (state, cert) the question names must be covered by some summary
+        required = [(state_id, cert_id) for state_id in state_ids or [None] for cert_id in cert_ids or [None]]
+        with tracing.span("summary_search", query=query,
+                          filter=json.dumps(where_filter, sort_keys=True) if where_filter else None) as span:
+            # A summary only answers when it is a clearly better match than the chunks it summarizes;
+            # otherwise a specific question with no named entity would get a state overview
+            best_chunk = cached_search(vs, query, 1, where_filter)
+            threshold = max(min_score, best_chunk[0][1] + min_margin if best_chunk else min_score)
+            query_vector = vs.embed_query(query)  # Usually an embedding cache hit after the probe
+            for level in levels:
+                hits = [(doc, score) for doc, score in
+                        summary_index.search(query_vector, level, max(max_results, len(required)), where_filter)
+                        if score >= threshold]
+                covered = all(
+                    any((state_id is None or doc.metadata["state_id"] == state_id) and
+                        (cert_id is None or level == "state" or doc.metadata["cert_id"] == cert_id)
+                        for doc, _ in hits)
+                    for state_id, cert_id in required
+                )
+                if hits and covered:
+                    if span:
+                        span.set(level=level, docs=len(hits), threshold=round(threshold, 4))
+                    return level, hits
+            if span:
+                span.set(level=None, threshold=round(threshold, 4))
+        return None
+    
     def retrieve(state: AgenticRAGState) -> AgenticRAGState:
         state["reasoning_trace"].append("📚 Retrieving relevant documents...")
         
@@ -402,21 +844,45 @@ def create_smart_retriever(vs: Chroma):
         entities = state["extracted_entities"]
         search_queries = state["search_queries"]
         
-        all_docs = []
+        # A follow-up about the same thing reuses the previous turn's documents
+        previous = state.get("previous_retrieval")
+        if previous and previous["key"] == retrieval_key(query_type, entities, entity_ids):
+            state["retrieved_docs"] = list(previous["docs"])
+            state["retrieval_scores"] = list(previous["scores"])
+            state["retrieval_strategy"] = f"reused previous turn ({previous['strategy']})"
+            state["reasoning_trace"].append(
+                f"   Reused {len(state['retrieved_docs'])} docs from the previous turn (same entities)"
+            )
+            return state
         
-        # Build metadata filter
-        where_filter = None
-        filter_conditions = []
+        all_docs = []
         
-        if entities.get("state"):
-            filter_conditions.append({"state": {"$eq": entities["state"]}})
-        if entities.get("certification"):
-            filter_conditions.append({"certification": {"$eq": entities["certification"]}})
+        # Filter on canonical ids; entities that resolve to nothing add no condition
+        state_ids = entity_ids("state", entities.get("state"))
+        cert_ids = entity_ids("cert", entities.get("certification"))
+        where_filter = entity_filter(state_ids, cert_ids)
         
-        if len(filter_conditions) == 1:
-            where_filter = filter_conditions[0]
-        elif len(filter_conditions) > 1:
-            where_filter = {"$and": filter_conditions}
+        if summary_index and query_type in SUMMARIES_CONFIG.get('query_types', ["general", "comparison"]):
+            try:
+                summaries = summary_search(search_queries[0] if search_queries else state["question"],
+                                           where_filter, state_ids, cert_ids)
+            except Exception as e:
+                # Same as a search error below: degrade to the chunk drill-down rather than fail the request
+                print(f"[!] Summary search error: {e}")
+                tracing.record_error(e)
+                state["reasoning_trace"].append(f"   ⚠️ Summary search failed ({e}), drilling down to chunks")
+                summaries = False
+            if summaries:
+                level, hits = summaries
+                state["retrieved_docs"] = [doc for doc, _ in hits]
+                state["retrieval_scores"] = [round(score, 4) for _, score in hits]
+                state["retrieval_strategy"] = f"summaries level={level}, filter={where_filter is not None}"
+                state["reasoning_trace"].append(
+                    f"   Answered from {len(hits)} {level} summaries (strategy: {state['retrieval_strategy']})"
+                )
+                return state
+            if summaries is None:
+                state["reasoning_trace"].append("   Summaries did not cover the question, drilling down to chunks")
         
         # Determine k based on query type
         k_values = {
@@ -430,37 +896,56 @@ def create_smart_retriever(vs: Chroma):
         }
         k = k_values.get(query_type, 5)
         
-        # Execute searches
-        for query in search_queries[:3]:  # Max 3 queries
+        # With MMR, a diverse k picked from a larger pool replaces a large k of near-duplicates
+        mmr = mmr_settings(query_type)
+        if mmr:
+            k = mmr.pop("k", k)
+        # With a score cutoff, k follows how many hits are actually relevant
+        cutoff = cutoff_settings(query_type)
+        
+        # Execute searches; with little time left, only the first (best) query
+        search_queries = search_queries[:3]  # Max 3 queries
+        if (len(search_queries) > 1
+                and remaining_budget(state) < step_config('retrieve').get('single_query_below_seconds', 8)):
+            mark_degraded(state, "retrieve", f"searched 1 of {len(search_queries)} queries")
+            search_queries = search_queries[:1]
+        chosen = []
+        for query in search_queries:
             try:
-                if where_filter:
-                    docs = vs.similarity_search(
-                        query,
-                        k=k,
-                        filter=where_filter
-                    )
-                else:
-                    docs = vs.similarity_search(query, k=k)
-                
-                all_docs.extend(docs)
+                docs = cached_search(vs, query, k, where_filter, mmr, cutoff)
                 
             except Exception as e:
                 print(f"[!] Retrieval error for '{query}': {e}")
+                tracing.record_error(e)
                 # Fallback without filter
-                docs = vs.similarity_search(query, k=k)
-                all_docs.extend(docs)
+                docs = cached_search(vs, query, k, None, mmr, cutoff)
+            all_docs.extend(docs)
+            chosen.append(docs)
         
         # Deduplicate while preserving order
         seen = set()
         unique_docs = []
-        for doc in all_docs:
+        scores = []
+        for doc, score in all_docs:
             doc_id = hash(doc.page_content[:200])
             if doc_id not in seen:
                 seen.add(doc_id)
                 unique_docs.append(doc)
+                scores.append(round(score, 4))
         
         state["retrieved_docs"] = unique_docs[:12]  # Cap at 12
+        state["retrieval_scores"] = scores[:12]
         state["retrieval_strategy"] = f"filter={where_filter is not None}, k={k}, queries={len(search_queries)}"
+        if cutoff:
+            state["retrieval_strategy"] = (
+                f"filter={where_filter is not None}, adaptive k={[len(docs) for docs in chosen]} "
+                f"(min_score={cutoff['min_score']}, relative_drop={cutoff['relative_drop']}, "
+                f"k {cutoff['min_k']}-{cutoff['max_k']}), "
+                f"scores={[[round(score, 3) for _, score in docs] for docs in chosen]}, "
+                f"queries={len(search_queries)}"
+            )
+        if mmr:
+            state["retrieval_strategy"] += f", mmr(lambda={mmr['lambda']}, fetch_k={mmr['fetch_k']})"
         
         state["reasoning_trace"].append(
             f"   Retrieved {len(state['retrieved_docs'])} unique docs "
@@ -476,6 +961,21 @@ def create_smart_retriever(vs: Chroma):
 # ============================================================
 
 
+def source_label(doc: Document, index: int) -> str:
+    """'State > Certification > Section' label a document is cited by in prompts and sources"""
+    source_info = [doc.metadata[field] for field in ("state", "certification", "section")
+                   if doc.metadata.get(field)]
+    if doc.metadata.get("level"):
+        source_info.append(f"{doc.metadata['level']} summary")
+    return " > ".join(source_info) if source_info else f"Source {index + 1}"
+
+
+def extractive_answer(docs: List[Document], max_docs: int = 3) -> str:
+    """Answer made of the top documents' leading sentences, for when the LLM is out of time"""
+    excerpts = [first_sentences(doc.page_content, max_chars=400) for doc in docs[:max_docs]]
+    return "Here is the most relevant information I found:\n\n" + "\n\n".join(f"- {e}" for e in excerpts)
+
+
 def create_answer_generator(llm: ChatOpenAI):
     """
     Generates answers that are grounded in retrieved context.
@@ -560,18 +1060,10 @@ Provide a helpful, accurate answer."""
         sources_seen = set()
         
         for i, doc in enumerate(state["retrieved_docs"]):
-            source_info = []
-            if doc.metadata.get("state"):
-                source_info.append(doc.metadata["state"])
-            if doc.metadata.get("certification"):
-                source_info.append(doc.metadata["certification"])
-            if doc.metadata.get("section"):
-                source_info.append(doc.metadata["section"])
-            
-            source_label = " > ".join(source_info) if source_info else f"Source {i+1}"
-            sources_seen.add(source_label)
+            label = source_label(doc, i)
+            sources_seen.add(label)
             
-            context_parts.append(f"[{source_label}]\n{doc.page_content}")
+            context_parts.append(f"[{label}]\n{doc.page_content}")
         
         context = "\n\n---\n\n".join(context_parts)
         
@@ -579,18 +1071,38 @@ Provide a helpful, accurate answer."""
         query_type = state["query_type"]
         prompt_template = prompts.get(query_type, prompts["general"])
         
-        prompt = ChatPromptTemplate.from_messages([
+        messages = [
             ("system", "You are a helpful healthcare certification advisor. "
                       "Answer based ONLY on the provided context. "
-                      "Be accurate, specific, and cite your sources."),
-            ("user", prompt_template)
-        ])
+                      "Be accurate, specific, and cite your sources.")
+        ]
+        if state["conversation_summary"]:
+            messages.append(("system", "Conversation so far (use it only to interpret the question):\n{history}"))
+        messages.append(("user", prompt_template))
+        prompt = ChatPromptTemplate.from_messages(messages)
+        
+        # Fit the answer into the remaining budget: fewer tokens, or no LLM call at all
+        generate_config = step_config('generate')
+        remaining = remaining_budget(state)
+        if remaining < generate_config.get('skip_below_seconds', 2):
+            state["draft_answer"] = extractive_answer(state["retrieved_docs"])
+            state["citations"] = [{"source": s} for s in sources_seen]
+            state["sources"] = list(sources_seen)
+            mark_degraded(state, "generate", "answered with excerpts instead of the LLM")
+            return state
+        max_tokens = generate_config.get('max_tokens')
+        if remaining < generate_config.get('low_budget_seconds', 8):
+            budget_tokens = max(64, int(remaining * generate_config.get('tokens_per_second', 40)))
+            if not max_tokens or budget_tokens < max_tokens:
+                max_tokens = budget_tokens
+                mark_degraded(state, "generate", f"answer capped at {max_tokens} tokens")
         
         try:
-            chain = prompt | llm
+            chain = prompt | bounded_llm(llm, state, "generate", max_tokens)
             response = chain.invoke({
                 "context": context,
-                "question": state["question"]
+                "question": state["question"],
+                "history": state["conversation_summary"]
             })
             
             state["draft_answer"] = response.content
@@ -604,6 +1116,13 @@ Provide a helpful, accurate answer."""
             
         except Exception as e:
             print(f"[!] Generation error: {e}")
+            tracing.record_error(e)
+            if is_timeout(e):
+                state["draft_answer"] = extractive_answer(state["retrieved_docs"])
+                state["citations"] = [{"source": s} for s in sources_seen]
+                state["sources"] = list(sources_seen)
+                mark_degraded(state, "generate", "timed out, answered with excerpts")
+                return state
             state["draft_answer"] = "I encountered an error generating the answer. Please try again."
             state["reasoning_trace"].append(f"   ❌ Generation error: {e}")
         
@@ -662,10 +1181,19 @@ Evaluate this answer.""")
         
         state["reasoning_trace"].append("🔎 Self-critique validation...")
         
+        # Validation is the first thing to go when the budget runs low
+        base_confidence = len(state["retrieved_docs"]) / 12  # Max docs = 12
+        if remaining_budget(state) < step_config('critique').get('skip_below_seconds', 5):
+            state["is_grounded"] = True
+            state["critique"] = "Skipped (time budget)"
+            state["confidence"] = round(min(base_confidence * 0.8, 1.0), 2)
+            mark_degraded(state, "critique", "skipped")
+            return state
+        
         try:
             context = "\n\n".join([doc.page_content for doc in state["retrieved_docs"][:5]])
             
-            chain = critique_prompt | llm | JsonOutputParser()
+            chain = critique_prompt | bounded_llm(llm, state, "critique") | JsonOutputParser()
             result = chain.invoke({
                 "context": context,
                 "question": state["question"],
@@ -677,7 +1205,6 @@ Evaluate this answer.""")
             state["missing_info"] = result.get("missing_info", [])
             
             # Adjust confidence based on critique
-            base_confidence = len(state["retrieved_docs"]) / 12  # Max docs = 12
             critique_factor = result.get("confidence_adjustment", 0.8)
             state["confidence"] = round(min(base_confidence * critique_factor, 1.0), 2)
             
@@ -688,9 +1215,12 @@ Evaluate this answer.""")
             
         except Exception as e:
             print(f"[!] Critique error: {e}")
+            tracing.record_error(e)
             state["is_grounded"] = True
             state["confidence"] = 0.5
             state["reasoning_trace"].append(f"   ⚠️ Critique fallback: {e}")
+            if is_timeout(e):
+                mark_degraded(state, "critique", "timed out")
         
         return state
     
@@ -734,12 +1264,460 @@ def create_response_synthesizer(llm: ChatOpenAI):
     
     return synthesize
 
+# ============================================================
+# AGENT 6: FUSED ANALYZE-AND-ANSWER (LOW-LATENCY TIER)
+# ============================================================
+
+
+PIPELINE_MODES = ("full", "fused")
+
+
+def prepare_fused_retrieval(state: AgenticRAGState) -> AgenticRAGState:
+    """Search the question as asked, filtered by the UI filters and earlier turns' entities"""
+    state["reasoning_trace"].append("⚡ Fused mode: searching the question as asked")
+    state["query_type"] = "general"
+    state["search_queries"] = [state["question"]]
+    state["extracted_entities"] = dict(state["prior_entities"])
+    for name in ("state", "certification"):
+        if state["filters"].get(name):
+            state["extracted_entities"][name] = state["filters"][name]
+    return state
+
+
+def create_fused_answerer(llm: ChatOpenAI, metadata_index: Dict[str, Any]):
+    """
+    One structured call that classifies the question, extracts its entities,
+    answers from the retrieved context and grades its own grounding, in
+    place of the analyzer, generator and critique calls.
+
+    The answer is handed to the full pipeline (state["fused_fallback"] says
+    why) when the question names several states or certifications, is a
+    comparison, or the self-assessed confidence is below
+    pipeline.fused.min_confidence.
+    """
+    fused_config = PIPELINE_CONFIG.get('fused', {})
+    
+    fused_prompt = ChatPromptTemplate.from_messages([
+        ("system", """You are a helpful healthcare certification advisor.
+Answer based ONLY on the provided context. Be accurate, specific, and cite your sources.
+
+Available states: {states}
+Available certifications: {certifications}
+
+Respond in JSON format:
+{{
+    "query_type": "one of [comparison, requirements, cost_duration, process, general, study_material, renewal]",
+    "entities": {{
+        "state": ["every state the question asks about"],
+        "certification": ["every certification the question asks about"]
+    }},
+    "answer": "the answer, using only the context",
+    "is_grounded": true/false (is every claim in the answer supported by the context?),
+    "missing_info": ["information the context lacks to answer fully"],
+    "confidence": 0.0 to 1.0 (how well the context answers the question)
+}}"""),
+        ("user", "Conversation so far:\n{history}\n\nContext:\n{context}\n\n"
+                 "Question: {question}\nUI Filters: {filters}")
+    ])
+    
+    # Below this the full pipeline's analyzer would be skipped anyway, so falling back could only
+    # trade the fused answer for a search of the question as asked
+    fallback_min_seconds = max(fused_config.get('fallback_min_seconds', 10),
+                               step_config('analyze').get('skip_below_seconds', 10))
+    
+    def fall_back(state: AgenticRAGState, reason: str) -> AgenticRAGState:
+        # Not worth starting three more LLM calls that the deadline would cut short anyway
+        if remaining_budget(state) < fallback_min_seconds:
+            if not state["draft_answer"]:
+                state["draft_answer"] = extractive_answer(state["retrieved_docs"])
+            mark_degraded(state, "fused", f"kept the fused answer ({reason}), no time for the full pipeline")
+            return state
+        state["fused_fallback"] = reason
+        state["reasoning_trace"].append(f"   ↪️ Falling back to the full pipeline: {reason}")
+        return state
+    
+    def answer(state: AgenticRAGState) -> AgenticRAGState:
+        state["reasoning_trace"].append("⚡ Analyzing and answering in one call...")
+        
+        if not state["retrieved_docs"]:
+            state["fused_fallback"] = "no documents for the question as asked"
+            state["reasoning_trace"].append(f"   ↪️ Falling back to the full pipeline: {state['fused_fallback']}")
+            return state
+        
+        context_parts = []
+        sources_seen = set()
+        for i, doc in enumerate(state["retrieved_docs"]):
+            label = source_label(doc, i)
+            sources_seen.add(label)
+            context_parts.append(f"[{label}]\n{doc.page_content}")
+        
+        try:
+            chain = (fused_prompt
+                     | bounded_llm(llm, state, "fused", fused_config.get('max_tokens', 1024))
+                     | JsonOutputParser())
+            result = chain.invoke({
+                "context": "\n\n---\n\n".join(context_parts),
+                "question": state["question"],
+                "filters": json.dumps(state["filters"]),
+                "history": state["conversation_summary"] or "(none)",
+                "states": ", ".join(entity_resolver.value("state", s) for s in metadata_index.get("state_ids", [])),
+                "certifications": ", ".join(
+                    entity_resolver.value("cert", c) for c in metadata_index.get("cert_ids", [])
+                )
+            })
+        except Exception as e:
+            print(f"[!] Fused answer error: {e}")
+            tracing.record_error(e)
+            state["reasoning_trace"].append(f"   ⚠️ Fused answer failed: {e}")
+            if is_timeout(e) and remaining_budget(state) < fallback_min_seconds:
+                state["draft_answer"] = extractive_answer(state["retrieved_docs"])
+                state["citations"] = [{"source": s} for s in sources_seen]
+                state["sources"] = list(sources_seen)
+                mark_degraded(state, "fused", "timed out, answered with excerpts")
+                return state
+            state["fused_fallback"] = f"fused call failed ({type(e).__name__})"
+            return state
+        
+        entities = result.get("entities") or {}
+        state["query_type"] = result.get("query_type", "general")
+        for name, value in entities.items():
+            # One-item lists read like the analyzer's single values
+            if isinstance(value, list):
+                value = [v for v in value if v]
+                value = value[0] if len(value) == 1 else value
+            if value:
+                state["extracted_entities"][name] = value
+        # UI filters take precedence, as in the analyzer
+        for name in ("state", "certification"):
+            if state["filters"].get(name):
+                state["extracted_entities"][name] = state["filters"][name]
+        
+        state["draft_answer"] = result.get("answer") or ""
+        state["citations"] = [{"source": s} for s in sources_seen]
+        state["sources"] = list(sources_seen)
+        state["is_grounded"] = bool(result.get("is_grounded", False))
+        state["missing_info"] = result.get("missing_info", [])
+        state["critique"] = "Self-assessed in the fused call"
+        try:
+            self_confidence = min(max(float(result.get("confidence", 0.0)), 0.0), 1.0)
+        except (TypeError, ValueError):
+            self_confidence = 0.0
+        # Same scale as the critique step: more supporting documents, more confidence
+        state["confidence"] = round(min(len(state["retrieved_docs"]) / 12 * self_confidence, 1.0), 2)
+        
+        state["reasoning_trace"].append(
+            f"   Query type: {state['query_type']}, Entities: {state['extracted_entities']}, "
+            f"Grounded: {state['is_grounded']}, Self-assessed confidence: {self_confidence}"
+        )
+        
+        state_ids = entity_ids("state", state["extracted_entities"].get("state"))
+        cert_ids = entity_ids("cert", state["extracted_entities"].get("certification"))
+        if state["query_type"] == "comparison" or len(state_ids) > 1 or len(cert_ids) > 1:
+            return fall_back(state, "comparison or several entities")
+        if not state["draft_answer"]:
+            return fall_back(state, "empty answer")
+        if not state["is_grounded"] or self_confidence < fused_config.get('min_confidence', 0.7):
+            return fall_back(state, f"grounded={state['is_grounded']}, confidence={self_confidence}")
+        return state
+    
+    return answer
+
+
+def choose_pipeline(state: AgenticRAGState) -> str:
+    return "fused_retrieve" if state.get("pipeline") == "fused" else "analyze"
+
+
+def after_fused(state: AgenticRAGState) -> str:
+    return "analyze" if state["fused_fallback"] else "synthesize"
+
+# ============================================================
+# AGENT 7: PER-ITEM COMPARISON (FAN-OUT)
+# ============================================================
+
+
+COMPARISON_FIELDS = ("requirements", "cost", "duration", "salary", "notes")
+
+
+class ComparisonItemTask(TypedDict):
+    """Input of one compare_item run (sent by fan_out_comparison)"""
+    question: str
+    item: str
+    order: int
+    state_ids: List[str]
+    cert_ids: List[str]
+    deadline: float
+
+
+def comparison_tasks(state: AgenticRAGState) -> List[ComparisonItemTask]:
+    """
+    One task per compared item, scoped by the state or certification the item
+    names and otherwise by the question's shared entity ("CNA vs HHA in
+    Tennessee": cert per item, Tennessee for both). Empty unless the analyzer
+    found a comparison of at least two items.
+    """
+    entities = state["extracted_entities"]
+    if not COMPARISON_CONFIG.get('fan_out', True) or state["query_type"] != "comparison":
+        return []
+    items = entities.get("comparison_items") or []
+    if isinstance(items, str):
+        items = [items]
+    names = list(dict.fromkeys(str(item).strip() for item in items if item and str(item).strip()))
+    names = names[:COMPARISON_CONFIG.get('max_items', 4)]
+    if len(names) < 2:
+        return []
+    
+    shared_state_ids = entity_ids("state", entities.get("state"))
+    shared_cert_ids = entity_ids("cert", entities.get("certification"))
+    return [{
+        "question": state["question"],
+        "item": name,
+        "order": order,
+        "state_ids": entity_ids("state", name) or shared_state_ids,
+        "cert_ids": entity_ids("cert", name) or shared_cert_ids,
+        "deadline": state["deadline"]
+    } for order, name in enumerate(names)]
+
+
+def fan_out_comparison(state: AgenticRAGState):
+    """After analyze: a compare_item run per compared item (concurrently), or the single retrieve"""
+    tasks = comparison_tasks(state)
+    if not tasks:
+        return "retrieve"
+    return [Send("compare_item", task) for task in tasks]
+
+
+def create_item_extractor(llm: ChatOpenAI, vs: ShardedVectorIndex):
+    """
+    Retrieval and a compact structured extraction for one compared item, so
+    each side of a comparison gets its own filtered search instead of sharing
+    one merged search that may be dominated by the other.
+    """
+    k = COMPARISON_CONFIG.get('k_per_item', 5)
+    
+    extract_prompt = ChatPromptTemplate.from_messages([
+        ("system", """You extract facts about one item of a healthcare certification comparison.
+Use ONLY the provided context. Keep every value short; use null or [] when the context does not say.
+
+Respond in JSON format:
+{{
+    "requirements": ["each requirement, e.g. training hours, exam, background check"],
+    "cost": "total cost or range, or null",
+    "duration": "how long it takes, or null",
+    "salary": "pay or salary range, or null",
+    "notes": ["other facts the question asks about"]
+}}"""),
+        ("user", "Question: {question}\nItem: {item}\n\nContext:\n{context}")
+    ])
+    
+    def excerpts(docs: List[Document]) -> List[str]:
+        return [first_sentences(doc.page_content, max_chars=300) for doc in docs[:2]]
+    
+    def extract(task: ComparisonItemTask) -> Dict[str, Any]:
+        item = task["item"]
+        where_filter = entity_filter(task["state_ids"], task["cert_ids"])
+        query = f"{item} requirements, cost, training duration and salary"
+        try:
+            hits = cached_search(vs, query, k, where_filter)
+        except Exception as e:
+            print(f"[!] Retrieval error for comparison item '{item}': {e}")
+            tracing.record_error(e)
+            hits = cached_search(vs, query, k, None)
+        
+        docs = [doc for doc, _ in hits]
+        extract = {
+            "item": item, "order": task["order"],
+            "requirements": [], "cost": None, "duration": None, "salary": None, "notes": [],
+            "docs": docs, "scores": [round(score, 4) for _, score in hits],
+            "filtered": where_filter is not None, "degraded": "", "error": ""
+        }
+        
+        if docs and remaining_budget(task) < step_config('compare_item').get('skip_below_seconds', 4):
+            extract["notes"] = excerpts(docs)
+            extract["degraded"] = "excerpts instead of extraction"
+        elif docs:
+            context = "\n\n---\n\n".join(f"[{source_label(doc, i)}]\n{doc.page_content}"
+                                         for i, doc in enumerate(docs))
+            try:
+                chain = (extract_prompt
+                         | bounded_llm(llm, task, "compare_item", COMPARISON_CONFIG.get('extract_max_tokens', 400))
+                         | JsonOutputParser())
+                result = chain.invoke({"question": task["question"], "item": item, "context": context})
+                for field in ("requirements", "notes"):
+                    values = result.get(field) or []
+                    extract[field] = [str(v) for v in values if v] if isinstance(values, list) else [str(values)]
+                for field in ("cost", "duration", "salary"):
+                    extract[field] = str(result[field]) if result.get(field) else None
+            except Exception as e:
+                print(f"[!] Extraction error for comparison item '{item}': {e}")
+                tracing.record_error(e)
+                extract["notes"] = excerpts(docs)
+                if is_timeout(e):
+                    extract["degraded"] = "timed out, excerpts instead"
+                else:
+                    extract["error"] = f"extraction failed ({type(e).__name__}), excerpts instead"
+        
+        return {"comparison_extracts": {item: extract}}
+    
+    return extract
+
+
+def format_extracts(extracts: List[Dict[str, Any]]) -> str:
+    """Plain comparison written from the extracts, for when the LLM is out of time"""
+    labels = {"requirements": "Requirements", "cost": "Cost", "duration": "Duration",
+              "salary": "Salary", "notes": "Notes"}
+    sections = []
+    for extract in extracts:
+        lines = [f"**{extract['item']}**"]
+        for field in COMPARISON_FIELDS:
+            value = extract[field]
+            if isinstance(value, list):
+                value = "; ".join(value)
+            lines.append(f"- {labels[field]}: {value or 'not found in the sources'}")
+        sections.append("\n".join(lines))
+    return "Here is how they compare, from the sources I found:\n\n" + "\n\n".join(sections)
+
+
+def create_comparer(llm: ChatOpenAI):
+    """
+    Writes the comparison from the per-item extracts, and gathers the items'
+    documents (interleaved, so each item is represented) for critique and
+    sources.
+    """
+    
+    compare_template = """Compare the following items using the facts extracted for each one from the sources.
+Create a clear comparison covering: requirements, cost, duration, and career outlook.
+Use a structured format with clear sections for each item being compared.
+When a fact is null or missing for an item, say the sources do not cover it.
+
+Extracted facts (JSON):
+{extracts}
+
+Question: {question}"""
+    
+    def compare(state: AgenticRAGState) -> AgenticRAGState:
+        extracts = sorted(state["comparison_extracts"].values(), key=lambda extract: extract["order"])
+        state["reasoning_trace"].append(f"⚖️ Comparing {len(extracts)} items from per-item extracts...")
+        for extract in extracts:
+            facts = sum(1 for field in COMPARISON_FIELDS if extract[field])
+            state["reasoning_trace"].append(
+                f"   {extract['item']}: {len(extract['docs'])} docs (filter={extract['filtered']}), "
+                f"{facts} of {len(COMPARISON_FIELDS)} fields found"
+            )
+            if extract["degraded"]:
+                mark_degraded(state, "compare_item", f"{extract['item']}: {extract['degraded']}")
+            elif extract["error"]:
+                state["reasoning_trace"].append(f"   ⚠️ {extract['item']}: {extract['error']}")
+        
+        # Round-robin over the items, so the first item's documents do not crowd out the rest
+        seen = set()
+        docs, scores = [], []
+        for rank in range(max((len(extract["docs"]) for extract in extracts), default=0)):
+            for extract in extracts:
+                if rank < len(extract["docs"]):
+                    doc = extract["docs"][rank]
+                    doc_id = hash(doc.page_content[:200])
+                    if doc_id not in seen:
+                        seen.add(doc_id)
+                        docs.append(doc)
+                        scores.append(extract["scores"][rank])
+        state["retrieved_docs"] = docs[:12]
+        state["retrieval_scores"] = scores[:12]
+        state["retrieval_strategy"] = (
+            f"comparison fan-out: {len(extracts)} items, k={COMPARISON_CONFIG.get('k_per_item', 5)} each, "
+            f"filtered={[extract['filtered'] for extract in extracts]}"
+        )
+        
+        if not docs:
+            state["draft_answer"] = "I couldn't find relevant information to answer your question. Please try rephrasing or being more specific about the state or certification you're interested in."
+            state["citations"] = []
+            state["reasoning_trace"].append("   ⚠️ No documents retrieved")
+            return state
+        
+        sources = list(dict.fromkeys(source_label(doc, i) for i, doc in enumerate(docs)))
+        state["citations"] = [{"source": s} for s in sources]
+        state["sources"] = sources
+        
+        if remaining_budget(state) < step_config('generate').get('skip_below_seconds', 2):
+            state["draft_answer"] = format_extracts(extracts)
+            mark_degraded(state, "compare", "answered with the extracts instead of the LLM")
+            return state
+        
+        facts = [{"item": extract["item"], **{field: extract[field] for field in COMPARISON_FIELDS}}
+                 for extract in extracts]
+        messages = [
+            ("system", "You are a helpful healthcare certification advisor. "
+                       "Answer based ONLY on the extracted facts. Be accurate and specific.")
+        ]
+        if state["conversation_summary"]:
+            messages.append(("system", "Conversation so far (use it only to interpret the question):\n{history}"))
+        messages.append(("user", compare_template))
+        prompt = ChatPromptTemplate.from_messages(messages)
+        try:
+            chain = prompt | bounded_llm(llm, state, "compare", COMPARISON_CONFIG.get('compare_max_tokens', 1024))
+            response = chain.invoke({
+                "extracts": json.dumps(facts, indent=1, ensure_ascii=False),
+                "question": state["question"],
+                "history": state["conversation_summary"]
+            })
+            state["draft_answer"] = response.content
+            state["reasoning_trace"].append(
+                f"   Generated {len(state['draft_answer'])} char comparison with {len(sources)} sources"
+            )
+        except Exception as e:
+            print(f"[!] Comparison error: {e}")
+            tracing.record_error(e)
+            state["draft_answer"] = format_extracts(extracts)
+            if is_timeout(e):
+                mark_degraded(state, "compare", "timed out, answered with the extracts")
+            else:
+                state["reasoning_trace"].append(f"   ⚠️ Comparison fallback to the extracts: {e}")
+        
+        return state
+    
+    return compare
+
 # ============================================================
 # BUILD THE AGENTIC GRAPH
 # ============================================================
 
 
-def create_agentic_graph(vs: Chroma) -> StateGraph:
+def comparison_item_attributes(update: Dict[str, Any]) -> Dict[str, Any]:
+    # compare_item returns only its own extract, not the whole state
+    extract = next(iter(update["comparison_extracts"].values()))
+    return {"item": extract["item"], "docs": len(extract["docs"]), "filtered": extract["filtered"],
+            "fields": sum(1 for field in COMPARISON_FIELDS if extract[field])}
+
+
+# What each node's span records from the state it returns
+NODE_SPAN_ATTRIBUTES = {
+    "analyze": lambda state: {"query_type": state["query_type"], "search_queries": len(state["search_queries"])},
+    "retrieve": lambda state: {"docs": len(state["retrieved_docs"]), "strategy": state["retrieval_strategy"]},
+    "generate": lambda state: {"answer_chars": len(state["draft_answer"]), "sources": len(state["sources"])},
+    "critique": lambda state: {"grounded": state["is_grounded"], "confidence": state["confidence"]},
+    "synthesize": lambda state: {"confidence": state["confidence"]},
+    "fused_retrieve": lambda state: {"docs": len(state["retrieved_docs"]), "strategy": state["retrieval_strategy"]},
+    "fused": lambda state: {"query_type": state["query_type"], "confidence": state["confidence"],
+                            "fallback": state["fused_fallback"] or None},
+    "compare_item": lambda update: comparison_item_attributes(update),
+    "compare": lambda state: {"items": len(state["comparison_extracts"]), "docs": len(state["retrieved_docs"]),
+                              "answer_chars": len(state["draft_answer"])}
+}
+
+
+def traced_node(name: str, node):
+    """A graph node wrapped in a span carrying a few attributes of its result"""
+    def run(state: AgenticRAGState) -> AgenticRAGState:
+        with tracing.span(f"node.{name}") as span:
+            state = node(state)
+            if span:
+                span.set(**NODE_SPAN_ATTRIBUTES.get(name, lambda _: {})(state))
+                span.set(degraded=name in state.get("degraded", []))
+            return state
+    return run
+
+
+def create_agentic_graph(vs: ShardedVectorIndex, metadata_index: Dict[str, Any],
+                         summary_index: Optional[SummaryIndex] = None) -> StateGraph:
     """
     Build the complete agentic RAG workflow.
     
@@ -749,30 +1727,57 @@ def create_agentic_graph(vs: Chroma) -> StateGraph:
     3. Answer Generator → Create grounded answer
     4. Self-Critique → Validate answer (optional)
     5. Response Synthesizer → Final formatting
+    
+    In fused mode (state["pipeline"]), retrieval on the question as asked and
+    one fused call replace steps 1-4; answers it is unsure of continue at 1.
+    
+    Comparisons of two or more items fan out after step 1: every item gets
+    its own retrieval and extraction (compare_item, run concurrently), and
+    one compare step writes the answer from the extracts in place of 2-3.
     """
     
-    llm = ChatOpenAI(model=OPENAI_CHAT_MODEL, temperature=0)
+    # Retries would restart a call with a fresh timeout, past the request deadline
+    llm = ChatOpenAI(
+        model=OPENAI_CHAT_MODEL, temperature=0,
+        max_retries=DEADLINE_CONFIG.get('llm_max_retries', 0) if DEADLINE_CONFIG.get('enabled', True) else 2
+    )
     
     # Create all agents
-    query_analyzer = create_query_analyzer(llm)
-    smart_retriever = create_smart_retriever(vs)
+    query_analyzer = create_query_analyzer(llm, metadata_index)
+    smart_retriever = create_smart_retriever(vs, summary_index)
     answer_generator = create_answer_generator(llm)
     self_critique = create_self_critique(llm)
     response_synthesizer = create_response_synthesizer(llm)
+    fused_answerer = create_fused_answerer(llm, metadata_index)
+    item_extractor = create_item_extractor(llm, vs)
+    comparer = create_comparer(llm)
     
     # Build graph
     workflow = StateGraph(AgenticRAGState)
     
     # Add nodes
-    workflow.add_node("analyze", query_analyzer)
-    workflow.add_node("retrieve", smart_retriever)
-    workflow.add_node("generate", answer_generator)
-    workflow.add_node("critique", self_critique)
-    workflow.add_node("synthesize", response_synthesizer)
-    
-    # Define edges (linear flow for now, can add conditionals later)
-    workflow.set_entry_point("analyze")
-    workflow.add_edge("analyze", "retrieve")
+    workflow.add_node("analyze", traced_node("analyze", query_analyzer))
+    workflow.add_node("retrieve", traced_node("retrieve", smart_retriever))
+    workflow.add_node("generate", traced_node("generate", answer_generator))
+    workflow.add_node("critique", traced_node("critique", self_critique))
+    workflow.add_node("synthesize", traced_node("synthesize", response_synthesizer))
+    workflow.add_node("fused_retrieve", traced_node(
+        "fused_retrieve", lambda state: smart_retriever(prepare_fused_retrieval(state))
+    ))
+    workflow.add_node("fused", traced_node("fused", fused_answerer))
+    workflow.add_node("compare_item", traced_node("compare_item", item_extractor))
+    workflow.add_node("compare", traced_node("compare", comparer))
+    
+    # Define edges: the full pipeline is linear; fused mode rejoins it at
+    # synthesize, or at analyze when its answer is not good enough.
+    # Comparisons fan out to one compare_item per item, and compare runs
+    # once all of them are done
+    workflow.set_conditional_entry_point(choose_pipeline, ["analyze", "fused_retrieve"])
+    workflow.add_edge("fused_retrieve", "fused")
+    workflow.add_conditional_edges("fused", after_fused, ["analyze", "synthesize"])
+    workflow.add_conditional_edges("analyze", fan_out_comparison, ["retrieve", "compare_item"])
+    workflow.add_edge("compare_item", "compare")
+    workflow.add_edge("compare", "critique")
     workflow.add_edge("retrieve", "generate")
     workflow.add_edge("generate", "critique")
     workflow.add_edge("critique", "synthesize")
@@ -785,6 +1790,14 @@ def create_agentic_graph(vs: Chroma) -> StateGraph:
 # ============================================================
 
 
+def not_ready_response():
+    """503 for endpoints that need the knowledge base before it is loaded"""
+    return jsonify({
+        "error": "System not initialized",
+        "phase": startup_state["phase"]
+    }), 503
+
+
 @app.route('/')
 def index():
     """Health check"""
@@ -796,21 +1809,119 @@ def index():
     })
 
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """Liveness: the process is up and serving requests"""
+    return jsonify({"status": "ok"})
+
+
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    """Readiness: the knowledge base, vector store and agent graph are loaded"""
+    body = {
+        "status": "ready" if startup_state["ready"] else ("failed" if startup_state["error"] else "starting"),
+        "phase": startup_state["phase"],
+        "timings_ms": startup_state["timings_ms"],
+        "pid": os.getpid()  # Which worker answered, under a multi-worker server
+    }
+    if startup_state["error"]:
+        body["error"] = startup_state["error"]
+    return jsonify(body), 200 if startup_state["ready"] else 503
+
+
+@app.before_request
+def start_request_span():
+    """Root span of the request's trace; its trace id is the request id"""
+    if request.path in TRACING_CONFIG.get('exclude_paths', ['/healthz', '/readyz']):
+        return
+    incoming = request.headers.get("X-Request-ID", "")
+    trace_id = incoming.lower() if re.fullmatch(r"[0-9a-fA-F]{32}", incoming) else None
+    g.trace_span = tracing.tracer.start(
+        f"{request.method} {request.path}", trace_id=trace_id,
+        method=request.method, path=request.path, endpoint=request.endpoint
+    )
+
+
+def admin_token_matches() -> bool:
+    """
+    True if ADMIN_TOKEN is set and the request's X-Admin-Token equals it
+    (compared in constant time). The one check behind every admin-only feature.
+    """
+    token = os.environ.get("ADMIN_TOKEN")
+    supplied = request.headers.get("X-Admin-Token", "")
+    return bool(token) and hmac.compare_digest(supplied.encode(), token.encode())
+
+
+@app.before_request
+def start_request_profile():
+    """Profile this request if an admin asked for it (X-Profile: cprofile|sample or ?profile=)"""
+    mode = request.headers.get("X-Profile") or request.args.get("profile")
+    if not mode or request_profiler is None:
+        return
+    if not admin_token_matches():
+        return
+    if mode not in PROFILE_MODES:
+        g.profile_status = "unknown-mode"
+        return
+    span = g.get("trace_span")
+    profile = request_profiler.start(span.trace_id if span else os.urandom(8).hex(), mode)
+    if profile is None:
+        g.profile_status = "rate-limited"
+        return
+    g.profile = profile
+    g.profile_status = profile.name + (".pstats" if mode == "cprofile" else ".collapsed")
+
+
+@app.after_request
+def add_request_id(response):
+    span = g.get("trace_span")
+    if span:
+        span.set(status=response.status_code, response_bytes=response.calculate_content_length())
+        response.headers["X-Request-ID"] = span.trace_id
+    if g.get("profile_status"):
+        response.headers["X-Profile"] = g.profile_status
+    return response
+
+
+@app.teardown_request
+def end_request_span(error=None):
+    span = g.pop("trace_span", None)
+    if span:
+        tracing.tracer.end(span, error)
+
+
+@app.teardown_request
+def end_request_profile(error=None):
+    # Teardown runs in reverse order, so the profile stops before the root span ends
+    profile = g.pop("profile", None)
+    if profile:
+        request_profiler.finish(profile, f"{request.method} {request.full_path.rstrip('?')}")
+
+
+@app.after_request
+def compress_response(response):
+    """gzip/brotli for large JSON and text responses the client accepts"""
+    return compressor.compress_response(request, response)
+
+
+# The config never changes at runtime, so it is serialized once
+config_payload = Payload({
+    'product': CONFIG.get('product', {}),
+    'branding': CONFIG.get('branding', {}),
+    'features': CONFIG.get('features', {}),
+    'sample_questions': CONFIG.get('sample_questions', {})
+}, compressor, PAYLOAD_MAX_AGE)
+
+
 @app.route('/api/config', methods=['GET'])
 def get_config():
     """Return public config for frontend"""
-    return jsonify({
-        'product': CONFIG.get('product', {}),
-        'branding': CONFIG.get('branding', {}),
-        'features': CONFIG.get('features', {}),
-        'sample_questions': CONFIG.get('sample_questions', {})
-    })
+    return config_payload.response(request)
 
 
-@app.route('/api/taxonomies', methods=['GET', 'POST'])
-def get_taxonomies():
-    """Return taxonomies - now includes discovered metadata"""
-    taxonomies = CONFIG.get('taxonomies', {}).copy()
+def taxonomies_payload(metadata_index: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Configured taxonomies plus the states and certifications found in the data"""
+    taxonomies = dict(CONFIG.get('taxonomies', {}))
     
     # Enhance with discovered metadata
     if metadata_index:
@@ -821,63 +1932,249 @@ def get_taxonomies():
         if metadata_index.get("state_certs"):
             taxonomies["state_certifications"] = metadata_index["state_certs"]
     
-    return jsonify(taxonomies)
+    return taxonomies
+
+
+@app.route('/api/taxonomies', methods=['GET', 'POST'])
+def get_taxonomies():
+    """Return taxonomies - now includes discovered metadata"""
+    kb = knowledge_base
+    if kb is None:
+        return jsonify(taxonomies_payload(None))
+    return kb.payloads["taxonomies"].response(request)
+
+
+def summarize_turn(summary: str, question: str, answer: str) -> str:
+    """Roll the latest turn into a session summary capped at sessions.summary_max_tokens"""
+    max_tokens = session_config.get('summary_max_tokens', 300)
+    if session_config.get('summary_mode', 'extractive') == 'llm':
+        try:
+            llm = ChatOpenAI(model=OPENAI_CHAT_MODEL, temperature=0, max_tokens=max_tokens)
+            prompt = ChatPromptTemplate.from_messages([
+                ("system", "Update the running summary of a conversation about healthcare certifications. "
+                           "Keep the states, certifications and facts the user cares about. "
+                           "Stay under {max_tokens} tokens."),
+                ("user", "Summary so far:\n{summary}\n\nNew question: {question}\nAnswer: {answer}")
+            ])
+            response = (prompt | llm).invoke({
+                "summary": summary or "(none)",
+                "question": question,
+                "answer": answer,
+                "max_tokens": max_tokens
+            })
+            return response.content.strip()
+        except Exception as e:
+            print(f"[!] Summary error, falling back to extractive: {e}")
+    return extractive_summary(summary, question, answer, max_tokens)
+
+
+def summarize_node(node: Dict[str, Any], content: str) -> str:
+    """Summary of one state/program/section node for the offline summaries build"""
+    max_words = SUMMARIES_CONFIG.get('max_words', 120)
+    if SUMMARIES_CONFIG.get('mode', 'llm') == 'llm':
+        llm = ChatOpenAI(model=OPENAI_CHAT_MODEL, temperature=0)
+        prompt = ChatPromptTemplate.from_messages([
+            ("system", "You write compact reference summaries for a training and certification advisor. "
+                       "Keep concrete facts: requirements, costs, durations, funding programs, salaries. "
+                       "Use at most {max_words} words and no preamble."),
+            ("user", "Summarize this {level} ({title}, {state_id}):\n\n{content}")
+        ])
+        response = (prompt | llm).invoke({
+            "max_words": max_words,
+            "level": node["level"],
+            "title": node["title"],
+            "state_id": node["state_id"],
+            "content": content
+        })
+        return response.content
+    return first_sentences(content, max_chars=max_words * 6)
+
+
+def session_fields(result: Dict[str, Any]) -> Dict[str, Any]:
+    """The subset of a pipeline result that ConversationSession.record_turn reads"""
+    return {
+        name: result.get(name)
+        for name in ("extracted_entities", "final_answer", "query_type",
+                     "retrieved_docs", "retrieval_scores", "retrieval_strategy")
+    }
+
+
+def public_response(response: Dict[str, Any], session=None) -> Dict[str, Any]:
+    """Strip internal fields and add the session turn, if any"""
+    body = {k: v for k, v in response.items() if not k.startswith("_")}
+    if tracing.request_id():
+        body["request_id"] = tracing.request_id()
+    if session:
+        body["session_id"] = session.session_id
+        body["turn"] = session.turns
+    return body
+
+
+def client_key() -> str:
+    """Rate-limit key: the caller's address (the first X-Forwarded-For hop behind a trusted proxy)"""
+    if client_limit_config.get('trust_forwarded_for', False) and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr or "unknown"
+
+
+def overloaded_response(error: Overloaded):
+    """Fast 429/503 with Retry-After for requests refused by admission control"""
+    response = jsonify({"error": "Too many requests" if error.status == 429 else "Server busy",
+                        "reason": error.reason, "retry_after": error.retry_after})
+    response.status_code = error.status
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response
+
+
+def normalize_question(question: str) -> str:
+    """Cache key form of a question: lowercase, single-spaced, no trailing punctuation"""
+    return re.sub(r"\s+", " ", question.lower()).strip(" ?.!")
+
+
+def answer_cache_key(kb: KnowledgeBase, pipeline: str, question: str, filters: Dict[str, Any]) -> tuple:
+    return (kb.version, pipeline, normalize_question(question), json.dumps(filters, sort_keys=True))
+
+
+def pipeline_response(result: Dict[str, Any], pipeline: str) -> Dict[str, Any]:
+    """The /api/query body for a pipeline result"""
+    response = {
+        "answer": result["final_answer"],
+        "confidence": result["confidence"],
+        "sources": result["sources"],
+        "query_type": result["query_type"],
+        "entities": result["extracted_entities"],
+        # The pipeline that produced the answer (fused answers may fall back to full)
+        "pipeline": "fused" if pipeline == "fused" and not result["fused_fallback"] else "full"
+    }
+    
+    # Steps cut short by the time budget
+    if result["degraded"]:
+        response["degraded"] = result["degraded"]
+    
+    # Include reasoning trace if enabled
+    if CONFIG.get('features', {}).get('show_reasoning', False):
+        response["reasoning"] = result["reasoning_trace"]
+    return response
+
+
+def log_query(question: str, filters: Dict[str, Any], query_type: Optional[str], started: float,
+              cache: str, pipeline: str):
+    if query_log:
+        try:
+            query_log.record(normalize_question(question), filters, query_type,
+                             (time.perf_counter() - started) * 1000, cache, pipeline)
+        except OSError as e:
+            print(f"[!] Query log write failed: {e}")
+
+
+def initial_query_state(question: str, filters: Dict[str, str], pipeline: str = "full", deadline: float = 0.0,
+                        session=None, previous_retrieval: Optional[Dict[str, Any]] = None) -> AgenticRAGState:
+    """Graph input for one question (also used by bench.py)"""
+    return {
+        "question": question,
+        "filters": filters,
+        "pipeline": pipeline,
+        "fused_fallback": "",
+        "session_id": session.session_id if session else "",
+        "conversation_summary": session.summary if session else "",
+        "prior_entities": dict(session.entities) if session else {},
+        "previous_retrieval": previous_retrieval,
+        "deadline": deadline,
+        "degraded": [],
+        "query_type": "general",
+        "extracted_entities": {},
+        "search_queries": [question],
+        "comparison_extracts": {},
+        "retrieved_docs": [],
+        "retrieval_scores": [],
+        "retrieval_strategy": "",
+        "draft_answer": "",
+        "citations": [],
+        "critique": "",
+        "is_grounded": True,
+        "missing_info": [],
+        "final_answer": "",
+        "confidence": 0.0,
+        "reasoning_trace": [],
+        "sources": []
+    }
 
 
 @app.route('/api/query', methods=['POST'])
 def query():
     """Handle search queries with full agentic pipeline"""
+    started = time.perf_counter()
     try:
         data = request.json
         question = data.get('question', '').strip()
         filters = data.get('filters', {})
+        session_id = data.get('session_id')
+        pipeline = data.get('pipeline') or PIPELINE_CONFIG.get('mode', 'full')
         
         if not question:
             return jsonify({"error": "Question required"}), 400
+        if pipeline not in PIPELINE_MODES:
+            return jsonify({"error": f"pipeline must be one of: {', '.join(PIPELINE_MODES)}"}), 400
         
-        if not app_graph:
+        # The time budget starts now, so time spent queued for admission counts against it
+        try:
+            budget_seconds = data.get('budget_seconds')
+            deadline = request_deadline(float(budget_seconds) if budget_seconds is not None else None)
+        except (TypeError, ValueError):
+            return jsonify({"error": "budget_seconds must be a number"}), 400
+        
+        # One snapshot for the whole request, even if a reload swaps it meanwhile
+        kb = knowledge_base
+        if not kb or not kb.app_graph:
             return jsonify({"error": "System not initialized"}), 503
         
-        # Initialize state
-        initial_state = {
-            "question": question,
-            "filters": filters,
-            "query_type": "general",
-            "extracted_entities": {},
-            "search_queries": [question],
-            "retrieved_docs": [],
-            "retrieval_strategy": "",
-            "draft_answer": "",
-            "citations": [],
-            "critique": "",
-            "is_grounded": True,
-            "missing_info": [],
-            "final_answer": "",
-            "confidence": 0.0,
-            "reasoning_trace": [],
-            "sources": []
-        }
+        session = None
+        if session_id and session_config.get('enabled', True):
+            session = conversation_sessions.get_or_create(str(session_id))
         
-        # Run the agentic pipeline
-        result = app_graph.invoke(initial_state)
+        # Follow-up answers depend on the conversation, so only first turns are cached
+        cache_key = answer_cache_key(kb, pipeline, question, filters)
+        use_cache = session is None or session.turns == 0
+        cached = answer_cache.get(cache_key) if use_cache else None
+        if cached is not None:
+            if session:
+                session.record_turn(question, cached["_state"], kb.version, summarize_turn, entity_ids)
+            log_query(question, filters, cached["query_type"], started, "hit", pipeline)
+            return jsonify(public_response(cached, session))
         
-        # Build response
-        response = {
-            "answer": result["final_answer"],
-            "confidence": result["confidence"],
-            "sources": result["sources"],
-            "query_type": result["query_type"],
-            "entities": result["extracted_entities"]
-        }
+        previous_retrieval = None
+        if session and session.last_retrieval and session_config.get('reuse_retrieval', True):
+            if session.last_retrieval["kb_version"] == kb.version:
+                previous_retrieval = session.last_retrieval
+        
+        # Initialize state
+        initial_state = initial_query_state(question, filters, pipeline, deadline, session, previous_retrieval)
         
-        # Include reasoning trace if enabled
-        if CONFIG.get('features', {}).get('show_reasoning', False):
-            response["reasoning"] = result["reasoning_trace"]
+        # Run the agentic pipeline, if there is capacity for it
+        try:
+            if client_limiter:
+                client_limiter.check(client_key())
+            with admission.admit():
+                result = kb.app_graph.invoke(initial_state, config={"callbacks": tracing.llm_callbacks()})
+        except Overloaded as e:
+            log_query(question, filters, None, started, "rejected", pipeline)
+            return overloaded_response(e)
+        
+        response = pipeline_response(result, pipeline)
         
-        return jsonify(response)
+        if session:
+            session.record_turn(question, result, kb.version, summarize_turn, entity_ids)
+        # A degraded answer is only the best we could do in time, so it is not cached
+        cacheable = use_cache and not result["degraded"]
+        if cacheable:
+            # The pipeline fields a session needs are kept alongside, never sent
+            answer_cache.put(cache_key, {**response, "_state": session_fields(result)})
+        log_query(question, filters, result["query_type"], started, "miss" if cacheable else "uncached", pipeline)
+        return jsonify(public_response(response, session))
         
     except Exception as e:
         print(f"[!] Error: {e}")
+        tracing.record_error(e)
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
@@ -886,24 +2183,49 @@ def query():
 @app.route('/api/debug/metadata', methods=['GET'])
 def debug_metadata():
     """Debug endpoint to see extracted metadata"""
-    if metadata_index:
-        return jsonify({
-            "states": metadata_index.get("states", []),
-            "certifications": metadata_index.get("certifications", []),
-            "state_certs": metadata_index.get("state_certs", {}),
-            "sample_details": dict(list(metadata_index.get("cert_details", {}).items())[:5])
-        })
+    kb = knowledge_base
+    if kb:
+        return kb.payloads["debug_metadata"].response(request)
     return jsonify({"error": "Metadata not initialized"})
 
 
+def debug_metadata_payload(metadata_index: Dict[str, Any]) -> Dict[str, Any]:
+    """The extracted metadata shown by /api/debug/metadata"""
+    return {
+        "states": metadata_index.get("states", []),
+        "certifications": metadata_index.get("certifications", []),
+        "state_certs": metadata_index.get("state_certs", {}),
+        "state_ids": metadata_index.get("state_ids", []),
+        "cert_ids": metadata_index.get("cert_ids", []),
+        "aid_ids": metadata_index.get("aid_ids", []),
+        "section_ids": metadata_index.get("section_ids", []),
+        "state_cert_ids": metadata_index.get("state_cert_ids", {}),
+        # Keyed by (state, cert) internally; JSON keys must be strings
+        "sample_details": {
+            f"{state} / {cert}": details
+            for (state, cert), details in list(metadata_index.get("cert_details", {}).items())[:5]
+        }
+    }
+
+
 @app.route('/api/sections', methods=['GET'])
 def get_sections():
     """Return the full L1/L2/L3 hierarchy for the Explorer UI."""
-    return jsonify(section_hierarchy)
+    if not startup_state["ready"]:
+        return not_ready_response()
+    return knowledge_base.payloads["sections"].response(request)
 
 # This powers the left sidebar tree.
 
 
+def find_sections(state: str, cert: str, section: str):
+    """Section numbers in the chunk table for Explorer names (headers without their '#' marks)"""
+    return knowledge_base.docs.find_sections(
+        normalize=lambda value: value.strip("# ").strip(),
+        state=state, certification=cert, section=section
+    )
+
+
 @app.route('/api/section-content', methods=['POST'])
 def get_section_content():
     """
@@ -915,6 +2237,9 @@ def get_section_content():
       "section": "Requirements"
     }
     """
+    if not startup_state["ready"]:
+        return not_ready_response()
+
     data = request.json
     state = data.get("state")
     cert = data.get("certification")
@@ -923,14 +2248,7 @@ def get_section_content():
     if not (state and cert and section):
         return jsonify({"error": "Missing state/certification/section"}), 400
 
-    matches = []
-    for doc in docs:
-        if (
-            doc.metadata.get("state", "").strip("# ").strip() == state and
-            doc.metadata.get("certification", "").strip("# ").strip() == cert and
-            doc.metadata.get("section", "").strip("# ").strip() == section
-        ):
-            matches.append(doc.page_content)
+    matches = [knowledge_base.docs.section_text(i) for i in find_sections(state, cert, section)]
 
     if not matches:
         return jsonify({"error": "Section not found"}), 404
@@ -945,6 +2263,9 @@ def get_section_metadata():
     """
     Return extracted metadata (cost, duration, requirements) for a section.
     """
+    if not startup_state["ready"]:
+        return not_ready_response()
+
     data = request.json
     state = data.get("state")
     cert = data.get("certification")
@@ -953,7 +2274,7 @@ def get_section_metadata():
         return jsonify({"error": "Missing state/certification"}), 400
 
     key = (state, cert)
-    details = metadata_index.get("cert_details", {}).get(key, {})
+    details = knowledge_base.metadata_index.get("cert_details", {}).get(key, {})
 
     return jsonify(details)
 
@@ -965,6 +2286,9 @@ def get_section_chunks():
     """
     Return all vectorstore chunks belonging to a section.
     """
+    if not startup_state["ready"]:
+        return not_ready_response()
+
     data = request.json
     state = data.get("state")
     cert = data.get("certification")
@@ -973,16 +2297,13 @@ def get_section_chunks():
     if not (state and cert and section):
         return jsonify({"error": "Missing state/certification/section"}), 400
 
+    table = knowledge_base.docs
     results = []
-    for doc in docs:
-        if (
-            doc.metadata.get("state", "").strip("# ").strip() == state and
-            doc.metadata.get("certification", "").strip("# ").strip() == cert and
-            doc.metadata.get("section", "").strip("# ").strip() == section
-        ):
+    for i in find_sections(state, cert, section):
+        for row in table.section_rows(i):
             results.append({
-                "text": doc.page_content,
-                "metadata": doc.metadata
+                "text": table.text(row),
+                "metadata": table.metadata(row)
             })
 
     return jsonify({"chunks": results})
@@ -995,6 +2316,9 @@ def get_section_suggestions():
     """
     Generate suggested questions for a section.
     """
+    if not startup_state["ready"]:
+        return not_ready_response()
+
     data = request.json
     state = data.get("state")
     cert = data.get("certification")
@@ -1004,44 +2328,74 @@ def get_section_suggestions():
         return jsonify({"error": "Missing state/certification/section"}), 400
 
     # Build a prompt using the section content
-    section_docs = []
-    for doc in docs:
-        if (
-            doc.metadata.get("state", "").strip("# ").strip() == state and
-            doc.metadata.get("certification", "").strip("# ").strip() == cert and
-            doc.metadata.get("section", "").strip("# ").strip() == section
-        ):
-            section_docs.append(doc.page_content)
-
-    context = "\n\n".join(section_docs)
-
-    llm = ChatOpenAI(model=OPENAI_CHAT_MODEL, temperature=0)
+    context = "\n\n".join(knowledge_base.docs.section_text(i) for i in find_sections(state, cert, section))
+
+    llm = ChatOpenAI(model=OPENAI_CHAT_MODEL, temperature=0, timeout=DEADLINE_CONFIG.get('default_seconds', 25))
     prompt = ChatPromptTemplate.from_messages([
         ("system", "Generate 10 helpful questions a user might ask after reading this section."),
         ("user", "{context}")
     ])
 
     chain = prompt | llm
-    response = chain.invoke({"context": context})
+    try:
+        if client_limiter:
+            client_limiter.check(client_key())
+        with admission.admit():
+            response = chain.invoke({"context": context}, config={"callbacks": tracing.llm_callbacks()})
+    except Overloaded as e:
+        return overloaded_response(e)
 
     return jsonify({"suggestions": response.content.split("\n")})
 
 
-study_memory = []
+study_config = CONFIG.get('study', {})
+study_store = StudyStore(
+    study_config.get('db_path', './study_memory.db'),
+    max_items_per_user=study_config.get('max_items_per_user', 500),
+    max_item_bytes=study_config.get('max_item_bytes', 16384),
+    retention_days=study_config.get('retention_days', 90)
+)
 
 # This powers the Suggested Questions panel.
 
 
+def study_user_id(data: Dict[str, Any] = None) -> str:
+    """Owner of study items: X-User-Id header, then user_id/session_id in the body or query"""
+    data = data or {}
+    return (
+        request.headers.get('X-User-Id')
+        or data.get('user_id') or data.get('session_id')
+        or request.args.get('user_id') or request.args.get('session_id')
+        or 'anonymous'
+    )
+
+
 @app.route('/api/study/save', methods=['POST'])
 def study_save():
-    data = request.json
-    study_memory.append(data)
-    return jsonify({"status": "saved"})
+    data = request.json or {}
+    try:
+        item_id = study_store.append(study_user_id(data), data)
+    except StudyItemTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    return jsonify({"status": "saved", "id": item_id})
 
 
 @app.route('/api/study/list', methods=['GET'])
 def study_list():
-    return jsonify(study_memory)
+    """
+    One page of the caller's saved items, newest first.
+    Query params: cursor (next_cursor from the previous page), limit.
+    """
+    # request.args.get(type=int) would silently turn bad input into the default
+    try:
+        cursor = int(request.args['cursor']) if request.args.get('cursor') else None
+        limit = int(request.args['limit']) if request.args.get('limit') else study_config.get('page_size', 50)
+    except ValueError:
+        return jsonify({"error": "cursor and limit must be integers"}), 400
+    limit = max(1, min(limit, study_config.get('max_page_size', 200)))
+    
+    items, next_cursor = study_store.list(study_user_id(), cursor=cursor, limit=limit)
+    return jsonify({"items": items, "next_cursor": next_cursor})
 
 # This powers the Learning Mode sidebar.
 
@@ -1050,48 +2404,711 @@ def study_list():
 # ============================================================
 
 
-def initialize():
-    """Initialize the agentic RAG system"""
-    global vector_store, metadata_index, app_graph
+class KnowledgeBase:
+    """
+    Everything derived from the data file, built together and published
+    together: chunks, metadata index, section hierarchy, vector index and
+    the agent graph that closes over them.
+    """
     
-    print("=" * 60)
-    print("Initializing Agentic RAG System...")
-    print("=" * 60)
+    def __init__(self, version: str, docs: ChunkTable, metadata_index: Dict[str, Any],
+                 section_hierarchy: Dict[str, Any], vector_store: ShardedVectorIndex,
+                 summary_index: Optional[SummaryIndex] = None):
+        self.version = version
+        self.docs = docs
+        self.metadata_index = metadata_index
+        self.section_hierarchy = section_hierarchy
+        self.vector_store = vector_store
+        self.summary_index = summary_index
+        self.app_graph = None
+        self.built_at = time.time()
+        # Shared lease on the version's directory (see leases.py), released with the snapshot
+        self.lease = None
+        # Read-mostly responses, serialized once per snapshot (see payloads.py)
+        self.payloads = {
+            "taxonomies": Payload(taxonomies_payload(metadata_index), compressor, PAYLOAD_MAX_AGE),
+            "sections": Payload(section_hierarchy, compressor, PAYLOAD_MAX_AGE),
+            "debug_metadata": Payload(debug_metadata_payload(metadata_index), compressor, PAYLOAD_MAX_AGE)
+        }
+
+
+@contextmanager
+def startup_phase(name: str, state: Dict[str, Any] = None):
+    """Time one initialization phase and record it for /readyz (or the reload status)"""
+    state = startup_state if state is None else state
+    state["phase"] = name
+    start = time.perf_counter()
+    yield
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 1)
+    state["timings_ms"][name] = elapsed_ms
+    print(f"[*] Phase '{name}' took {elapsed_ms} ms")
+
+
+def data_version(corpus_fingerprint: str) -> str:
+    """
+    Hash of the ingested sources, ingest schema and embedding model; names the
+    persisted vector store for that content
+    """
+    digest = hashlib.sha256(INGEST_SCHEMA_VERSION.encode())
+    digest.update(OPENAI_EMBED_MODEL.encode())
+    digest.update(corpus_fingerprint.encode())
+    return digest.hexdigest()[:12]
+
+
+@contextmanager
+def build_lock(persist_dir: str):
+    """Serialize vector store builds across worker processes (POSIX only)"""
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(persist_dir, exist_ok=True)
+    with open(os.path.join(persist_dir, ".build.lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def build_knowledge_base(state: Dict[str, Any] = None) -> KnowledgeBase:
+    """
+    Load chunks, metadata index, section hierarchy and vectors: from the
+    artifact bundle when bundle.path is set, else from the sources.
+
+    This is the expensive, read-only part of startup. Under a pre-forking
+    server it runs once in the master so workers inherit it copy-on-write.
+    """
+    with startup_phase("imports", state):
+        import_heavy_dependencies()
+    if BUNDLE_CONFIG.get('path'):
+        return load_bundled_knowledge_base(state)
+    return build_from_sources(state)
+
+
+def build_from_sources(state: Dict[str, Any] = None) -> KnowledgeBase:
+    """Ingest the sources, build (or resume) the Chroma store and export the vector shards"""
+    import_heavy_dependencies()
     
     # Load documents and extract metadata
-    docs, metadata_index = load_documents()
-    section_hierarchy = build_section_hierarchy(docs)
+    with startup_phase("load_documents", state):
+        docs, metadata_index, corpus_fingerprint = load_documents()
+    
+    version = data_version(corpus_fingerprint)
+    persist_dir = os.path.join(PERSIST_DIR, version)
+    # Chunk text is served from the memory-mapped corpus file, shared across workers
+    os.makedirs(persist_dir, exist_ok=True)
+    # Which model the vectors in this store come from, so later versions only reuse shards from the same one
+    bundle.write_json(os.path.join(persist_dir, "version.json"),
+                      {"ingest_schema_version": INGEST_SCHEMA_VERSION, "embed_model": OPENAI_EMBED_MODEL})
+    docs.map_corpus(os.path.join(persist_dir, "corpus.bin"))
+    with startup_phase("section_hierarchy", state):
+        section_hierarchy = build_section_hierarchy(docs)
     # Now your backend knows the full structure of the domain.
      
-    # Create vector store
-    vector_store = create_vectorstore(docs)
+    # Create vector store, then serve from the shared memory-mapped copy
+    with build_lock(PERSIST_DIR):
+        with startup_phase("vectorstore", state):
+            chroma = create_vectorstore(docs, persist_dir)
+        with startup_phase("shared_vectors", state):
+            vector_store = create_shared_index(docs, chroma, persist_dir, version)
+    del chroma
+    
+    summary_index = None
+    if SUMMARIES_CONFIG.get('enabled', True):
+        with startup_phase("summaries", state):
+            summary_index = SummaryIndex.load(SUMMARIES_FILE, docs, entity_resolver, Document)
+    
+    kb = KnowledgeBase(version, docs, metadata_index, section_hierarchy, vector_store, summary_index)
+    kb.lease = leases.hold(persist_dir)
+    return kb
+
+
+def bundle_compatibility() -> Dict[str, Any]:
+    """What a bundle must have been built with for this server to load it (see bundle.py)"""
+    return {
+        "ingest_schema_version": INGEST_SCHEMA_VERSION,
+        "embed_model": OPENAI_EMBED_MODEL,
+        "quantization": quantization_settings()["quantization"]
+    }
+
+
+def encode_metadata_index(metadata_index: Dict[str, Any]) -> Dict[str, Any]:
+    """metadata_index as JSON: cert_details is keyed by (state, cert) tuples"""
+    return {**metadata_index, "cert_details": [
+        [state, cert, details] for (state, cert), details in metadata_index["cert_details"].items()
+    ]}
+
+
+def decode_metadata_index(encoded: Dict[str, Any]) -> Dict[str, Any]:
+    return {**encoded, "cert_details": {(state, cert): details for state, cert, details in encoded["cert_details"]}}
+
+
+def write_bundle(kb: KnowledgeBase, root: str, keep: int = 2) -> Dict[str, Any]:
+    """Write a knowledge base built from the sources as the current bundle under root; returns its manifest"""
+    os.makedirs(root, exist_ok=True)
+    staging = bundle.staging_directory(root, kb.version)
+    kb.docs.save(os.path.join(staging, "chunks"))
+    bundle.write_json(os.path.join(staging, "metadata_index.json"), encode_metadata_index(kb.metadata_index))
+    bundle.write_json(os.path.join(staging, "section_hierarchy.json"), kb.section_hierarchy)
+    
+    # Float32 vectors first: copy2 keeps mtimes, and a quantized copy must not look older than its vectors
+    shard_dir = os.path.join(staging, "shards")
+    os.makedirs(shard_dir)
+    for name, shard in kb.vector_store.shards.items():
+        paths = [shard.path, kb.vector_store.manifest_path(name)]
+        if shard.quantization:
+            paths.append(quantized_path(shard.path, shard.quantization))
+            if shard.quantization == "int8":
+                paths.append(scale_path(shard.path))
+        for path in paths:
+            shutil.copy2(path, shard_dir)
+    
+    summaries_vectors = os.path.splitext(SUMMARIES_FILE)[0] + ".npy"
+    if kb.summary_index and os.path.exists(SUMMARIES_FILE) and os.path.exists(summaries_vectors):
+        shutil.copy2(SUMMARIES_FILE, os.path.join(staging, "summaries.json"))
+        shutil.copy2(summaries_vectors, os.path.join(staging, "summaries.npy"))
+    
+    contents = {
+        "chunks": len(kb.docs),
+        "sections": kb.docs.section_count,
+        "shards": {name: len(shard.rows) for name, shard in kb.vector_store.shards.items()},
+        "summaries": kb.summary_index is not None
+    }
+    return bundle.publish_bundle(root, kb.version, staging, bundle_compatibility(), contents, keep)
+
+
+def load_bundled_knowledge_base(state: Dict[str, Any] = None) -> KnowledgeBase:
+    """
+    The knowledge base from the current bundle under bundle.path, memory-
+    mapped. Raises BundleError (and the process does not start) if the
+    bundle is missing, corrupt or incompatible.
+    """
+    with startup_phase("open_bundle", state):
+        path, manifest = bundle.open_bundle(BUNDLE_CONFIG['path'], bundle_compatibility(),
+                                            BUNDLE_CONFIG.get('verify_checksums', True))
+    version = manifest["version"]
+    
+    with startup_phase("load_documents", state):
+        docs = ChunkTable.load(os.path.join(path, "chunks"))
+        metadata_index = decode_metadata_index(bundle.read_json(os.path.join(path, "metadata_index.json")))
+        section_hierarchy = bundle.read_json(os.path.join(path, "section_hierarchy.json"))
+    
+    with startup_phase("shared_vectors", state):
+        vector_store = ShardedVectorIndex(
+            path, docs,
+            embedding_factory=lambda: OpenAIEmbeddings(model=OPENAI_EMBED_MODEL),
+            version=version,
+            max_workers=VECTOR_INDEX_CONFIG.get('max_parallel_shards', 4),
+            embedding_cache=embedding_cache,
+            **quantization_settings()
+        )
+        for name, shard in vector_store.shards.items():
+            if manifest["contents"]["shards"].get(name) != len(shard.rows):
+                raise bundle.BundleError(f"Bundle {path}: vector shard {name} does not match its chunks")
+            # Mapped now rather than on first search, so the mappings outlive the directory
+            shard.map()
+    
+    summary_index = None
+    if SUMMARIES_CONFIG.get('enabled', True):
+        with startup_phase("summaries", state):
+            summary_index = SummaryIndex.load(os.path.join(path, "summaries.json"), docs, entity_resolver, Document)
+    
+    print(f"[*] Loaded bundle {version} from {path} ({manifest['contents']['chunks']} chunks, "
+          f"built {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['built_at']))})")
+    kb = KnowledgeBase(version, docs, metadata_index, section_hierarchy, vector_store, summary_index)
+    kb.lease = leases.hold(path)
+    return kb
+
+
+def attach_agents(kb: KnowledgeBase, state: Dict[str, Any] = None) -> KnowledgeBase:
+    """Build the agent graph for a knowledge base (per process, after fork)"""
+    with startup_phase("agent_graph", state):
+        kb.app_graph = create_agentic_graph(kb.vector_store, kb.metadata_index, kb.summary_index)
+    return kb
+
+
+def publish_knowledge_base(kb: KnowledgeBase):
+    """Make kb the one every new request sees"""
+    global knowledge_base
     
-    # Build the agentic graph
-    app_graph = create_agentic_graph(vector_store)
+    knowledge_base = kb
+    # Keys carry the version; clearing just frees the old entries
+    answer_cache.clear()
+    retrieval_cache.clear()
     
     # Initialize visibility module for data exploration
-    try:
-        from visibility_module import visibility_bp, init_visibility
+    if init_visibility:
         llm = ChatOpenAI(model=OPENAI_CHAT_MODEL, temperature=0)
-        init_visibility(vector_store, llm)
-        app.register_blueprint(visibility_bp)
+        init_visibility(kb.vector_store, llm)
+
+
+def init_worker():
+    """
+    Per-process setup: LLM clients, the agent graph and the visibility module.
+
+    Cheap, and must run after fork so no HTTP connection pool is shared
+    between worker processes.
+    """
+    attach_agents(knowledge_base)
+    publish_knowledge_base(knowledge_base)
+    if init_visibility:
         print("[*] Visibility module loaded - explore your data at /api/visibility/summary")
-    except ImportError as e:
-        print(f"[!] Visibility module not available: {e}")
+    start_reload_watcher()
+    
+    total_ms = round(sum(startup_state["timings_ms"].values()), 1)
+    startup_state["phase"] = "ready"
+    startup_state["ready"] = True
+    print(f"[*] Agentic RAG System ready in {total_ms} ms (pid {os.getpid()}, kb {knowledge_base.version})! "
+          f"Timings: {startup_state['timings_ms']}")
+    print(f"[*] Agents: Query Analyzer → Smart Retriever → Answer Generator → Self-Critique → Synthesizer "
+          f"(default pipeline: {PIPELINE_CONFIG.get('mode', 'full')})")
+    start_cache_warmer(knowledge_base)
+
+
+def load_initial_knowledge_base():
+    """Build the first knowledge base without publishing it (init_worker does that)"""
+    global knowledge_base
+    
+    print("=" * 60)
+    print(f"Initializing Agentic RAG System ({PRODUCT_NAME} v{PRODUCT_VERSION}, data: {DATA_FILE})...")
+    print("=" * 60)
+    knowledge_base = build_knowledge_base()
+
+
+def initialize():
+    """Initialize the agentic RAG system in a single process"""
+    load_initial_knowledge_base()
+    init_worker()
+    return True
+
+
+def create_app() -> Flask:
+    """
+    App factory for pre-forking WSGI servers (see gunicorn.conf.py).
+
+    Builds the knowledge base in the master process and freezes it out of
+    the garbage collector, so forked workers share its pages instead of
+    touching (and copying) them on every collection. Workers then call
+    init_worker() from the post_fork hook.
+    """
+    load_initial_knowledge_base()
+    gc.freeze()
+    print(f"[*] Knowledge base built in master (pid {os.getpid()}), {gc.get_freeze_count()} objects frozen")
+    return app
+
+
+def initialize_in_background() -> threading.Thread:
+    """
+    Run initialize() on a daemon thread so the server can bind and answer
+    /healthz immediately; /readyz turns 200 once the pipeline is loaded.
+    """
+    def run():
+        try:
+            initialize()
+        except Exception as e:
+            startup_state["error"] = str(e)
+            print(f"[!] Initialization failed during '{startup_state['phase']}': {e}")
+            import traceback
+            traceback.print_exc()
+    
+    thread = threading.Thread(target=run, name="rag-initializer", daemon=True)
+    thread.start()
+    return thread
+
+# ============================================================
+# HOT RELOAD
+# ============================================================
+
+reload_config = CONFIG.get('reload', {})
+
+# Progress of the most recent reload, reported by /api/admin/reload
+reload_state = {
+    "running": False,
+    "phase": None,
+    "error": None,
+    "timings_ms": {},
+    "last_version": None,
+    "last_reload_at": None
+}
+reload_lock = threading.Lock()
+
+
+def reload_knowledge_base() -> bool:
+    """
+    Rebuild the knowledge base in the background of the current process while
+    the old one keeps serving, then swap it in with one assignment.
+
+    Returns False if a reload was already in progress.
+    """
+    if not reload_lock.acquire(blocking=False):
+        return False
     
-    print("[*] Agentic RAG System ready!")
-    print(f"[*] Agents: Query Analyzer → Smart Retriever → Answer Generator → Self-Critique → Synthesizer")
+    try:
+        reload_state.update({"running": True, "error": None, "timings_ms": {}})
+        old_version = knowledge_base.version if knowledge_base else None
+        print(f"[*] Reloading knowledge base (current {old_version})...")
+        
+        kb = attach_agents(build_knowledge_base(reload_state), reload_state)
+        publish_knowledge_base(kb)
+        start_cache_warmer(kb)
+        
+        reload_state.update({"phase": "done", "last_version": kb.version, "last_reload_at": time.time()})
+        print(f"[*] Knowledge base swapped {old_version} -> {kb.version} "
+              f"({round(sum(reload_state['timings_ms'].values()), 1)} ms)")
+        prune_old_versions(keep={kb.version, old_version})
+    except Exception as e:
+        reload_state["error"] = str(e)
+        print(f"[!] Reload failed during '{reload_state['phase']}', still serving the previous version: {e}")
+    finally:
+        reload_state["running"] = False
+        reload_lock.release()
     return True
 
+
+def prune_old_versions(keep: set):
+    """
+    Delete persisted vector stores for versions no worker still has open;
+    the rest are retried after the next reload
+    """
+    if not os.path.isdir(PERSIST_DIR):
+        return
+    for name in os.listdir(PERSIST_DIR):
+        path = os.path.join(PERSIST_DIR, name)
+        if name not in keep and os.path.isdir(path):
+            if leases.remove_if_unused(path):
+                print(f"[*] Removed old vector store {path}")
+            else:
+                print(f"[*] Kept old vector store {path} (still open in some process)")
+
+
+def reload_watch_signature() -> tuple:
+    """
+    What the watcher compares: the admin reload stamp, plus with reload.watch
+    the source files (or the bundle's CURRENT)
+    """
+    watched = []
+    if reload_config.get('watch', False) and BUNDLE_CONFIG.get('path'):
+        watched = [os.path.join(BUNDLE_CONFIG['path'], bundle.CURRENT_FILE)]
+    elif reload_config.get('watch', False):
+        watched = source_paths("./data", DATA_FILE, DATA_CONFIG.get('source_dir'))
+    signature = []
+    for path in watched + [RELOAD_STAMP_FILE]:
+        try:
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def start_reload_watcher():
+    """
+    Poll the stamp written by /api/admin/reload (and, with reload.watch, the
+    data file) and reload on change. Runs in every worker, so an admin
+    reload reaches all of them.
+    """
+    poll_seconds = reload_config.get('poll_seconds', 5)
+    
+    def watch():
+        last = reload_watch_signature()
+        while True:
+            time.sleep(poll_seconds)
+            current = reload_watch_signature()
+            if current != last:
+                last = current
+                reload_knowledge_base()
+    
+    threading.Thread(target=watch, name="kb-watcher", daemon=True).start()
+    if reload_config.get('watch', False):
+        print(f"[*] Watching the data sources for changes every {poll_seconds}s")
+
+
+# ============================================================
+# CACHE WARMER
+# ============================================================
+
+# Progress of the most recent warm-up, reported by /api/admin/caches
+warmer_state = {
+    "running": False,
+    "version": None,
+    "mode": None,
+    "questions": 0,
+    "warmed": 0,
+    "skipped": 0,
+    "errors": 0,
+    "seconds": None
+}
+
+
+def sample_question_filters(node: Any, filters: Dict[str, str] = None) -> List[tuple]:
+    """
+    (question, filters) for every config sample question. The nesting gives
+    the filters the UI asks them with: state, then certification ("default"
+    and "general" add none).
+    """
+    filters = filters or {}
+    if isinstance(node, str):
+        return [(node, filters)]
+    if isinstance(node, list):
+        return [pair for item in node for pair in sample_question_filters(item, filters)]
+    if not isinstance(node, dict):
+        return []
+    pairs = []
+    for key, value in node.items():
+        nested = dict(filters)
+        if key not in ("default", "general"):
+            nested["certification" if "state" in filters else "state"] = key
+        pairs.extend(sample_question_filters(value, nested))
+    return pairs
+
+
+def warm_questions() -> List[tuple]:
+    """The most asked (question, filters) from the query log, then the config sample questions, deduplicated"""
+    candidates = []
+    if query_log and CACHE_WARMER_CONFIG.get('top_n', 20):
+        since = CACHE_WARMER_CONFIG.get('log_window_hours', 168) * 3600
+        candidates += [(question, filters) for question, filters, _ in
+                       query_log.top(CACHE_WARMER_CONFIG.get('top_n', 20), since)]
+    if CACHE_WARMER_CONFIG.get('sample_questions', True):
+        candidates += sample_question_filters(CONFIG.get('sample_questions', {}))
+    seen = set()
+    questions = []
+    for question, filters in candidates:
+        key = (normalize_question(question), json.dumps(filters, sort_keys=True))
+        if key not in seen:
+            seen.add(key)
+            questions.append((question, filters))
+    return questions[:CACHE_WARMER_CONFIG.get('max_questions', 60)]
+
+
+def wait_until_idle(kb: KnowledgeBase) -> bool:
+    """Block while real requests are running or queued; False once kb is no longer the published one"""
+    poll_seconds = CACHE_WARMER_CONFIG.get('idle_poll_seconds', 0.5)
+    while knowledge_base is kb:
+        stats = admission.stats()
+        if not stats["active"] and not stats["waiting"]:
+            return True
+        time.sleep(poll_seconds)
+    return False
+
+
+@contextmanager
+def full_warm_up_election(version: str):
+    """
+    Yields {"elected": bool, "complete": False} for the full (LLM) warm-up of
+    version. The one process to take the lock file is elected, unless another
+    process already completed that version. The caller sets "complete" after a
+    full pass; only then is the version recorded, so a pass cut short by a
+    newer knowledge base is not counted. Without fcntl every process is elected.
+    """
+    election = {"elected": True, "complete": False}
+    try:
+        import fcntl
+    except ImportError:
+        yield election
+        return
+    os.makedirs(PERSIST_DIR, exist_ok=True)
+    with open(os.path.join(PERSIST_DIR, "cache_warmer.lock"), "a+") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            election["elected"] = False
+            yield election
+            return
+        try:
+            lock_file.seek(0)
+            election["elected"] = lock_file.read().strip() != version
+            yield election
+            if election["elected"] and election["complete"]:
+                # Later reloads of the same version in other workers skip the LLM replay
+                lock_file.truncate(0)
+                lock_file.write(version)
+                lock_file.flush()
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def warm_caches(kb: KnowledgeBase):
+    """
+    Warm kb's caches for popular questions before users ask them.
+
+    Every worker embeds each question and runs the analyzer-free search for
+    it (the question as asked, filtered by its UI filters: what the fused
+    pipeline and a deadline-skipped analyzer search), filling its query
+    embedding and retrieval caches without LLM calls. With mode "full", one
+    worker per version also replays the questions through the pipeline to
+    cache their answers; answer caches are per process, so only that worker's
+    is warm, but the LLM quota is spent once. Mode "embeddings" only embeds.
+
+    Low priority: one question at a time, only while no real request is
+    running or queued in this worker, outside admission control (so it never
+    takes a slot from a user), on a niced thread where the OS allows it.
+    Stops early if another knowledge base is published.
+    """
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), CACHE_WARMER_CONFIG.get('nice', 10))
+    except (AttributeError, OSError):
+        pass  # Not Linux, or not permitted: the idle checks still apply
+    
+    time.sleep(CACHE_WARMER_CONFIG.get('start_delay_seconds', 2))
+    mode = CACHE_WARMER_CONFIG.get('mode', 'retrieval')
+    if mode == "full":
+        with full_warm_up_election(kb.version) as election:
+            election["complete"] = replay_questions(kb, "full" if election["elected"] else "retrieval")
+    else:
+        replay_questions(kb, mode)
+
+
+def replay_questions(kb: KnowledgeBase, mode: str) -> bool:
+    """
+    One warm-up pass over warm_questions(): "embeddings" only embeds,
+    "retrieval" also searches, "full" also runs the pipeline. True if every
+    question was reached.
+    """
+    pipeline = PIPELINE_CONFIG.get('mode', 'full')
+    questions = warm_questions()
+    retrieve = create_smart_retriever(kb.vector_store, kb.summary_index)
+    warmer_state.update({"running": True, "version": kb.version, "mode": mode, "questions": len(questions),
+                         "warmed": 0, "skipped": 0, "errors": 0, "seconds": None})
+    started = time.perf_counter()
+    print(f"[*] Warming caches with {len(questions)} questions (mode {mode})")
+    
+    complete = True
+    for question, filters in questions:
+        if not wait_until_idle(kb):
+            print("[*] Cache warm-up stopped: a newer knowledge base was published")
+            complete = False
+            break
+        cache_key = answer_cache_key(kb, pipeline, question, filters)
+        if mode == "full" and answer_cache.get(cache_key) is not None:
+            warmer_state["skipped"] += 1
+            continue
+        try:
+            with tracing.span("warm_cache", question=question, mode=mode):
+                if mode == "embeddings":
+                    kb.vector_store.embed_query(question)
+                else:
+                    retrieve(prepare_fused_retrieval(
+                        initial_query_state(question, filters, pipeline, request_deadline())
+                    ))
+                if mode == "full":
+                    result = kb.app_graph.invoke(
+                        initial_query_state(question, filters, pipeline, request_deadline()),
+                        config={"callbacks": tracing.llm_callbacks()}
+                    )
+                    if not result["degraded"]:
+                        answer_cache.put(cache_key, {**pipeline_response(result, pipeline),
+                                                     "_state": session_fields(result)})
+            warmer_state["warmed"] += 1
+        except Exception as e:
+            warmer_state["errors"] += 1
+            print(f"[!] Cache warm-up failed for {question!r}: {e}")
+        time.sleep(CACHE_WARMER_CONFIG.get('pause_seconds', 0.2))
+    
+    warmer_state.update({"running": False, "seconds": round(time.perf_counter() - started, 1)})
+    print(f"[*] Cache warm-up done: {warmer_state['warmed']} warmed, {warmer_state['skipped']} already cached, "
+          f"{warmer_state['errors']} failed in {warmer_state['seconds']}s")
+    return complete
+
+
+def start_cache_warmer(kb: KnowledgeBase):
+    if not CACHE_WARMER_CONFIG.get('enabled', True):
+        return
+    threading.Thread(target=warm_caches, args=(kb,), name="cache-warmer", daemon=True).start()
+
+
+def require_admin():
+    """Error response unless the request carries the ADMIN_TOKEN, else None"""
+    if not os.environ.get("ADMIN_TOKEN"):
+        return jsonify({"error": "Admin API disabled (set ADMIN_TOKEN)"}), 403
+    if not admin_token_matches():
+        return jsonify({"error": "Unauthorized"}), 401
+    return None
+
+
+@app.route('/api/admin/reload', methods=['GET', 'POST'])
+def admin_reload():
+    """POST starts a background reload; GET reports the last one"""
+    denied = require_admin()
+    if denied:
+        return denied
+    
+    if request.method == 'POST':
+        if not startup_state["ready"]:
+            return not_ready_response()
+        # Every worker's watcher (this one included) picks up the stamp and reloads,
+        # so no worker keeps answering from the old version
+        os.makedirs(PERSIST_DIR, exist_ok=True)
+        with open(RELOAD_STAMP_FILE, "w") as f:
+            f.write(str(time.time()))
+        return jsonify({"status": "signaled", "poll_seconds": reload_config.get('poll_seconds', 5)}), 202
+    
+    return jsonify({
+        **reload_state,
+        "current_version": knowledge_base.version if knowledge_base else None
+    })
+
+
+@app.route('/api/admin/caches', methods=['GET'])
+def admin_caches():
+    """Hit/miss counters and sizes of the in-process caches"""
+    denied = require_admin()
+    if denied:
+        return denied
+    
+    return jsonify({
+        "answers": answer_cache.stats(),
+        "retrieval": retrieval_cache.stats(),
+        "embeddings": embedding_cache.stats(),
+        "warmer": warmer_state,
+        "query_log": query_log.stats() if query_log else None,
+        "sessions": conversation_sessions.stats(),
+        "tracing": tracing.tracer.stats(),
+        "profiling": request_profiler.stats() if request_profiler else None,
+        "admission": {**admission.stats(), "per_client": client_limiter.stats() if client_limiter else None},
+        "chunk_table": knowledge_base.docs.stats() if knowledge_base else {},
+        "vector_shards": knowledge_base.vector_store.stats() if knowledge_base else {},
+        "summaries": knowledge_base.summary_index.stats() if knowledge_base and knowledge_base.summary_index else {}
+    })
+
+@app.route('/api/admin/profiles', methods=['GET'])
+def admin_profiles():
+    """Stored request profiles, newest first"""
+    denied = require_admin()
+    if denied:
+        return denied
+    if request_profiler is None:
+        return jsonify({"error": "Profiling disabled"}), 404
+    
+    return jsonify({**request_profiler.stats(), "profiles": request_profiler.list()})
+
+
+@app.route('/api/admin/profiles/<name>', methods=['GET'])
+def admin_profile_download(name):
+    """Download one profile (.pstats, .collapsed or the .txt summary)"""
+    denied = require_admin()
+    if denied:
+        return denied
+    path = request_profiler.path(name) if request_profiler else None
+    if path is None:
+        return jsonify({"error": "Profile not found"}), 404
+    
+    mimetype = "text/plain" if not name.endswith(".pstats") else "application/octet-stream"
+    return send_file(os.path.abspath(path), mimetype=mimetype, as_attachment=True, download_name=name)
+
 # ============================================================
 # MAIN
 # ============================================================
 
 
 if __name__ == '__main__':
-    if initialize():
-        port = int(os.environ.get('PORT', 5000))
-        app.run(host='0.0.0.0', port=port, debug=True)
-    else:
-        print("[!] Initialization failed")
-        sys.exit(1)
+    from werkzeug.serving import make_server
+    
+    port = int(os.environ.get('PORT', 5000))
+    # Bind first, then load the knowledge base while already taking traffic
+    server = make_server('0.0.0.0', port, app, threaded=True)
+    print(f"[*] Listening on port {port}; initializing in background (see /readyz)")
+    initialize_in_background()
+    server.serve_forever()
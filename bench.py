@@ -0,0 +1,520 @@
+"""
+TEAI Benchmarks
+===============
+Runs questions through the agent graph in-process (real LLM and embedding
+calls, no HTTP) and reports latency and cost per configuration:
+
+    python bench.py pipeline                      # full vs fused, on config.yaml sample_questions
+    python bench.py pipeline --questions q.txt    # one question per line (or a JSON list)
+    python bench.py quantization                  # quantized first pass vs exact float32 search
+    python bench.py label --n 200                 # generate a labeled question set (question -> gold chunk)
+    python bench.py sweep --labeled eval/labeled_questions.json
+
+pipeline asks each question once per pipeline mode, with the retrieval
+and embedding caches cleared between modes (and the cache warmer off) so
+neither run benefits from the other's searches. The report gives per-mode p50/p95/mean latency, LLM calls per
+question, how often fused answers fell back to the full pipeline, and the
+fused-minus-full deltas.
+
+quantization embeds each question once and searches every shard with the
+exact float32 index and with each quantized mode. It reports recall@k of
+the quantized results against the exact top k, search latency and the bytes
+each encoding takes on disk.
+
+quantization and sweep never write next to the served shards: the float32
+files are hard-linked (or copied) into a temporary directory and the
+quantized copies are built there, so benchmarking a serving box does not
+touch files its workers have mapped.
+
+sweep replays a labeled question set against a grid of vector index
+configurations and recommends one. The grid covers:
+
+- the serving shards, exact or quantized
+- Chroma HNSW collections over every M / construction_ef / search_ef value
+
+Per configuration it reports recall@k and MRR against the gold chunks, p50
+and p99 search latency, build time (n/a for exact float32 shards, which
+need no build) and memory. For shards, memory is the
+bytes of the encoding a search scans. For Chroma, it is the process RSS
+growth while building. Vectors come from the exported shards, so the sweep
+makes no embedding calls besides the questions.
+
+A labeled set is a JSON list of {"question", "gold"} entries. gold lists
+chunk keys, "<source_file>:<byte_start>" as in the chunk metadata. Curated
+entries may use "gold_text" instead, a list of snippets; every chunk that
+contains one counts as gold. label writes such a file by asking the LLM for
+one question per sampled chunk. It is like /api/visibility/questions, but
+it keeps the chunk each question came from.
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import app as rag_app
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def load_questions(path: str = None) -> List[str]:
+    """Questions from a file, or every sample question in config.yaml"""
+    if path:
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        if text.lstrip().startswith("["):
+            return [q for q in json.loads(text) if q]
+        return [line.strip() for line in text.splitlines() if line.strip()]
+
+    questions = []
+    def collect(node):
+        if isinstance(node, str):
+            questions.append(node)
+        elif isinstance(node, list):
+            for item in node:
+                collect(item)
+        elif isinstance(node, dict):
+            for item in node.values():
+                collect(item)
+    collect(rag_app.CONFIG.get('sample_questions', {}))
+    return list(dict.fromkeys(questions))
+
+
+def count_llm_calls():
+    """Callback handler counting chat model calls"""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class Counter(BaseCallbackHandler):
+        calls = 0
+
+        def on_chat_model_start(self, serialized, messages, **kwargs):
+            self.calls += 1
+
+        def on_llm_start(self, serialized, prompts, **kwargs):
+            self.calls += 1
+
+    return Counter()
+
+
+def run_mode(kb, questions: List[str], mode: str) -> Dict[str, Any]:
+    rag_app.retrieval_cache.clear()
+    rag_app.embedding_cache.clear()
+    latencies, calls, confidences = [], [], []
+    fallbacks = errors = 0
+    for question in questions:
+        counter = count_llm_calls()
+        state = rag_app.initial_query_state(question, {}, mode)
+        start = time.perf_counter()
+        try:
+            result = kb.app_graph.invoke(state, config={"callbacks": [counter]})
+        except Exception as e:
+            print(f"[!] {mode}: {question!r} failed: {e}", file=sys.stderr)
+            errors += 1
+            continue
+        latencies.append((time.perf_counter() - start) * 1000)
+        calls.append(counter.calls)
+        confidences.append(result["confidence"])
+        fallbacks += bool(result["fused_fallback"])
+    return {
+        "questions": len(latencies),
+        "errors": errors,
+        "p50_ms": round(percentile(latencies, 0.5), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "mean_ms": round(statistics.fmean(latencies), 1) if latencies else 0.0,
+        "llm_calls_per_question": round(statistics.fmean(calls), 2) if calls else 0.0,
+        "mean_confidence": round(statistics.fmean(confidences), 3) if confidences else 0.0,
+        "fallback_rate": round(fallbacks / len(latencies), 3) if latencies else 0.0
+    }
+
+
+def bench_pipeline(args: argparse.Namespace) -> int:
+    questions = load_questions(args.questions)
+    if args.limit:
+        questions = questions[:args.limit]
+    if not questions:
+        print("[!] No questions to run", file=sys.stderr)
+        return 1
+    # Warm caches would hide the latency being measured
+    rag_app.CACHE_WARMER_CONFIG['enabled'] = False
+    rag_app.initialize()
+    kb = rag_app.knowledge_base
+
+    report = {"questions": len(questions), "modes": {}}
+    for mode in rag_app.PIPELINE_MODES:
+        print(f"[*] Running {len(questions)} questions through the {mode} pipeline...")
+        report["modes"][mode] = run_mode(kb, questions, mode)
+    full, fused = report["modes"]["full"], report["modes"]["fused"]
+    report["fused_minus_full"] = {
+        key: round(fused[key] - full[key], 2)
+        for key in ("p50_ms", "p95_ms", "mean_ms", "llm_calls_per_question", "mean_confidence")
+    }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+@contextmanager
+def scratch_shards(kb) -> Iterator[str]:
+    """
+    A temporary persist directory whose shards/ hold links to (or copies of)
+    kb's float32 shard files, removed afterwards; quantized copies built from
+    it never replace files a serving process maps
+    """
+    from vector_index import link_or_copy
+
+    scratch = tempfile.mkdtemp(prefix="teai-bench-")
+    try:
+        shard_dir = os.path.join(scratch, "shards")
+        os.makedirs(shard_dir)
+        for shard in kb.vector_store.shards.values():
+            link_or_copy(shard.path, os.path.join(shard_dir, os.path.basename(shard.path)))
+        yield scratch
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+
+def bench_quantization(args: argparse.Namespace) -> int:
+    from vector_index import QUANTIZATION_MODES, ShardedVectorIndex
+
+    questions = load_questions(args.questions)
+    if args.limit:
+        questions = questions[:args.limit]
+    kb = rag_app.build_knowledge_base()
+    settings = rag_app.quantization_settings()
+    if args.rescore_factor:
+        settings["rescore_factor"] = args.rescore_factor
+    ks = sorted(set(args.k))
+
+    print(f"[*] Embedding {len(questions)} questions...")
+    query_vectors = [kb.vector_store.embed_query(question) for question in questions]
+
+    def open_index(mode):
+        index = ShardedVectorIndex(persist_dir, kb.docs, lambda: None, kb.version,
+                                   **{**settings, "quantization": mode})
+        for shard in index.shards.values():
+            shard.ensure_quantized()
+        return index
+
+    def run(index):
+        latencies, results = [], []
+        for vector in query_vectors:
+            start = time.perf_counter()
+            results.append([row for row, _ in index.search_vector(vector, max(ks))])
+            latencies.append((time.perf_counter() - start) * 1000)
+        return latencies, results
+
+    with scratch_shards(kb) as persist_dir:
+        exact_index = open_index(None)
+        exact_latencies, exact = run(exact_index)
+        report = {
+            "questions": len(questions),
+            "rescore_factor": settings["rescore_factor"],
+            "min_candidates": settings["min_candidates"],
+            "modes": {"float32": {
+                "p50_ms": round(percentile(exact_latencies, 0.5), 2),
+                "p95_ms": round(percentile(exact_latencies, 0.95), 2),
+                "bytes": sum(shard.vector_bytes()["float32"] for shard in exact_index.shards.values())
+            }}
+        }
+        for mode in QUANTIZATION_MODES:
+            index = open_index(mode)
+            latencies, approximate = run(index)
+            report["modes"][mode] = {
+                "p50_ms": round(percentile(latencies, 0.5), 2),
+                "p95_ms": round(percentile(latencies, 0.95), 2),
+                "bytes": sum(shard.vector_bytes()[mode] for shard in index.shards.values()),
+                **{
+                    f"recall@{k}": round(statistics.fmean(
+                        len(set(got[:k]) & set(want[:k])) / len(want[:k]) if want else 1.0
+                        for got, want in zip(approximate, exact)
+                    ), 4) if questions else 0.0
+                    for k in ks
+                }
+            }
+    print(json.dumps(report, indent=2))
+    return 0
+
+
+def chunk_key(docs, row: int) -> str:
+    """Version-independent id of a chunk, for labeled question sets"""
+    return f"{docs.value('source_file', row)}:{int(docs.chunk_source_start[row])}"
+
+
+LABEL_PROMPT = [
+    ("system", """You write evaluation questions for a healthcare certification search system.
+
+Given one passage, write one realistic question a user would type that this passage answers.
+Name the state and certification if the passage is specific to them. Do not copy phrases
+from the passage word for word.
+
+Respond in JSON: {{"question": "..."}}"""),
+    ("user", "Passage:\n{passage}")
+]
+
+
+def bench_label(args: argparse.Namespace) -> int:
+    from langchain_core.output_parsers import JsonOutputParser
+    from langchain_core.prompts import ChatPromptTemplate
+
+    kb = rag_app.build_knowledge_base()
+    docs = kb.docs
+    rows = [row for row in range(len(docs)) if len(docs.text_bytes(row)) >= args.min_chars]
+    rows = random.Random(args.seed).sample(rows, min(args.n, len(rows)))
+    chain = (ChatPromptTemplate.from_messages(LABEL_PROMPT)
+             | rag_app.ChatOpenAI(model=rag_app.OPENAI_CHAT_MODEL, temperature=0.3)
+             | JsonOutputParser())
+
+    labeled = []
+    for number, row in enumerate(rows, 1):
+        try:
+            question = chain.invoke({"passage": docs.text(row)}).get("question", "").strip()
+        except Exception as e:
+            print(f"[!] Chunk {chunk_key(docs, row)}: {e}", file=sys.stderr)
+            continue
+        if question:
+            labeled.append({"question": question, "gold": [chunk_key(docs, row)]})
+        if number % 25 == 0:
+            print(f"[*] Labeled {number}/{len(rows)} chunks")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(labeled, f, indent=2, ensure_ascii=False)
+    print(f"[*] Wrote {len(labeled)} labeled questions to {args.out}")
+    return 0
+
+
+def load_labeled(path: str, docs) -> List[Dict[str, Any]]:
+    """Labeled questions with their gold chunks resolved to rows; entries with no gold in this corpus are dropped"""
+    with open(path, encoding="utf-8") as f:
+        entries = json.load(f)
+    rows_by_key = {chunk_key(docs, row): row for row in range(len(docs))}
+    labeled = []
+    for entry in entries:
+        gold = {rows_by_key[key] for key in entry.get("gold", []) if key in rows_by_key}
+        for snippet in entry.get("gold_text", []):
+            gold.update(row for row in range(len(docs)) if snippet in docs.text(row))
+        if gold:
+            labeled.append({"question": entry["question"], "gold": gold})
+        else:
+            print(f"[!] No gold chunk found for {entry['question']!r}; skipped", file=sys.stderr)
+    return labeled
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process (Linux), 0 where unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def score_run(ranked: List[List[int]], labeled: List[Dict[str, Any]], latencies: List[float],
+              ks: List[int]) -> Dict[str, Any]:
+    """
+    recall@k (gold chunks in the top k, out of at most k), MRR of the first
+    gold chunk and latency percentiles
+    """
+    result = {}
+    for k in ks:
+        result[f"recall@{k}"] = round(statistics.fmean(
+            len(entry["gold"] & set(rows[:k])) / min(len(entry["gold"]), k)
+            for rows, entry in zip(ranked, labeled)
+        ), 4)
+    reciprocal = []
+    for rows, entry in zip(ranked, labeled):
+        rank = next((i for i, row in enumerate(rows, 1) if row in entry["gold"]), None)
+        reciprocal.append(1 / rank if rank else 0.0)
+    result["mrr"] = round(statistics.fmean(reciprocal), 4)
+    result["p50_ms"] = round(percentile(latencies, 0.5), 3)
+    result["p99_ms"] = round(percentile(latencies, 0.99), 3)
+    return result
+
+
+def sweep_shards(kb, persist_dir: str, modes: List[Optional[str]], query_vectors, labeled, ks,
+                 rescore_factor: int, min_candidates: int) -> List[Dict[str, Any]]:
+    """persist_dir is a scratch copy (scratch_shards), so every quantization is built fresh there"""
+    from vector_index import ShardedVectorIndex
+
+    results = []
+    for mode in modes:
+        start = time.perf_counter()
+        index = ShardedVectorIndex(persist_dir, kb.docs, lambda: None, kb.version, quantization=mode,
+                                   rescore_factor=rescore_factor, min_candidates=min_candidates)
+        for shard in index.shards.values():
+            shard.ensure_quantized()
+        # Exact search builds nothing; only index construction would be timed
+        build_seconds = time.perf_counter() - start if mode else None
+
+        ranked, latencies = [], []
+        for vector in query_vectors:
+            start = time.perf_counter()
+            ranked.append([row for row, _ in index.search_vector(vector, max(ks))])
+            latencies.append((time.perf_counter() - start) * 1000)
+        sizes = [shard.vector_bytes() for shard in index.shards.values()]
+        results.append({
+            "backend": "shards",
+            "quantization": mode or "none",
+            **score_run(ranked, labeled, latencies, ks),
+            "build_seconds": round(build_seconds, 3) if build_seconds is not None else "n/a",
+            "memory_bytes": sum(size[mode or "float32"] for size in sizes)
+        })
+    return results
+
+
+def sweep_chroma(kb, grid: Dict[str, List[int]], query_vectors, labeled, ks) -> List[Dict[str, Any]]:
+    import chromadb
+    from vector_index import chunk_ids
+
+    vectors = kb.vector_store.vectors_for(list(range(len(kb.docs))))
+    ids = chunk_ids(len(kb.docs))
+    row_by_id = {chunk_id: row for row, chunk_id in enumerate(ids)}
+    client = chromadb.EphemeralClient()
+
+    results = []
+    for m, construction_ef in itertools.product(grid["M"], grid["construction_ef"]):
+        before = rss_bytes()
+        start = time.perf_counter()
+        collection = client.create_collection("sweep", metadata=rag_app.hnsw_metadata(
+            {"M": m, "construction_ef": construction_ef}
+        ))
+        for offset in range(0, len(ids), 1000):
+            collection.add(ids=ids[offset:offset + 1000], embeddings=vectors[offset:offset + 1000].tolist())
+        build_seconds = time.perf_counter() - start
+        memory = max(rss_bytes() - before, 0)
+
+        for search_ef in grid["search_ef"]:
+            try:
+                collection.modify(configuration={"hnsw": {"ef_search": search_ef}})
+            except (TypeError, ValueError):  # Older Chroma: search_ef is collection metadata
+                collection.modify(metadata={**collection.metadata, "hnsw:search_ef": search_ef})
+            ranked, latencies = [], []
+            for vector in query_vectors:
+                start = time.perf_counter()
+                found = collection.query(query_embeddings=[vector.tolist()], n_results=max(ks), include=[])
+                latencies.append((time.perf_counter() - start) * 1000)
+                ranked.append([row_by_id[chunk_id] for chunk_id in found["ids"][0]])
+            results.append({
+                "backend": "chroma",
+                "M": m, "construction_ef": construction_ef, "search_ef": search_ef,
+                **score_run(ranked, labeled, latencies, ks),
+                "build_seconds": round(build_seconds, 3),
+                "memory_bytes": memory
+            })
+        client.delete_collection("sweep")
+    return results
+
+
+def recommend(results: List[Dict[str, Any]], metric: str, tolerance: float) -> Dict[str, Any]:
+    """Among configurations within tolerance of the best metric, the lowest p99 latency, then memory"""
+    best = max(result[metric] for result in results)
+    eligible = [result for result in results if result[metric] >= best - tolerance]
+    return min(eligible, key=lambda result: (result["p99_ms"], result["memory_bytes"]))
+
+
+def bench_sweep(args: argparse.Namespace) -> int:
+    kb = rag_app.build_knowledge_base()
+    labeled = load_labeled(args.labeled, kb.docs)
+    if args.limit:
+        labeled = labeled[:args.limit]
+    if not labeled:
+        print("[!] No labeled questions with gold chunks in this corpus", file=sys.stderr)
+        return 1
+    ks = sorted(set(args.k))
+    settings = rag_app.quantization_settings()
+
+    print(f"[*] Embedding {len(labeled)} questions...")
+    query_vectors = [kb.vector_store.embed_query(entry["question"]) for entry in labeled]
+
+    results = []
+    if "shards" in args.backends:
+        modes = [None if mode == "none" else mode for mode in args.quantization]
+        print(f"[*] Sweeping shard search: quantization={args.quantization}")
+        with scratch_shards(kb) as persist_dir:
+            results += sweep_shards(kb, persist_dir, modes, query_vectors, labeled, ks,
+                                    settings["rescore_factor"], settings["min_candidates"])
+    if "chroma" in args.backends:
+        grid = {"M": args.m, "construction_ef": args.construction_ef, "search_ef": args.search_ef}
+        print(f"[*] Sweeping Chroma HNSW: {grid}")
+        results += sweep_chroma(kb, grid, query_vectors, labeled, ks)
+
+    metric = f"recall@{args.target_k or max(ks)}"
+    best = recommend(results, metric, args.tolerance)
+    servable = recommend([r for r in results if r["backend"] == "shards"], metric, args.tolerance) \
+        if any(r["backend"] == "shards" for r in results) else None
+    report = {
+        "questions": len(labeled),
+        "chunks": len(kb.docs),
+        "results": results,
+        "recommended": best,
+        # Serving reads the shards; Chroma results show whether an HNSW backend would pay off
+        "recommended_config": {"vector_index": {"quantization": {
+            "mode": servable["quantization"], "rescore_factor": settings["rescore_factor"],
+            "min_candidates": settings["min_candidates"]
+        }}} if servable else None
+    }
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="In-process benchmarks of the agent graph")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    pipeline = commands.add_parser("pipeline", help="Compare the full and fused answer pipelines")
+    pipeline.add_argument("--questions", help="File with one question per line, or a JSON list")
+    pipeline.add_argument("--limit", type=int, help="Only the first N questions")
+    pipeline.set_defaults(handler=bench_pipeline)
+
+    quantization = commands.add_parser("quantization", help="Recall and latency of quantized vs exact search")
+    quantization.add_argument("--questions", help="File with one question per line, or a JSON list")
+    quantization.add_argument("--limit", type=int, help="Only the first N questions")
+    quantization.add_argument("--k", type=int, nargs="+", default=[1, 5, 10], help="Cutoffs for recall@k")
+    quantization.add_argument("--rescore-factor", type=int, help="Override vector_index.quantization.rescore_factor")
+    quantization.set_defaults(handler=bench_quantization)
+
+    label = commands.add_parser("label", help="Generate a labeled question set from sampled chunks")
+    label.add_argument("--n", type=int, default=200, help="Chunks to sample (one question each)")
+    label.add_argument("--min-chars", type=int, default=200, help="Skip chunks shorter than this")
+    label.add_argument("--seed", type=int, default=7)
+    label.add_argument("--out", default="./eval/labeled_questions.json")
+    label.set_defaults(handler=bench_label)
+
+    sweep = commands.add_parser("sweep", help="Recall/latency sweep over vector index configurations")
+    sweep.add_argument("--labeled", default="./eval/labeled_questions.json", help="Labeled question set")
+    sweep.add_argument("--limit", type=int, help="Only the first N questions")
+    sweep.add_argument("--k", type=int, nargs="+", default=[1, 5, 10], help="Cutoffs for recall@k")
+    sweep.add_argument("--target-k", type=int, help="recall@k the recommendation optimizes (default: largest k)")
+    sweep.add_argument("--tolerance", type=float, default=0.01,
+                       help="Recall a faster configuration may give up against the best")
+    sweep.add_argument("--backends", nargs="+", choices=["shards", "chroma"], default=["shards", "chroma"])
+    sweep.add_argument("--quantization", nargs="+", choices=["none", "int8", "binary"],
+                       default=["none", "int8", "binary"])
+    sweep.add_argument("--m", type=int, nargs="+", default=[8, 16, 32], help="HNSW M values")
+    sweep.add_argument("--construction-ef", type=int, nargs="+", default=[64, 128, 256])
+    sweep.add_argument("--search-ef", type=int, nargs="+", default=[16, 32, 64, 128])
+    sweep.add_argument("--out", help="Also write the report to this JSON file")
+    sweep.set_defaults(handler=bench_sweep)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
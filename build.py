@@ -0,0 +1,88 @@
+"""
+TEAI Offline Build
+==================
+Builds the knowledge base outside the web server, e.g. before a deploy or
+in CI, so workers start from a finished vector store:
+
+    python build.py vectors
+    python build.py summaries
+    python build.py bundle
+
+An interrupted vector build resumes from its checkpoint when run again, and
+summaries are only regenerated for content that changed. `bundle` packs the
+result into the versioned artifact bundle (bundle.py) that servers with
+bundle.path set load at startup.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+
+import app as rag_app
+
+
+def build_vectors(args: argparse.Namespace) -> int:
+    state = {"phase": None, "timings_ms": {}}
+    kb = rag_app.build_from_sources(state)
+    print(json.dumps({
+        "version": kb.version,
+        "chunks": len(kb.docs),
+        "shards": kb.vector_store.stats(),
+        "timings_ms": state["timings_ms"]
+    }, indent=2))
+    return 0
+
+
+def build_summaries(args: argparse.Namespace) -> int:
+    from summaries import build_summaries as build
+
+    if args.mode:
+        rag_app.SUMMARIES_CONFIG['mode'] = args.mode
+    kb = rag_app.build_from_sources()
+    embeddings = rag_app.OpenAIEmbeddings(model=rag_app.OPENAI_EMBED_MODEL)
+    stats = build(kb.docs, rag_app.entity_resolver, rag_app.summarize_node,
+                  embeddings.embed_documents, rag_app.SUMMARIES_FILE)
+    print(json.dumps(stats, indent=2))
+    return 0
+
+
+def build_bundle(args: argparse.Namespace) -> int:
+    root = args.output or rag_app.BUNDLE_CONFIG.get('path') or "./bundle"
+    state = {"phase": None, "timings_ms": {}}
+    kb = rag_app.build_from_sources(state)
+    manifest = rag_app.write_bundle(kb, root, keep=args.keep)
+    print(json.dumps({
+        "path": os.path.join(root, rag_app.bundle.current_directory(root)),
+        "version": manifest["version"],
+        "compatibility": manifest["compatibility"],
+        "contents": manifest["contents"],
+        "bytes": sum(entry["bytes"] for entry in manifest["files"].values()),
+        "timings_ms": state["timings_ms"]
+    }, indent=2))
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline knowledge-base builds")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    vectors = commands.add_parser("vectors", help="Ingest sources, embed chunks and export vector shards")
+    vectors.set_defaults(handler=build_vectors)
+
+    summaries = commands.add_parser("summaries", help="Summarize states, programs and sections and embed them")
+    summaries.add_argument("--mode", choices=["llm", "extractive"], help="Override summaries.mode")
+    summaries.set_defaults(handler=build_summaries)
+
+    bundle = commands.add_parser("bundle", help="Build from the sources and write the artifact bundle servers load")
+    bundle.add_argument("--output", help="Bundle root directory (default: bundle.path, else ./bundle)")
+    bundle.add_argument("--keep", type=int, default=2, help="Versions to keep under the root")
+    bundle.set_defaults(handler=build_bundle)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
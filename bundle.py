@@ -0,0 +1,189 @@
+"""
+TEAI Artifact Bundle
+====================
+Everything the server derives from the sources, built once by
+`python build.py bundle` and loaded by every worker and replica in place of
+re-ingesting the sources and opening Chroma:
+
+    bundle/
+      CURRENT                      the directory to serve
+      <version>-<quantization>-<digest>/
+        manifest.json              format, version, compatibility, size and sha256 of every file
+        chunks/                    chunk table: corpus.bin, vocab.json, one .npy per column
+        metadata_index.json
+        section_hierarchy.json
+        shards/                    vector shards and their quantized copies (vector_index.py)
+        summaries.json, .npy       hierarchical summaries, if they were built
+
+Arrays and vectors are memory-mapped on load, so startup only reads files,
+and those files are identical on every replica. open_bundle() raises
+BundleError when a bundle is missing files or fails its checksums. It also
+raises when the bundle was built for another format version, ingest schema,
+embedding model or quantization. In each case nothing is served that the
+other replicas would answer differently.
+
+Each build is written to a new directory named after the knowledge-base
+version, the quantization and a digest of its files, and CURRENT is switched
+last. An existing directory is never rewritten: publishing identical files
+again only switches CURRENT back to it. Servers map every file at startup
+and hold a lease on their directory (leases.py). Pruning keeps the newest
+few directories plus any a running server still holds.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Tuple
+
+import leases
+
+FORMAT = "teai-bundle"
+FORMAT_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "CURRENT"
+
+
+class BundleError(Exception):
+    """The bundle is missing, corrupt, or incompatible with this server's configuration."""
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def write_json(path: str, value: Any):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(value, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def read_json(path: str) -> Any:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def current_directory(root: str) -> str:
+    try:
+        with open(os.path.join(root, CURRENT_FILE), encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError as e:
+        raise BundleError(f"No bundle at {root} (missing {CURRENT_FILE}); run `python build.py bundle`") from e
+
+
+def set_current(root: str, name: str):
+    tmp_path = os.path.join(root, f"{CURRENT_FILE}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(name + "\n")
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def staging_directory(root: str, version: str) -> str:
+    """Empty directory to write a new bundle into, renamed into place by publish_bundle()"""
+    path = os.path.join(root, f".{version}.{os.getpid()}.tmp")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    return path
+
+
+def publish_bundle(root: str, version: str, staging: str, compatibility: Dict[str, Any],
+                   contents: Dict[str, Any], keep: int = 2) -> Dict[str, Any]:
+    """
+    Checksum everything written to staging, add the manifest, move it to
+    root/<version>-<quantization>-<digest> and point CURRENT at it. Returns
+    the manifest. If that directory already exists it holds the same files,
+    so staging is discarded and the existing directory is left untouched.
+    """
+    files = {}
+    for directory, _, names in os.walk(staging):
+        for name in names:
+            path = os.path.join(directory, name)
+            relative = os.path.relpath(path, staging).replace(os.sep, "/")
+            files[relative] = {"bytes": os.path.getsize(path), "sha256": file_sha256(path)}
+    manifest = {
+        "format": FORMAT,
+        "format_version": FORMAT_VERSION,
+        "version": version,
+        "built_at": time.time(),
+        "compatibility": compatibility,
+        "contents": contents,
+        "files": dict(sorted(files.items()))
+    }
+    write_json(os.path.join(staging, MANIFEST_FILE), manifest)
+
+    digest = hashlib.sha256(json.dumps(manifest["files"], sort_keys=True).encode()).hexdigest()[:8]
+    name = f"{version}-{compatibility.get('quantization') or 'none'}-{digest}"
+    target = os.path.join(root, name)
+    if os.path.exists(target):
+        shutil.rmtree(staging, ignore_errors=True)
+        manifest = read_json(os.path.join(target, MANIFEST_FILE))
+        print(f"[*] Bundle {name} was already built; serving it again")
+    else:
+        os.rename(staging, target)
+    set_current(root, name)
+    prune_bundles(root, keep)
+    return manifest
+
+
+def prune_bundles(root: str, keep: int):
+    """
+    Delete all but the keep most recently built directories, except the
+    current one and any that a running server still holds a lease on
+    """
+    current = current_directory(root)
+    built = []
+    for name in os.listdir(root):
+        manifest_path = os.path.join(root, name, MANIFEST_FILE)
+        if not name.startswith(".") and os.path.exists(manifest_path):
+            built.append((os.path.getmtime(manifest_path), name))
+    for _, name in sorted(built, reverse=True)[max(keep, 1):]:
+        if name == current:
+            continue
+        if leases.remove_if_unused(os.path.join(root, name)):
+            print(f"[*] Removed old bundle {name}")
+        else:
+            print(f"[*] Kept old bundle {name} (still open in some process)")
+
+
+def open_bundle(root: str, compatibility: Dict[str, Any],
+                verify_checksums: bool = True) -> Tuple[str, Dict[str, Any]]:
+    """
+    (directory, manifest) of the current bundle under root, after checking
+    its format, compatibility and files. Raises BundleError.
+    """
+    path = os.path.join(root, current_directory(root))
+    try:
+        manifest = read_json(os.path.join(path, MANIFEST_FILE))
+    except (OSError, ValueError) as e:
+        raise BundleError(f"Bundle {path} has no readable {MANIFEST_FILE}: {e}") from e
+
+    if manifest.get("format") != FORMAT or manifest.get("format_version") != FORMAT_VERSION:
+        raise BundleError(
+            f"Bundle {path} is {manifest.get('format')} v{manifest.get('format_version')}, "
+            f"this server reads {FORMAT} v{FORMAT_VERSION}; rebuild it with `python build.py bundle`"
+        )
+    built_for = manifest.get("compatibility", {})
+    mismatches = [f"{key}: bundle {built_for.get(key)!r}, server {value!r}"
+                  for key, value in compatibility.items() if built_for.get(key) != value]
+    if mismatches:
+        raise BundleError(f"Bundle {path} does not match this server ({'; '.join(mismatches)}); "
+                          "rebuild it with `python build.py bundle`")
+
+    for relative, expected in manifest.get("files", {}).items():
+        file_path = os.path.join(path, relative)
+        try:
+            size = os.path.getsize(file_path)
+        except OSError as e:
+            raise BundleError(f"Bundle {path} is missing {relative}") from e
+        if size != expected["bytes"]:
+            raise BundleError(f"Bundle {path}: {relative} is {size} bytes, the manifest says {expected['bytes']}")
+        if verify_checksums and file_sha256(file_path) != expected["sha256"]:
+            raise BundleError(f"Bundle {path}: {relative} does not match its manifest checksum")
+    return path, manifest
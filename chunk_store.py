@@ -0,0 +1,305 @@
+"""
+TEAI Chunk Store
+================
+Columnar, read-only table of the knowledge-base chunks.
+
+Instead of one LangChain Document (with its own metadata dict of repeated
+long strings) per chunk, the table keeps:
+
+- one UTF-8 corpus buffer holding every section's text once, written to
+  chroma_db_v2/<version>/corpus.bin and memory-mapped, so forked workers
+  share its pages and overlapping chunks do not duplicate text
+- per section: start/end offsets into the buffer and integer codes for the
+  metadata strings (state, certification, section, ids, source), each
+  distinct string stored once in a per-field vocabulary
+- per chunk: start/end offsets into the buffer, its section, its byte
+  offset in the source file and a uint16 token count
+
+save() writes the table as files (the artifact bundle, see bundle.py) and
+load() opens them again with every array memory-mapped.
+
+Indexing the table returns a ChunkView, a two-slot object with the
+page_content/metadata interface the agents read. Document objects are only
+created by document(), at the LangChain boundary; section reads are slices
+of the buffer.
+"""
+from __future__ import annotations
+
+import json
+import mmap
+import os
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# Metadata strings shared by every chunk of a section, stored as vocabulary codes
+SECTION_FIELDS = ("state", "certification", "section", "source", "source_file", "source_path",
+                  "state_id", "cert_id", "aid_id", "section_id")
+
+MAX_TOKEN_COUNT = np.iinfo(np.uint16).max
+
+# Per-section and per-chunk columns, one .npy file each in a saved table
+ARRAY_FIELDS = ("section_starts", "section_ends", "section_mtime", "chunk_starts", "chunk_ends",
+                "chunk_section", "chunk_source_start", "token_counts")
+
+
+class ChunkView:
+    """One row of a ChunkTable, read like a Document."""
+
+    __slots__ = ("table", "row")
+
+    def __init__(self, table: "ChunkTable", row: int):
+        self.table = table
+        self.row = row
+
+    @property
+    def page_content(self) -> str:
+        return self.table.text(self.row)
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.table.metadata(self.row)
+
+    @property
+    def token_count(self) -> int:
+        return int(self.table.token_counts[self.row])
+
+    def to_document(self) -> Document:
+        return self.table.document(self.row)
+
+
+class ChunkTableBuilder:
+    """Accumulates sections and their chunks, then freezes them into a ChunkTable."""
+
+    def __init__(self):
+        self.corpus = bytearray()
+        self.vocab: Dict[str, Dict[str, int]] = {field: {} for field in SECTION_FIELDS}
+        self.section_codes: Dict[str, List[int]] = {field: [] for field in SECTION_FIELDS}
+        self.section_bounds: List[Tuple[int, int]] = []
+        self.section_mtime: List[float] = []
+        self.chunk_bounds: List[Tuple[int, int]] = []
+        self.chunk_section: List[int] = []
+        self.chunk_source_start: List[int] = []
+        self.chunk_tokens: List[int] = []
+
+    def add_section(self, text: str, metadata: Dict[str, Any], source_start: int, mtime: float,
+                    chunks: List[Tuple[int, int, int]]):
+        """
+        text is the section; chunks are (start, end, tokens) byte ranges within
+        it, and source_start is the section's byte offset in its source file.
+        """
+        encoded = text.encode("utf-8")
+        base = len(self.corpus)
+        self.corpus.extend(encoded)
+        section = len(self.section_bounds)
+        self.section_bounds.append((base, base + len(encoded)))
+        self.section_mtime.append(mtime)
+        for field in SECTION_FIELDS:
+            codes = self.vocab[field]
+            value = metadata.get(field) or ""
+            self.section_codes[field].append(codes.setdefault(value, len(codes)))
+
+        for start, end, tokens in chunks:
+            self.chunk_bounds.append((base + start, base + end))
+            self.chunk_section.append(section)
+            self.chunk_source_start.append(source_start + start)
+            self.chunk_tokens.append(min(tokens, MAX_TOKEN_COUNT))
+
+    def build(self) -> "ChunkTable":
+        def array(values, dtype, shape=None):
+            result = np.asarray(values, dtype=dtype)
+            return result.reshape(shape) if shape and not len(values) else result
+
+        section_bounds = array(self.section_bounds, np.int64, (0, 2))
+        chunk_bounds = array(self.chunk_bounds, np.int64, (0, 2))
+        return ChunkTable(
+            corpus=bytes(self.corpus),
+            vocab={field: list(codes) for field, codes in self.vocab.items()},
+            section_codes={field: np.asarray(codes, dtype=np.int32)
+                           for field, codes in self.section_codes.items()},
+            section_starts=section_bounds[:, 0].copy(),
+            section_ends=section_bounds[:, 1].copy(),
+            section_mtime=np.asarray(self.section_mtime, dtype=np.float64),
+            chunk_starts=chunk_bounds[:, 0].copy(),
+            chunk_ends=chunk_bounds[:, 1].copy(),
+            chunk_section=np.asarray(self.chunk_section, dtype=np.int32),
+            chunk_source_start=np.asarray(self.chunk_source_start, dtype=np.int64),
+            token_counts=np.asarray(self.chunk_tokens, dtype=np.uint16)
+        )
+
+
+class ChunkTable:
+    """Parallel arrays over one corpus buffer; see the module docstring."""
+
+    def __init__(self, corpus, vocab: Dict[str, List[str]], section_codes: Dict[str, np.ndarray],
+                 section_starts: np.ndarray, section_ends: np.ndarray, section_mtime: np.ndarray,
+                 chunk_starts: np.ndarray, chunk_ends: np.ndarray, chunk_section: np.ndarray,
+                 chunk_source_start: np.ndarray, token_counts: np.ndarray):
+        self.corpus = corpus
+        self.vocab = vocab
+        self._lookup = {field: {value: code for code, value in enumerate(values)}
+                        for field, values in vocab.items()}
+        self.section_codes = section_codes
+        self.section_starts = section_starts
+        self.section_ends = section_ends
+        self.section_mtime = section_mtime
+        self.chunk_starts = chunk_starts
+        self.chunk_ends = chunk_ends
+        self.chunk_section = chunk_section
+        self.chunk_source_start = chunk_source_start
+        self.token_counts = token_counts
+        # Chunks are stored section by section, so section i's rows are
+        # section_row_starts[i]:section_row_starts[i + 1]
+        self.section_row_starts = np.searchsorted(chunk_section, np.arange(len(section_starts) + 1))
+        self._corpus_file = None
+
+    # -- sequence interface (rows are chunks) --
+
+    def __len__(self) -> int:
+        return len(self.chunk_starts)
+
+    def __getitem__(self, row: int) -> ChunkView:
+        if not -len(self) <= row < len(self):
+            raise IndexError(row)
+        return ChunkView(self, row % len(self))
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        return (ChunkView(self, row) for row in range(len(self)))
+
+    # -- chunk access --
+
+    def text_bytes(self, row: int) -> memoryview:
+        """The chunk's UTF-8 bytes, as a view into the corpus buffer (no copy)."""
+        return memoryview(self.corpus)[self.chunk_starts[row]:self.chunk_ends[row]]
+
+    def text(self, row: int) -> str:
+        return str(self.text_bytes(row), "utf-8")
+
+    def value(self, field: str, row: int) -> str:
+        """A metadata string of a chunk, without materializing the metadata dict."""
+        return self.vocab[field][self.section_codes[field][self.chunk_section[row]]]
+
+    def column(self, field: str, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        """Vocabulary codes of field for rows (default: every chunk)."""
+        sections = self.chunk_section if rows is None else self.chunk_section[rows]
+        return self.section_codes[field][sections]
+
+    def code(self, field: str, value: str) -> Optional[int]:
+        return self._lookup[field].get(value)
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        section = self.chunk_section[row]
+        metadata = {field: self.vocab[field][self.section_codes[field][section]] for field in SECTION_FIELDS}
+        byte_start = int(self.chunk_source_start[row])
+        metadata.update({
+            "byte_start": byte_start,
+            "byte_end": byte_start + int(self.chunk_ends[row] - self.chunk_starts[row]),
+            "source_mtime": float(self.section_mtime[section])
+        })
+        return metadata
+
+    def document(self, row: int) -> Document:
+        """Materialize a LangChain Document, for the agents and vector-store callers."""
+        from langchain_core.documents import Document
+        return Document(page_content=self.text(row), metadata=self.metadata(row))
+
+    # -- sections --
+
+    @property
+    def section_count(self) -> int:
+        return len(self.section_starts)
+
+    def section_value(self, field: str, section: int) -> str:
+        return self.vocab[field][self.section_codes[field][section]]
+
+    def find_sections(self, normalize: Optional[Callable[[str], str]] = None, **values: str) -> np.ndarray:
+        """
+        Section numbers whose metadata equals every given field value, after
+        applying normalize (if given) to the stored values. Only the field
+        vocabularies are scanned, not the chunks.
+        """
+        mask = np.ones(len(self.section_starts), dtype=bool)
+        for field, value in values.items():
+            codes = [code for code, stored in enumerate(self.vocab[field])
+                     if (normalize(stored) if normalize else stored) == value]
+            mask &= np.isin(self.section_codes[field], codes)
+        return np.nonzero(mask)[0]
+
+    def section_text(self, section: int) -> str:
+        return str(memoryview(self.corpus)[self.section_starts[section]:self.section_ends[section]], "utf-8")
+
+    def section_rows(self, section: int) -> np.ndarray:
+        """Chunk rows of a section, in order."""
+        return np.arange(self.section_row_starts[section], self.section_row_starts[section + 1])
+
+    # -- storage --
+
+    def map_corpus(self, path: str):
+        """
+        Move the corpus buffer into a file (written once per version) and
+        memory-map it read-only, so processes share one copy of the text.
+        """
+        size = len(self.corpus)
+        if not os.path.exists(path) or os.path.getsize(path) != size:
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self.corpus)
+            os.replace(tmp_path, path)
+        self._open_corpus(path)
+
+    def _open_corpus(self, path: str):
+        if os.path.getsize(path) == 0:
+            self.corpus = b""
+            return
+        self._corpus_file = open(path, "rb")
+        self.corpus = mmap.mmap(self._corpus_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def save(self, directory: str) -> List[str]:
+        """Write corpus.bin, vocab.json and one .npy per array to directory; returns the file names."""
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "corpus.bin"), "wb") as f:
+            f.write(self.corpus)
+        with open(os.path.join(directory, "vocab.json"), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        names = ["corpus.bin", "vocab.json"]
+        arrays = {name: getattr(self, name) for name in ARRAY_FIELDS}
+        arrays.update({f"section_codes.{field}": codes for field, codes in self.section_codes.items()})
+        for name, values in arrays.items():
+            np.save(os.path.join(directory, f"{name}.npy"), np.asarray(values))
+            names.append(f"{name}.npy")
+        return names
+
+    @classmethod
+    def load(cls, directory: str) -> "ChunkTable":
+        """Open a table written by save(), with the corpus and every array memory-mapped read-only."""
+        with open(os.path.join(directory, "vocab.json"), encoding="utf-8") as f:
+            vocab = json.load(f)
+
+        def array(name: str) -> np.ndarray:
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+
+        table = cls(
+            corpus=b"",
+            vocab=vocab,
+            section_codes={field: array(f"section_codes.{field}") for field in SECTION_FIELDS},
+            **{name: array(name) for name in ARRAY_FIELDS}
+        )
+        table._open_corpus(os.path.join(directory, "corpus.bin"))
+        return table
+
+    def stats(self) -> Dict[str, Any]:
+        arrays = (self.section_starts, self.section_ends, self.section_mtime, self.chunk_starts,
+                  self.chunk_ends, self.chunk_section, self.chunk_source_start, self.token_counts,
+                  *self.section_codes.values())
+        return {
+            "chunks": len(self),
+            "sections": len(self.section_starts),
+            "corpus_bytes": len(self.corpus),
+            "corpus_mapped": isinstance(self.corpus, mmap.mmap),
+            "array_bytes": sum(a.nbytes for a in arrays),
+            "vocabulary": {field: len(values) for field, values in self.vocab.items()},
+            "tokens": int(self.token_counts.sum())
+        }
@@ -0,0 +1,262 @@
+"""
+TEAI Embedding Pipeline
+=======================
+Streams chunks into the vector store: chunks -> batches -> embed -> upsert.
+
+- Chunks are pulled lazily and grouped into batches of embedding.batch_size.
+- Up to embedding.concurrency batches are embedded at once, under request
+  and token rate limits; at most max_in_flight_batches are held in memory,
+  so a build uses the same memory whatever the corpus size.
+- Batches are upserted in order and the number of upserted chunks is
+  checkpointed after each one. Ids are stable, so an interrupted build
+  resumes after the last upserted batch and re-running a batch is harmless.
+- With an EmbeddingStore, vectors are also kept by model and chunk-text
+  hash across knowledge-base versions, so after an edit only the chunks
+  whose text changed are sent to the embedding API.
+- A progress line is printed every few seconds and a throughput summary at
+  the end.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ratelimit import TokenBucket
+from sessions import estimate_tokens
+
+# (id, text, metadata)
+Chunk = Tuple[str, str, Dict[str, Any]]
+
+PROGRESS_INTERVAL_SECONDS = 5
+
+
+def batched(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class BuildCheckpoint:
+    """Number of chunks already upserted into a store, persisted next to it."""
+
+    def __init__(self, path: str, total: int):
+        self.path = path
+        self.total = total
+        self.done = 0
+        self.complete = False
+        self.exists = False
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.exists = True
+            if data.get("total") == total:
+                self.done = data.get("done", 0)
+                self.complete = data.get("complete", False)
+        except (OSError, ValueError):
+            pass
+
+    def save(self, done: int, complete: bool = False):
+        self.done = done
+        self.complete = complete
+        self.exists = True
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"total": self.total, "done": done, "complete": complete}, f)
+        os.replace(tmp_path, self.path)
+
+
+class EmbeddingStore:
+    """
+    Embeddings by (model, sha256 of the chunk text) in SQLite, shared by every
+    knowledge-base version built with that model. Safe to use from the
+    pipeline's threads.
+    """
+
+    def __init__(self, path: str, model: str):
+        self.model = model
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._db.commit()
+
+    def key(self, text: str) -> str:
+        digest = hashlib.sha256(self.model.encode())
+        digest.update(b"\0")
+        digest.update(text.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Stored vector of each text, or None where it has not been embedded with this model."""
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(keys))})", keys
+            ).fetchall()
+        found = {key: array("f", blob).tolist() for key, blob in rows}
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts: List[str], vectors: List[List[float]]):
+        rows = [(self.key(text), array("f", vector).tobytes()) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._db.commit()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class PipelineStats:
+    def __init__(self, total: int, resumed_from: int):
+        self.total = total
+        self.resumed_from = resumed_from
+        self.chunks = 0
+        self.batches = 0
+        self.tokens = 0
+        self.retries = 0
+        self.reused = 0  # Chunks whose vector came from the EmbeddingStore
+        self.embed_seconds = 0.0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def report(self, force: bool = False):
+        now = time.perf_counter()
+        if not force and now - self._last_report < PROGRESS_INTERVAL_SECONDS:
+            return
+        self._last_report = now
+        done = self.resumed_from + self.chunks
+        rate = self.chunks / self.elapsed if self.elapsed else 0.0
+        remaining = (self.total - done) / rate if rate else 0.0
+        print(f"[*] Embedded {done}/{self.total} chunks ({done * 100 // max(self.total, 1)}%), "
+              f"{rate:.1f} chunks/s, ~{remaining:.0f}s left")
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = self.elapsed
+        return {
+            "chunks": self.chunks,
+            "resumed_from": self.resumed_from,
+            "batches": self.batches,
+            "estimated_tokens": self.tokens,
+            "retries": self.retries,
+            "reused": self.reused,
+            "seconds": round(elapsed, 2),
+            "chunks_per_second": round(self.chunks / elapsed, 1) if elapsed else None,
+            "tokens_per_second": round(self.tokens / elapsed, 1) if elapsed else None,
+            # Time spent inside embedding calls, summed over concurrent batches
+            "embed_seconds": round(self.embed_seconds, 2)
+        }
+
+
+class EmbeddingPipeline:
+    """Concurrent, rate-limited, checkpointed embed-and-upsert of a chunk stream."""
+
+    def __init__(self, embed: Callable[[List[str]], List[List[float]]],
+                 upsert: Callable[[List[str], List[str], List[Dict[str, Any]], List[List[float]]], None],
+                 batch_size: int = 64, concurrency: int = 4, max_in_flight_batches: int = 8,
+                 requests_per_minute: Optional[float] = None, tokens_per_minute: Optional[float] = None,
+                 max_retries: int = 5, store: Optional[EmbeddingStore] = None):
+        self.embed = embed
+        self.upsert = upsert
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_in_flight_batches = max(max_in_flight_batches, concurrency)
+        self.max_retries = max_retries
+        self.store = store
+        self.request_bucket = TokenBucket(requests_per_minute / 60 if requests_per_minute else None,
+                                          capacity=max(1, concurrency))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60 if tokens_per_minute else None,
+                                        capacity=tokens_per_minute / 60 if tokens_per_minute else None)
+
+    def _embed_batch(self, batch: List[Chunk]) -> Tuple[List[List[float]], Dict[str, Any]]:
+        """
+        (vectors, counters) for one batch. Runs on a pool thread, so the
+        counters are added to the stats by the caller rather than here.
+        Only texts missing from the store are embedded.
+        """
+        texts = [text for _, text, _ in batch]
+        vectors = self.store.get_many(texts) if self.store else [None] * len(texts)
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        counters = {"embed_seconds": 0.0, "tokens": 0, "retries": 0, "reused": len(texts) - len(missing)}
+        if not missing:
+            return vectors, counters
+
+        missing_texts = [texts[i] for i in missing]
+        tokens = sum(estimate_tokens(text) for text in missing_texts)
+        for attempt in range(self.max_retries + 1):
+            self.request_bucket.acquire()
+            self.token_bucket.acquire(tokens)
+            start = time.perf_counter()
+            try:
+                embedded = self.embed(missing_texts)
+                counters.update(embed_seconds=time.perf_counter() - start, tokens=tokens, retries=attempt)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                backoff = min(60, 2 ** attempt)
+                print(f"[!] Embedding batch failed ({e}); retrying in {backoff}s")
+                time.sleep(backoff)
+
+        if self.store:
+            self.store.put_many(missing_texts, embedded)
+        for i, vector in zip(missing, embedded):
+            vectors[i] = vector
+        return vectors, counters
+
+    def run(self, chunks: Iterable[Chunk], total: int, checkpoint: BuildCheckpoint) -> Dict[str, Any]:
+        """Embed and upsert every chunk after the checkpoint; returns the throughput summary."""
+        start_at = checkpoint.done if not checkpoint.complete else total
+        stats = PipelineStats(total, start_at)
+        if start_at:
+            print(f"[*] Resuming embedding at chunk {start_at}/{total}")
+
+        window = deque()
+        done = start_at
+        batches = batched(islice(chunks, start_at, None), self.batch_size)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="embed") as pool:
+            while True:
+                # Keep the window full, pulling only as many chunks as it can hold
+                while len(window) < self.max_in_flight_batches:
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+                    window.append((batch, pool.submit(self._embed_batch, batch)))
+                if not window:
+                    break
+
+                # Upsert strictly in order so the checkpoint is a contiguous prefix
+                batch, future = window.popleft()
+                vectors, counters = future.result()
+                stats.embed_seconds += counters["embed_seconds"]
+                stats.tokens += counters["tokens"]
+                stats.retries += counters["retries"]
+                stats.reused += counters["reused"]
+                self.upsert([cid for cid, _, _ in batch], [text for _, text, _ in batch],
+                            [metadata for _, _, metadata in batch], vectors)
+                done += len(batch)
+                stats.chunks += len(batch)
+                stats.batches += 1
+                checkpoint.save(done)
+                stats.report()
+
+        checkpoint.save(done, complete=True)
+        stats.report(force=True)
+        summary = stats.summary()
+        print(f"[*] Embedding finished: {summary}")
+        return summary
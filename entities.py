@@ -0,0 +1,113 @@
+"""
+TEAI Entity Resolver
+====================
+Maps free-text states, certifications, financial aid programs and section
+headings to canonical ids using the alias tables in config.yaml taxonomies.
+
+Used at ingestion to stamp every chunk with state_id / cert_id / aid_id /
+section_id, and at query time to turn analyzer entities and UI filters into
+the same ids, so metadata filters match exactly instead of comparing an
+extracted "Tennessee" against a stored H1 title.
+"""
+from __future__ import annotations
+
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+# taxonomy key in config.yaml -> entity kind
+ENTITY_TAXONOMIES = {
+    "states": "state",
+    "certifications": "cert",
+    "financial_aid": "aid",
+    "sections": "section",
+}
+
+
+def normalize(text: str) -> str:
+    """Lowercase, punctuation to spaces, single-spaced."""
+    return re.sub(r"[^a-z0-9]+", " ", (text or "").lower()).strip()
+
+
+def slugify(text: str) -> str:
+    return normalize(text).replace(" ", "_")
+
+
+class EntityResolver:
+    """Alias lookup for one set of taxonomies."""
+
+    def __init__(self, taxonomies: Dict[str, Any]):
+        # kind -> [(normalized alias, id)], longest alias first so "west virginia" beats "virginia"
+        self.aliases: Dict[str, List[Tuple[str, str]]] = {}
+        # kind -> {id: taxonomy value}
+        self.values: Dict[str, Dict[str, str]] = {}
+
+        for taxonomy, kind in ENTITY_TAXONOMIES.items():
+            pairs = []
+            values = {}
+            for entry in taxonomies.get(taxonomy, []) or []:
+                entity_id = entry.get("id") or slugify(entry["value"])
+                values[entity_id] = entry["value"]
+                for alias in [entry["value"], entry.get("label", ""), entity_id] + list(entry.get("aliases", [])):
+                    if normalize(alias):
+                        pairs.append((normalize(alias), entity_id))
+            pairs.sort(key=lambda pair: len(pair[0]), reverse=True)
+            self.aliases[kind] = pairs
+            self.values[kind] = values
+
+    def resolve_all(self, kind: str, text: Optional[str]) -> List[str]:
+        """Every id whose alias appears as whole words in text, in order of first appearance."""
+        haystack = f" {normalize(text)} "
+        if not haystack.strip():
+            return []
+        found = {}
+        for alias, entity_id in self.aliases.get(kind, []):
+            position = haystack.find(f" {alias} ")
+            if position >= 0 and entity_id not in found:
+                found[entity_id] = position
+                # Blank out the match so "west virginia" does not also count as "virginia"
+                haystack = haystack[:position + 1] + " " * len(alias) + haystack[position + 1 + len(alias):]
+        return sorted(found, key=found.get)
+
+    def resolve(self, kind: str, text: Optional[str]) -> Optional[str]:
+        """Canonical id for text: an exact alias first, else the longest alias found in it."""
+        key = normalize(text)
+        if not key:
+            return None
+        aliases = self.aliases.get(kind, [])
+        for alias, entity_id in aliases:
+            if alias == key:
+                return entity_id
+        haystack = f" {key} "
+        for alias, entity_id in aliases:
+            if f" {alias} " in haystack:
+                return entity_id
+        return None
+
+    def value(self, kind: str, entity_id: str) -> str:
+        """Display value (the taxonomy 'value') for an id."""
+        return self.values.get(kind, {}).get(entity_id, entity_id)
+
+    def from_source(self, source_file: Optional[str]) -> Dict[str, Optional[str]]:
+        """
+        Ids from a <!-- SOURCE: TN-Medical-Assistant.md --> file name: the
+        prefix is the state, the rest is a certification or aid program.
+        """
+        ids = {"state": None, "cert": None, "aid": None}
+        if not source_file:
+            return ids
+        stem = os.path.splitext(os.path.basename(source_file))[0]
+        prefix, _, rest = stem.partition("-")
+        ids["state"] = self.resolve("state", prefix)
+        ids["cert"] = self.resolve("cert", rest)
+        ids["aid"] = self.resolve("aid", stem) or self.resolve("aid", rest)
+        return ids
+
+    def section_id(self, *headings: Optional[str]) -> str:
+        """Canonical section for the deepest heading that has an alias, else a slug of the first."""
+        for heading in reversed([h for h in headings if h]):
+            section = self.resolve("section", heading)
+            if section:
+                return section
+        first = next((h for h in headings if h), "")
+        return slugify(first)
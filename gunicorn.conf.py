@@ -0,0 +1,32 @@
+"""
+Gunicorn configuration for multi-worker serving.
+
+    gunicorn 'app:create_app()' -c gunicorn.conf.py
+
+The app is preloaded: create_app() builds chunks, metadata index, section
+hierarchy and the shared vector matrix once in the master, then the master
+forks. Workers share those pages copy-on-write (the vectors are an mmap'd
+file, so they are shared even if touched), and post_fork gives each worker
+its own LLM clients and agent graph. A hot reload rebuilds the knowledge
+base in every worker, so after one only the mmap'd files stay shared.
+tests/test_gunicorn.py runs this configuration with two workers.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Requests mostly wait on the OpenAI API, so each worker also runs threads.
+# Admission control (config.yaml admission) caps pipeline runs plus their
+# queue below this, leaving threads for cheap endpoints.
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+timeout = 120
+preload_app = True
+
+
+def post_fork(server, worker):
+    import app as rag_app
+
+    rag_app.init_worker()
+    server.log.info("Worker %s initialized", worker.pid)
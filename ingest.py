@@ -0,0 +1,388 @@
+"""
+TEAI Ingestion
+==============
+Turns the markdown corpus into header sections and chunks with provenance.
+
+Sources are every .md file under data.source_dir, or the concatenated
+data.source_file. Every file is split on its <!-- SOURCE: TN-CNA.md -->
+markers (a per-source file simply has none), and each segment is parsed and
+chunked independently, in a process pool when enough has changed. Every
+chunk records the file it came from, its byte range in that file and the
+file's mtime; chunk text is always an exact slice of the file, and of its
+section's text.
+
+Parsed segments are cached in a JSON file keyed by content hash. Files whose
+size and mtime are unchanged are not even read, and in a changed file only
+the segments whose text changed are parsed again, so ingestion cost follows
+the size of the change rather than the size of the corpus.
+"""
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from entities import EntityResolver
+from sessions import estimate_tokens
+
+SOURCE_MARKER = re.compile(r'<!--\s*SOURCE:\s*(.+?)\s*-->')
+
+# Bump when the cached section/chunk layout changes (content is unaffected)
+CACHE_FORMAT = 2
+
+# Markdown headers that start a section, deepest first, and the metadata they set
+HEADER_LEVELS = (("###", "section"), ("##", "certification"), ("#", "state"))
+HEADER_DEPTH = {"state": 1, "certification": 2, "section": 3}
+
+COST_PATTERN = re.compile(r'\$[\d,]+(?:\s*-\s*\$[\d,]+)?')
+DURATION_PATTERNS = [
+    re.compile(r'(\d+)\s*(?:to\s*\d+\s*)?(?:weeks?|months?|hours?)'),
+    re.compile(r'(\d+)-(\d+)\s*(?:weeks?|months?|hours?)')
+]
+
+_resolvers: Dict[str, EntityResolver] = {}
+
+
+def source_paths(data_dir: str, source_file: str, source_dir: Optional[str] = None) -> List[str]:
+    """Files to ingest: every .md under source_dir if configured, else the concatenated file."""
+    if source_dir:
+        return sorted(glob.glob(os.path.join(source_dir, "**", "*.md"), recursive=True))
+    return [os.path.join(data_dir, source_file)]
+
+
+def split_on_source_markers(content: str, default_name: str) -> List[Tuple[str, int, str]]:
+    """[(source name, char offset, text)] for the text before and after each SOURCE marker"""
+    segments = []
+    name = default_name
+    position = 0
+    for match in SOURCE_MARKER.finditer(content):
+        if content[position:match.start()].strip():
+            segments.append((name, position, content[position:match.start()]))
+        name = match.group(1)
+        position = match.end()
+    if content[position:].strip():
+        segments.append((name, position, content[position:]))
+    return segments
+
+
+def split_markdown_sections(text: str) -> List[Tuple[int, int, Dict[str, str]]]:
+    """
+    [(start, end, headers)] for each header section of text, where
+    text[start:end] is the section including its header line, without
+    surrounding whitespace. Headers with no body of their own are folded into
+    the next section, and lines inside code fences are never headers.
+    """
+    sections = []
+    headers: Dict[str, str] = {}
+    start = 0
+    has_body = False
+    in_fence = False
+    position = 0
+
+    def close(end: int):
+        s, e = start, end
+        while s < e and text[s].isspace():
+            s += 1
+        while e > s and text[e - 1].isspace():
+            e -= 1
+        if s < e:
+            sections.append((s, e, dict(headers)))
+
+    for line in text.splitlines(keepends=True):
+        stripped = line.strip()
+        header = None
+        if stripped.startswith(("```", "~~~")):
+            in_fence = not in_fence
+        elif not in_fence:
+            for sep, name in HEADER_LEVELS:
+                if stripped.startswith(sep) and (len(stripped) == len(sep) or stripped[len(sep)] == " "):
+                    header = (name, stripped[len(sep):].strip())
+                    break
+
+        if header:
+            if has_body:
+                close(position)
+                start = position
+                has_body = False
+            depth = HEADER_DEPTH[header[0]]
+            headers = {k: v for k, v in headers.items() if HEADER_DEPTH[k] < depth}
+            headers[header[0]] = header[1]
+        elif stripped:
+            has_body = True
+        position += len(line)
+
+    if has_body:
+        close(position)
+    return sections
+
+
+def extract_details(text: str) -> Dict[str, str]:
+    """Cost and duration mentioned in a section, for the metadata index"""
+    details = {}
+    cost_match = COST_PATTERN.search(text)
+    if cost_match:
+        details["cost"] = cost_match.group()
+    lowered = text.lower()
+    for pattern in DURATION_PATTERNS:
+        duration_match = pattern.search(lowered)
+        if duration_match:
+            details["duration"] = duration_match.group()
+            break
+    return details
+
+
+def resolver_for(taxonomies: Dict[str, Any]) -> EntityResolver:
+    key = json.dumps(taxonomies, sort_keys=True)
+    if key not in _resolvers:
+        _resolvers[key] = EntityResolver(taxonomies)
+    return _resolvers[key]
+
+
+def chunk_segment(name: str, text: str, taxonomies: Dict[str, Any],
+                  chunk_size: int, chunk_overlap: int) -> List[Dict[str, Any]]:
+    """
+    Parse one source segment into sections with canonical ids, details, the
+    section text and its chunks' byte ranges and token counts. Byte offsets
+    are relative to the start of the segment; chunk text is the matching
+    slice of the section text.
+
+    Runs in pool workers, so it only uses its arguments and light imports.
+    """
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    resolver = resolver_for(taxonomies)
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=["\n\n", "\n", ". ", " "]
+    )
+    source_ids = resolver.from_source(name)
+
+    # Char -> byte offsets, computed incrementally since chunk starts only increase
+    ascii_only = text.isascii()
+    last_char, last_byte = 0, 0
+
+    def byte_offset(char_offset: int) -> int:
+        nonlocal last_char, last_byte
+        if ascii_only:
+            return char_offset
+        if char_offset < last_char:
+            last_char, last_byte = 0, 0
+        last_byte += len(text[last_char:char_offset].encode("utf-8"))
+        last_char = char_offset
+        return last_byte
+
+    sections = []
+    for start, end, headers in split_markdown_sections(text):
+        content = text[start:end]
+        state = headers.get("state", "")
+        cert = headers.get("certification", "")
+        section = headers.get("section", "")
+
+        # Canonical ids: the SOURCE file name first, then the H1 title
+        ids = {
+            "state_id": source_ids["state"] or resolver.resolve("state", state) or "",
+            "cert_id": source_ids["cert"] or resolver.resolve("cert", state) or "",
+            "aid_id": source_ids["aid"] or resolver.resolve("aid", state) or "",
+            "section_id": resolver.section_id(cert, section)
+        }
+
+        if len(content) > chunk_size:
+            pieces = []
+            search_from = 0
+            for piece in splitter.split_text(content):
+                offset = content.find(piece, search_from)
+                if offset < 0:
+                    offset = content.find(piece)
+                pieces.append((start + offset, piece))
+                search_from = offset + 1
+        else:
+            pieces = [(start, content)]
+
+        section_start = byte_offset(start)
+        chunks = []
+        for char_start, piece in pieces:
+            byte_start = byte_offset(char_start)
+            chunks.append({
+                "byte_start": byte_start,
+                "byte_end": byte_start + len(piece.encode("utf-8")),
+                "tokens": estimate_tokens(piece)
+            })
+
+        sections.append({
+            "headers": {"state": state, "certification": cert, "section": section},
+            "ids": ids,
+            "details": extract_details(content) if state and cert else {},
+            "text": content,
+            "byte_start": section_start,
+            "byte_end": section_start + len(content.encode("utf-8")),
+            "chunks": chunks
+        })
+    return sections
+
+
+def _chunk_segment_task(args: tuple) -> List[Dict[str, Any]]:
+    return chunk_segment(*args)
+
+
+class Segment:
+    """One SOURCE segment of a file, with its parsed sections once ingested"""
+
+    def __init__(self, name: str, path: str, byte_start: int, digest: str, mtime: float,
+                 text: Optional[str] = None):
+        self.name = name
+        self.path = path
+        self.byte_start = byte_start  # Offset of the segment in its file
+        self.digest = digest
+        self.mtime = mtime
+        self.text = text  # Only kept while the segment waits to be parsed
+        self.sections: List[Dict[str, Any]] = []
+
+
+class Corpus:
+    """Ingested segments in file order, plus a fingerprint of their content"""
+
+    def __init__(self, segments: List[Segment], stats: Dict[str, Any]):
+        self.segments = segments
+        self.stats = stats
+        digest = hashlib.sha256()
+        for segment in segments:
+            digest.update(f"{segment.name}\0{segment.digest}\0".encode("utf-8"))
+        self.fingerprint = digest.hexdigest()
+
+
+class IngestCache:
+    """
+    Parsed segments by content digest, and the segment layout of each file by
+    (size, mtime), persisted as JSON. Entries from other ingest settings are
+    ignored.
+    """
+
+    def __init__(self, path: Optional[str], settings_key: str):
+        self.path = path
+        self.settings_key = settings_key
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.segments: Dict[str, List[Dict[str, Any]]] = {}
+        if path and os.path.exists(path):
+            try:
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("settings") == settings_key:
+                    self.files = data.get("files", {})
+                    self.segments = data.get("segments", {})
+            except (OSError, ValueError) as e:
+                print(f"[!] Ignoring unreadable ingest cache {path}: {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"settings": self.settings_key, "files": self.files, "segments": self.segments},
+                      f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+
+def segment_digest(name: str, text: str) -> str:
+    return hashlib.sha256(f"{name}\0{text}".encode("utf-8")).hexdigest()[:24]
+
+
+def scan_file(path: str, cache: IngestCache) -> Tuple[List[Segment], bool]:
+    """Segments of one file, and whether it was unchanged (and so not read)"""
+    stat = os.stat(path)
+    mtime = stat.st_mtime
+    cached = cache.files.get(path)
+    if (cached and cached["size"] == stat.st_size and cached["mtime_ns"] == stat.st_mtime_ns
+            and all(s["digest"] in cache.segments for s in cached["segments"])):
+        return [Segment(s["name"], path, s["byte_start"], s["digest"], mtime) for s in cached["segments"]], True
+
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+
+    segments = []
+    last_char, last_byte = 0, 0
+    for name, char_start, text in split_on_source_markers(content, os.path.basename(path)):
+        last_byte += len(content[last_char:char_start].encode("utf-8"))
+        last_char = char_start
+        segments.append(Segment(name, path, last_byte, segment_digest(name, text), mtime, text))
+
+    cache.files[path] = {
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "segments": [{"name": s.name, "byte_start": s.byte_start, "digest": s.digest} for s in segments]
+    }
+    return segments, False
+
+
+def ingest_corpus(paths: List[str], taxonomies: Dict[str, Any], chunk_size: int = 1000,
+                  chunk_overlap: int = 200, cache_path: Optional[str] = None, schema_version: str = "",
+                  workers: int = 0, parallel_min_bytes: int = 2 * 1024 * 1024) -> Corpus:
+    """
+    Parse every source file, reusing cached segments and parsing the rest in
+    a process pool once more than parallel_min_bytes changed (workers=0 uses
+    every core).
+    """
+    settings_key = hashlib.sha256(json.dumps(
+        [CACHE_FORMAT, schema_version, chunk_size, chunk_overlap, taxonomies], sort_keys=True
+    ).encode("utf-8")).hexdigest()[:16]
+    cache = IngestCache(cache_path, settings_key)
+
+    segments = []
+    unchanged_files = 0
+    for path in paths:
+        file_segments, unchanged = scan_file(path, cache)
+        segments.extend(file_segments)
+        unchanged_files += unchanged
+
+    # Identical segments (same name and text) are parsed once
+    pending: Dict[str, Segment] = {}
+    for segment in segments:
+        if segment.digest not in cache.segments:
+            pending.setdefault(segment.digest, segment)
+    pending_bytes = sum(len(s.text.encode("utf-8")) for s in pending.values())
+
+    workers = workers or os.cpu_count() or 1
+    pool_size = min(workers, len(pending)) if pending_bytes >= parallel_min_bytes else 1
+    tasks = [(s.name, s.text, taxonomies, chunk_size, chunk_overlap) for s in pending.values()]
+    if pool_size > 1:
+        # spawn: the caller may be multi-threaded (background init), which fork does not survive
+        with ProcessPoolExecutor(max_workers=pool_size,
+                                 mp_context=multiprocessing.get_context("spawn")) as pool:
+            results = list(pool.map(_chunk_segment_task, tasks))
+    else:
+        results = [_chunk_segment_task(task) for task in tasks]
+    for digest, sections in zip(pending, results):
+        cache.segments[digest] = sections
+
+    for segment in segments:
+        segment.sections = cache.segments[segment.digest]
+        segment.text = None
+
+    # Drop entries for files and segments that no longer exist
+    live_paths = set(paths)
+    cache.files = {path: entry for path, entry in cache.files.items() if path in live_paths}
+    live_digests = {segment.digest for segment in segments}
+    stale = [digest for digest in cache.segments if digest not in live_digests]
+    for digest in stale:
+        del cache.segments[digest]
+    if pending or stale or unchanged_files < len(paths):
+        cache.save()
+
+    stats = {
+        "files": len(paths),
+        "files_unchanged": unchanged_files,
+        "segments": len(segments),
+        "segments_parsed": len(pending),
+        "bytes_parsed": pending_bytes,
+        "workers": pool_size
+    }
+    print(f"[*] Ingested {stats['files']} files ({stats['files_unchanged']} unchanged), "
+          f"parsed {stats['segments_parsed']}/{stats['segments']} segments "
+          f"({stats['bytes_parsed']} bytes, {pool_size} worker(s))")
+    return Corpus(segments, stats)
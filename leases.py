@@ -0,0 +1,55 @@
+"""
+TEAI Version Leases
+===================
+Knowledge-base versions live in directories (chroma_db_v2/<version>/, or
+bundle/<version>-<quantization>-<digest>/) whose files are memory-mapped,
+in source mode on first use, so a version directory must not be deleted
+while any process may still read it.
+
+Every process serving a version holds a shared flock on <dir>/.lease for as
+long as it holds that snapshot; forked workers share the master's. Pruning
+takes an exclusive lock without waiting and skips the directories it cannot
+lock, i.e. the ones some process still has open. Without fcntl (Windows),
+or in a read-only directory, no lease is taken and nothing is pruned.
+"""
+from __future__ import annotations
+
+import os
+import shutil
+from typing import IO, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+LEASE_FILE = ".lease"
+
+
+def hold(directory: str) -> Optional[IO]:
+    """Shared lease on directory, held until the returned file is closed or garbage collected."""
+    if fcntl is None:
+        return None
+    try:
+        lease = open(os.path.join(directory, LEASE_FILE), "a")
+    except OSError:
+        return None  # Read-only deploy: nothing here can prune it either
+    fcntl.flock(lease, fcntl.LOCK_SH)
+    return lease
+
+
+def remove_if_unused(directory: str) -> bool:
+    """Delete directory unless some process holds its lease; True if it was deleted."""
+    if fcntl is None:
+        return False
+    try:
+        lease = open(os.path.join(directory, LEASE_FILE), "a")
+    except OSError:
+        return False
+    with lease:
+        try:
+            fcntl.flock(lease, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        shutil.rmtree(directory, ignore_errors=True)
+    return True
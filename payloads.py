@@ -0,0 +1,162 @@
+"""
+TEAI Response Payloads
+======================
+Serialization, compression and HTTP caching for API responses.
+
+- JSON is encoded with orjson when it is installed (the stdlib json module
+  otherwise), both for jsonify() (see FastJSONProvider) and for prebuilt
+  payloads.
+- Read-mostly responses (/api/config, /api/taxonomies, /api/sections,
+  /api/debug/metadata) are serialized once per knowledge-base snapshot into
+  a Payload: the body bytes, their gzip/brotli variants (made on first use)
+  and a strong ETag per variant. A client that sends If-None-Match with the
+  current tag gets a bodiless 304.
+- Other responses above a size threshold are compressed per request with
+  the best encoding the client accepts (brotli needs the optional `brotli`
+  package).
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from flask import Request, Response
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # Optional: faster JSON encoding
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # Optional: br Content-Encoding
+    brotli = None
+
+COMPRESSIBLE_TYPES = ("application/json", "text/")
+
+
+def _default(value: Any) -> Any:
+    """Fallback encoder for values neither encoder handles natively (numpy scalars, sets)."""
+    if hasattr(value, "item"):
+        return value.item()
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    """UTF-8 JSON bytes for obj."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_default, option=option)
+    return json.dumps(obj, default=_default, sort_keys=sort_keys, ensure_ascii=False,
+                      separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider whose jsonify() output goes through dumps() above."""
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return dumps(obj).decode("utf-8")
+
+    def response(self, *args: Any, **kwargs: Any) -> Response:
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps(obj) + b"\n", mimetype=self.mimetype)
+
+
+class Compressor:
+    """Content-Encoding negotiation and the compression settings (config.yaml http.compression)."""
+
+    def __init__(self, enabled: bool = True, min_bytes: int = 1024, gzip_level: int = 6,
+                 brotli_quality: int = 5):
+        self.enabled = enabled
+        self.min_bytes = min_bytes
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    def choose(self, request: Request) -> Optional[str]:
+        """The encoding to use for this request, or None for identity."""
+        if not self.enabled:
+            return None
+        accepted = request.accept_encodings
+        if brotli is not None and accepted["br"]:
+            return "br"
+        if accepted["gzip"]:
+            return "gzip"
+        return None
+
+    def compress(self, body: bytes, encoding: str) -> bytes:
+        if encoding == "br":
+            return brotli.compress(body, quality=self.brotli_quality)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def compress_response(self, request: Request, response: Response) -> Response:
+        """after_request hook: compress a large, not yet encoded text/JSON response."""
+        if (response.direct_passthrough or response.status_code < 200 or response.status_code in (204, 304)
+                or "Content-Encoding" in response.headers
+                or not (response.mimetype or "").startswith(COMPRESSIBLE_TYPES)):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = self.choose(request)
+        if encoding is None:
+            return response
+        body = response.get_data()
+        if len(body) < self.min_bytes:
+            return response
+        response.set_data(self.compress(body, encoding))
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+
+class Payload:
+    """A pre-serialized JSON body with its compressed variants and ETags."""
+
+    def __init__(self, obj: Any, compressor: Compressor, max_age: int = 0):
+        self.body = dumps(obj, sort_keys=True)
+        self.compressor = compressor
+        self.max_age = max_age
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self._encoded: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+
+    def encoded(self, encoding: Optional[str]) -> bytes:
+        if encoding is None or len(self.body) < self.compressor.min_bytes:
+            return self.body
+        data = self._encoded.get(encoding)
+        if data is None:
+            with self._lock:
+                data = self._encoded.get(encoding)
+                if data is None:
+                    data = self._encoded[encoding] = self.compressor.compress(self.body, encoding)
+        return data
+
+    def response(self, request: Request) -> Response:
+        """200 with the negotiated variant, or 304 if the client's copy is current."""
+        encoding = self.compressor.choose(request)
+        if len(self.body) < self.compressor.min_bytes:
+            encoding = None
+        # Each representation gets its own strong tag
+        etag = self.etag if encoding is None else f"{self.etag}-{encoding}"
+
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            response = Response(self.encoded(encoding), mimetype="application/json")
+            if encoding:
+                response.headers["Content-Encoding"] = encoding
+        response.set_etag(etag)
+        response.vary.add("Accept-Encoding")
+        response.cache_control.public = True
+        if self.max_age:
+            response.cache_control.max_age = self.max_age
+        else:
+            response.cache_control.no_cache = True
+        return response
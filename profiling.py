@@ -0,0 +1,168 @@
+"""
+TEAI Request Profiling
+======================
+Opt-in profiling of single requests, for finding where a slow request's
+time goes without redeploying:
+
+- "cprofile": deterministic profile of every Python call in the request
+  thread, saved as a .pstats file (open with `python -m pstats` or snakeviz)
+- "sample": the request thread's stack sampled every few milliseconds,
+  saved as collapsed stacks (flamegraph.pl, speedscope). Samples are wall
+  time, so stacks ending in socket or SSL reads show time spent waiting on
+  the network next to pure-Python work.
+
+Profiles are rate limited and only one runs at a time per process, since a
+profiler slows the request it observes. Old profiles beyond max_profiles
+are deleted.
+"""
+from __future__ import annotations
+
+import cProfile
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from ratelimit import TokenBucket
+
+MODES = ("cprofile", "sample")
+EXTENSIONS = {"cprofile": ".pstats", "sample": ".collapsed"}
+PROFILE_NAME = re.compile(r"^[0-9A-Za-z_-]+\.(pstats|collapsed|txt)$")
+
+
+class StackSampler:
+    """Samples one thread's Python stack on a background thread."""
+
+    def __init__(self, thread_id: int, interval_seconds: float = 0.005):
+        self.thread_id = thread_id
+        self.interval_seconds = interval_seconds
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_seconds):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ActiveProfile:
+    def __init__(self, name: str, mode: str, profiler: Any):
+        self.name = name
+        self.mode = mode
+        self.profiler = profiler
+        self.started = time.perf_counter()
+
+
+class RequestProfiler:
+    """Starts and stores per-request profiles; see the module docstring."""
+
+    def __init__(self, directory: str, max_profiles: int = 50, profiles_per_hour: float = 30,
+                 burst: int = 3, sample_interval_ms: float = 5.0):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self.sample_interval_ms = sample_interval_ms
+        self._bucket = TokenBucket(profiles_per_hour / 3600, burst)
+        self._busy = threading.Lock()
+        self.profiled = 0
+        self.refused = 0
+
+    def start(self, request_id: str, mode: str) -> Optional[ActiveProfile]:
+        """Begin profiling the calling thread; None when rate limited or another profile is running."""
+        if mode not in MODES:
+            raise ValueError(f"Unknown profile mode {mode!r}; use one of {', '.join(MODES)}")
+        if not self._busy.acquire(blocking=False):
+            self.refused += 1
+            return None
+        if self._bucket.try_acquire():
+            self._busy.release()
+            self.refused += 1
+            return None
+
+        name = f"{time.strftime('%Y%m%dT%H%M%S')}-{request_id[:16]}-{mode}"
+        if mode == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = StackSampler(threading.get_ident(), self.sample_interval_ms / 1000)
+            profiler.start()
+        return ActiveProfile(name, mode, profiler)
+
+    def finish(self, active: ActiveProfile, label: str = "") -> str:
+        """Stop profiling and write the profile; returns its file name."""
+        try:
+            elapsed_ms = round((time.perf_counter() - active.started) * 1000, 1)
+            os.makedirs(self.directory, exist_ok=True)
+            filename = active.name + EXTENSIONS[active.mode]
+            path = os.path.join(self.directory, filename)
+            if active.mode == "cprofile":
+                active.profiler.disable()
+                active.profiler.dump_stats(path)
+                # Readable summary next to the binary stats
+                text = io.StringIO()
+                text.write(f"{label} ({elapsed_ms} ms)\n\n")
+                pstats.Stats(active.profiler, stream=text).sort_stats("cumulative").print_stats(40)
+                with open(os.path.join(self.directory, active.name + ".txt"), "w", encoding="utf-8") as f:
+                    f.write(text.getvalue())
+            else:
+                active.profiler.stop()
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(active.profiler.collapsed())
+            self.profiled += 1
+            self._prune()
+            print(f"[*] Profiled {label} ({elapsed_ms} ms) -> {path}")
+            return filename
+        finally:
+            self._busy.release()
+
+    def _prune(self):
+        names = sorted(self.list(), key=lambda entry: entry["modified"])
+        for entry in names[:max(0, len(names) - self.max_profiles)]:
+            try:
+                os.remove(os.path.join(self.directory, entry["name"]))
+            except OSError:
+                pass
+
+    def list(self) -> List[Dict[str, Any]]:
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for name in os.listdir(self.directory):
+            if PROFILE_NAME.match(name):
+                stat = os.stat(os.path.join(self.directory, name))
+                entries.append({"name": name, "bytes": stat.st_size, "modified": stat.st_mtime})
+        return sorted(entries, key=lambda entry: entry["modified"], reverse=True)
+
+    def path(self, name: str) -> Optional[str]:
+        """Path of a stored profile, or None for unknown or unsafe names."""
+        if not PROFILE_NAME.match(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+    def stats(self) -> Dict[str, Any]:
+        return {"profiled": self.profiled, "refused": self.refused, "running": self._busy.locked()}
@@ -0,0 +1,95 @@
+"""
+TEAI Query Log
+==============
+Compact append-only log of /api/query traffic, one JSON line per question:
+
+    {"t": 1760000000, "q": "cna requirements in tennessee", "f": {"state": "Tennessee"},
+     "qt": "requirements", "ms": 4210, "c": "miss", "p": "full"}
+
+- t: unix time; q: normalized question; f: UI filters (omitted when empty)
+- qt: query type; ms: latency; p: pipeline
+- c: cache outcome: hit, miss, uncached (degraded or follow-up turn), rejected
+
+Writes go through O_APPEND, one write per line, so several worker processes
+can share the file. Past max_bytes it is rotated to <path>.1 ... <path>.N.
+The cache warmer (see app.py) reads the most frequent questions back with
+top().
+"""
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class QueryLog:
+    """Append-only JSON-lines log with size-based rotation."""
+
+    def __init__(self, path: str, max_bytes: int = 10 * 1024 * 1024, backups: int = 3):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def _rotate(self):
+        for number in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{number}"):
+                os.replace(f"{self.path}.{number}", f"{self.path}.{number + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def record(self, question: str, filters: Optional[Dict[str, Any]], query_type: Optional[str],
+               latency_ms: float, cache: str, pipeline: str = "full"):
+        entry = {"t": int(time.time()), "q": question}
+        if filters:
+            entry["f"] = filters
+        entry.update({"qt": query_type, "ms": int(latency_ms), "c": cache, "p": pipeline})
+        line = (json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            try:
+                if self.max_bytes and os.path.getsize(self.path) > self.max_bytes:
+                    self._rotate()
+            except OSError:
+                pass
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            self.written += 1
+
+    def entries(self) -> List[Dict[str, Any]]:
+        """Every readable entry, oldest file first."""
+        paths = [f"{self.path}.{number}" for number in range(self.backups, 0, -1)] + [self.path]
+        entries = []
+        for path in paths:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entries.append(json.loads(line))
+                        except ValueError:
+                            continue  # A line cut short by a crash
+            except OSError:
+                continue
+        return entries
+
+    def top(self, n: int, since_seconds: Optional[float] = None) -> List[Tuple[str, Dict[str, Any], int]]:
+        """The n most asked (question, filters, count), optionally only within the last since_seconds."""
+        cutoff = time.time() - since_seconds if since_seconds else 0
+        counts: Counter = Counter()
+        for entry in self.entries():
+            if entry.get("t", 0) >= cutoff and entry.get("c") != "rejected" and entry.get("q"):
+                counts[(entry["q"], json.dumps(entry.get("f") or {}, sort_keys=True))] += 1
+        return [(question, json.loads(filters), count) for (question, filters), count in counts.most_common(n)]
+
+    def stats(self) -> Dict[str, Any]:
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            size = 0
+        return {"path": self.path, "bytes": size, "written": self.written}
@@ -0,0 +1,193 @@
+"""
+TEAI Rate Limiting
+==================
+Thread-safe token bucket, used to keep embedding builds under the provider's
+request and token limits, and the admission control in front of the
+expensive API endpoints:
+
+- ClientRateLimiter: one token bucket per client, for 429s
+- AdmissionController: a cap on concurrent pipeline runs with a short,
+  bounded wait queue, for 503s when the process is saturated
+
+Both are per process; under gunicorn every worker has its own.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from caches import LRUCache
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens, refilled continuously at rate per second.
+    A rate of None means unlimited.
+    """
+
+    def __init__(self, rate: Optional[float], capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else (rate or 0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, amount: float = 1) -> float:
+        """Take amount tokens if available; returns 0 on success, else seconds until they would be."""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            self._refill(time.monotonic())
+            # Requests larger than the bucket go through once it is full
+            amount = min(amount, self.capacity)
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def acquire(self, amount: float = 1):
+        """Block until amount tokens are available, then take them."""
+        while True:
+            wait = self.try_acquire(amount)
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class Overloaded(Exception):
+    """Request refused by admission control; retry_after is in whole seconds."""
+
+    def __init__(self, status: int, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ClientRateLimiter:
+    """Token bucket per client key (requests_per_minute, bursts up to burst)."""
+
+    def __init__(self, requests_per_minute: float, burst: Optional[float] = None, max_clients: int = 10000):
+        self.rate = requests_per_minute / 60
+        self.burst = burst if burst is not None else max(1.0, requests_per_minute / 6)
+        self._buckets = LRUCache(max_entries=max_clients)
+        self._lock = threading.Lock()
+        self.limited = 0
+
+    def check(self, client: str):
+        """Take one token for client; raises Overloaded (429) when its bucket is empty."""
+        with self._lock:
+            bucket = self._buckets.get(client)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.burst)
+                self._buckets.put(client, bucket)
+        wait = bucket.try_acquire()
+        if wait:
+            with self._lock:
+                self.limited += 1
+            raise Overloaded(429, "rate_limited", max(1, math.ceil(wait)))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"clients": len(self._buckets), "limited": self.limited}
+
+
+class AdmissionController:
+    """
+    Lets at most max_concurrent callers run at once. Up to max_queue more
+    wait, in arrival order, for at most max_queue_wait_seconds (the queue-time
+    SLO); anyone beyond that is refused at once with a Retry-After estimated
+    from recent run times. A max_concurrent of 0 or None admits everyone.
+
+    Admission is strictly FIFO: a newcomer queues whenever anyone is already
+    waiting, even if a slot has just been freed, and only the head of the
+    queue takes a free slot.
+    """
+
+    def __init__(self, max_concurrent: Optional[int], max_queue: int = 0, max_queue_wait_seconds: float = 2.0):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.max_queue_wait_seconds = max_queue_wait_seconds
+        self._cond = threading.Condition()
+        self._queue = deque()  # One ticket per waiting caller, in arrival order
+        self.active = 0
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_queue_timeout = 0
+        self.max_queue_wait_ms = 0.0
+        self._avg_run_seconds: Optional[float] = None
+
+    @property
+    def waiting(self) -> int:
+        return len(self._queue)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue has probably drained."""
+        if not self._avg_run_seconds or not self.max_concurrent:
+            return 1
+        return max(1, math.ceil(self._avg_run_seconds * (self.waiting + 1) / self.max_concurrent))
+
+    @contextmanager
+    def admit(self) -> Iterator[float]:
+        """Hold a slot for the with-block; yields the seconds spent queued. Raises Overloaded (503)."""
+        if not self.max_concurrent:
+            yield 0.0
+            return
+
+        arrived = time.monotonic()
+        with self._cond:
+            if self._queue or self.active >= self.max_concurrent:
+                if len(self._queue) >= self.max_queue:
+                    self.rejected_queue_full += 1
+                    raise Overloaded(503, "queue_full", self.retry_after())
+                ticket = object()
+                self._queue.append(ticket)
+                try:
+                    deadline = arrived + self.max_queue_wait_seconds
+                    while self._queue[0] is not ticket or self.active >= self.max_concurrent:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self.rejected_queue_timeout += 1
+                            raise Overloaded(503, "queue_timeout", self.retry_after())
+                        self._cond.wait(remaining)
+                finally:
+                    self._queue.remove(ticket)
+                    # The head changed (admitted or gave up); let the new head check for a slot
+                    self._cond.notify_all()
+            self.active += 1
+            self.admitted += 1
+            queued = time.monotonic() - arrived
+            self.max_queue_wait_ms = max(self.max_queue_wait_ms, queued * 1000)
+
+        started = time.monotonic()
+        try:
+            yield queued
+        finally:
+            elapsed = time.monotonic() - started
+            with self._cond:
+                self.active -= 1
+                # Exponential moving average of run time, for Retry-After
+                self._avg_run_seconds = (elapsed if self._avg_run_seconds is None
+                                         else 0.8 * self._avg_run_seconds + 0.2 * elapsed)
+                # Only the head of the queue may take the slot, so wake everyone and let it find itself
+                self._cond.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "active": self.active,
+                "waiting": self.waiting,
+                "admitted": self.admitted,
+                "rejected_queue_full": self.rejected_queue_full,
+                "rejected_queue_timeout": self.rejected_queue_timeout,
+                "max_queue_wait_ms": round(self.max_queue_wait_ms, 1),
+                "avg_run_ms": round(self._avg_run_seconds * 1000, 1) if self._avg_run_seconds else None
+            }
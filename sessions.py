@@ -0,0 +1,132 @@
+"""
+TEAI Conversation Sessions
+==========================
+Compact per-session state for multi-turn /api/query conversations.
+
+A session keeps only what the next turn needs:
+- the resolved entities (state, certification, ...) so follow-ups like
+  "what about in West Virginia?" inherit the rest
+- a rolling summary of the conversation, capped at a token budget, so each
+  turn's prompt stays bounded no matter how long the conversation runs
+- the last retrieval set with its scores, reused when a follow-up resolves
+  to the same entities
+
+Sessions live in an in-process LRU cache with a TTL. Under multiple workers
+use sticky sessions (or a single worker) so a conversation stays on one
+process.
+"""
+from __future__ import annotations
+
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+from caches import LRUCache
+
+_encoding = None
+
+
+def estimate_tokens(text: str) -> int:
+    """Token count with tiktoken when available, else the ~4 chars/token rule of thumb."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return len(text) // 4 + 1
+
+
+def first_sentences(text: str, max_chars: int = 240) -> str:
+    """Leading sentences of an answer, without markdown noise, up to max_chars."""
+    flat = re.sub(r"[#*_`>|]+", "", text)
+    flat = re.sub(r"\s+", " ", flat).strip()
+    if len(flat) <= max_chars:
+        return flat
+    cut = flat[:max_chars]
+    end = cut.rfind(". ")
+    return cut[:end + 1] if end > max_chars // 3 else cut.rstrip() + "…"
+
+
+def truncate_to_tokens(lines: List[str], max_tokens: int) -> List[str]:
+    """Drop the oldest lines until the rest fit in max_tokens."""
+    while lines and estimate_tokens("\n".join(lines)) > max_tokens:
+        lines = lines[1:]
+    return lines
+
+
+def extractive_summary(summary: str, question: str, answer: str, max_tokens: int) -> str:
+    """Append the latest turn as a Q/A line and trim the oldest turns to the budget."""
+    lines = summary.splitlines() if summary else []
+    lines.append(f"Q: {question.strip()} | A: {first_sentences(answer)}")
+    return "\n".join(truncate_to_tokens(lines, max_tokens))
+
+
+class ConversationSession:
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.turns = 0
+        self.entities: Dict[str, Any] = {}
+        self.summary = ""
+        self.last_retrieval: Optional[Dict[str, Any]] = None
+        self.lock = threading.Lock()
+
+    def record_turn(self, question: str, result: Dict[str, Any], kb_version: str,
+                    summarize: Callable[[str, str, str], str], resolve_ids: Callable[[str, Any], List[str]]):
+        """Fold a completed pipeline run into the session; resolve_ids as for retrieval_key()."""
+        with self.lock:
+            self.turns += 1
+            # Keep entities from earlier turns unless this turn resolved new ones
+            for name, value in (result.get("extracted_entities") or {}).items():
+                if value:
+                    self.entities[name] = value
+            self.summary = summarize(self.summary, question, result.get("final_answer", ""))
+            if result.get("retrieved_docs"):
+                self.last_retrieval = {
+                    "kb_version": kb_version,
+                    "key": retrieval_key(result.get("query_type", ""), result.get("extracted_entities") or {},
+                                         resolve_ids),
+                    "docs": result["retrieved_docs"],
+                    "scores": result.get("retrieval_scores", []),
+                    "strategy": result.get("retrieval_strategy", "")
+                }
+
+
+class SessionStore:
+    """LRU + TTL bounded map of session_id -> ConversationSession."""
+
+    def __init__(self, max_sessions: int = 1000, ttl_seconds: float = 1800):
+        self._sessions = LRUCache(max_entries=max_sessions, ttl_seconds=ttl_seconds)
+        self._lock = threading.Lock()
+
+    def get_or_create(self, session_id: str) -> ConversationSession:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ConversationSession(session_id)
+            # Re-inserting refreshes both recency and the TTL clock
+            self._sessions.put(session_id, session)
+            return session
+
+    def drop(self, session_id: str):
+        self._sessions.pop(session_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._sessions.stats()
+
+
+def retrieval_key(query_type: str, entities: Dict[str, Any],
+                  resolve_ids: Callable[[str, Any], List[str]]) -> tuple:
+    """
+    What must match for a follow-up to reuse the previous turn's retrieval.
+    Entities (a string or a list) are compared by the canonical ids
+    resolve_ids(kind, value) gives, so "TN" and "Tennessee" match.
+    """
+    return (
+        query_type,
+        tuple(sorted(resolve_ids("state", entities.get("state")))),
+        tuple(sorted(resolve_ids("cert", entities.get("certification"))))
+    )
@@ -0,0 +1,121 @@
+"""
+TEAI Study Store
+================
+Persistent, bounded storage for Learning Mode items (/api/study/*).
+
+An append-only SQLite table indexed by (user_id, id). Items are only ever
+inserted; the two ways rows leave are the per-user cap (oldest first) and
+retention-based compaction. SQLite in WAL mode is shared by every worker
+process and survives restarts, and listing is a range scan on the index, so
+its cost depends on the page size, not on how much has been saved.
+"""
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS study_items (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_study_user_id ON study_items (user_id, id);
+CREATE INDEX IF NOT EXISTS idx_study_created_at ON study_items (created_at);
+"""
+
+
+class StudyItemTooLarge(ValueError):
+    pass
+
+
+class StudyStore:
+    """Append-only study memory with per-user caps, retention and cursor pagination."""
+
+    def __init__(self, path: str, max_items_per_user: int = 500, max_item_bytes: int = 16384,
+                 retention_days: Optional[float] = 90, compact_interval_seconds: float = 3600):
+        self.path = path
+        self.max_items_per_user = max_items_per_user
+        self.max_item_bytes = max_item_bytes
+        self.retention_days = retention_days
+        self.compact_interval_seconds = compact_interval_seconds
+        self._local = threading.local()
+        self._last_compacted = 0.0
+        self._compact_lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # One connection per thread, opened lazily so none crosses a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def append(self, user_id: str, item: Any) -> int:
+        """Store one item for a user and return its id (the pagination cursor)."""
+        payload = json.dumps(item, separators=(",", ":"))
+        if len(payload.encode("utf-8")) > self.max_item_bytes:
+            raise StudyItemTooLarge(f"Study item exceeds {self.max_item_bytes} bytes")
+
+        conn = self._connection()
+        with conn:
+            cursor = conn.execute(
+                "INSERT INTO study_items (user_id, created_at, payload) VALUES (?, ?, ?)",
+                (user_id, time.time(), payload)
+            )
+            item_id = cursor.lastrowid
+            # Enforce the per-user cap by dropping that user's oldest items
+            conn.execute(
+                """DELETE FROM study_items WHERE user_id = ? AND id <= (
+                       SELECT id FROM study_items WHERE user_id = ?
+                       ORDER BY id DESC LIMIT 1 OFFSET ?)""",
+                (user_id, user_id, self.max_items_per_user)
+            )
+
+        if time.time() - self._last_compacted > self.compact_interval_seconds:
+            self.compact()
+        return item_id
+
+    def list(self, user_id: str, cursor: Optional[int] = None,
+             limit: int = 50) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        One page of a user's items, newest first.
+        Returns (items, next_cursor); next_cursor is None on the last page.
+        """
+        rows = self._connection().execute(
+            """SELECT id, created_at, payload FROM study_items
+               WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?""",
+            (user_id, cursor if cursor is not None else 2 ** 63 - 1, limit + 1)
+        ).fetchall()
+
+        items = [
+            {"id": row[0], "created_at": row[1], "item": json.loads(row[2])}
+            for row in rows[:limit]
+        ]
+        next_cursor = items[-1]["id"] if len(rows) > limit else None
+        return items, next_cursor
+
+    def compact(self) -> int:
+        """Delete items older than the retention window; returns the number removed."""
+        if not self.retention_days:
+            return 0
+        if not self._compact_lock.acquire(blocking=False):
+            return 0
+        try:
+            cutoff = time.time() - self.retention_days * 86400
+            conn = self._connection()
+            with conn:
+                removed = conn.execute("DELETE FROM study_items WHERE created_at < ?", (cutoff,)).rowcount
+            self._last_compacted = time.time()
+            if removed:
+                print(f"[*] Study store compaction removed {removed} expired items")
+            return removed
+        finally:
+            self._compact_lock.release()
@@ -0,0 +1,252 @@
+"""
+TEAI Hierarchical Summaries
+===========================
+Compact summaries of the knowledge base at three levels, built offline
+(`python build.py summaries`) and retrieved as their own vector level:
+
+- section: one section of a guide (e.g. TN / CNA / cost)
+- program: one certification or financial aid guide (e.g. TN / CNA)
+- state:   everything for one state
+
+Section summaries are written from the section's chunks, program summaries
+from their section summaries and state summaries from their program
+summaries. Every node has a content digest (section: its chunk texts;
+program and state: their children's digests), so a rebuild only
+re-summarizes and re-embeds nodes whose content changed, and at load time
+summaries whose content no longer matches the chunks are dropped.
+
+Overview questions can then be answered from one state or program summary
+instead of a dozen raw chunks; the retriever drills down to chunks when
+the summaries do not match well enough.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from vector_index import matches_filter
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+    from entities import EntityResolver
+
+# Coarsest first
+LEVELS = ("state", "program", "section")
+
+
+def digest_of(parts: List[str]) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def summary_tree(docs: List[Document], resolver: EntityResolver) -> "OrderedDict[str, Dict[str, Any]]":
+    """
+    Nodes of the state -> program -> section tree for chunks that have a
+    state, keyed by "state/program/section" path, children before parents.
+    """
+    sections: "OrderedDict[Tuple[str, str, str], Dict[str, Any]]" = OrderedDict()
+    for doc in docs:
+        metadata = doc.metadata
+        state_id = metadata.get("state_id")
+        if not state_id:
+            continue
+        cert_id, aid_id = metadata.get("cert_id", ""), metadata.get("aid_id", "")
+        program_id = cert_id or aid_id or "general"
+        section_id = metadata.get("section_id") or "general"
+        node = sections.setdefault((state_id, program_id, section_id), {
+            "level": "section",
+            "state_id": state_id,
+            "cert_id": cert_id,
+            "aid_id": aid_id,
+            "section_id": section_id,
+            "title": metadata.get("section") or metadata.get("certification") or section_id,
+            "texts": []
+        })
+        node["texts"].append(doc.page_content)
+
+    nodes: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    programs: "OrderedDict[Tuple[str, str], List[str]]" = OrderedDict()
+    for (state_id, program_id, section_id), node in sections.items():
+        key = f"{state_id}/{program_id}/{section_id}"
+        node["digest"] = digest_of(node["texts"])
+        nodes[key] = node
+        programs.setdefault((state_id, program_id), []).append(key)
+
+    states: "OrderedDict[str, List[str]]" = OrderedDict()
+    for (state_id, program_id), children in programs.items():
+        first = nodes[children[0]]
+        if first["cert_id"]:
+            title = resolver.value("cert", first["cert_id"])
+        elif first["aid_id"]:
+            title = resolver.value("aid", first["aid_id"])
+        else:
+            title = "General"
+        key = f"{state_id}/{program_id}"
+        nodes[key] = {
+            "level": "program",
+            "state_id": state_id,
+            "cert_id": first["cert_id"],
+            "aid_id": first["aid_id"],
+            "section_id": "",
+            "title": title,
+            "children": children,
+            "digest": digest_of([nodes[child]["digest"] for child in children])
+        }
+        states.setdefault(state_id, []).append(key)
+
+    for state_id, children in states.items():
+        nodes[state_id] = {
+            "level": "state",
+            "state_id": state_id,
+            "cert_id": "",
+            "aid_id": "",
+            "section_id": "",
+            "title": resolver.value("state", state_id),
+            "children": children,
+            "digest": digest_of([nodes[child]["digest"] for child in children])
+        }
+    return nodes
+
+
+def build_summaries(docs: List[Document], resolver: EntityResolver,
+                    summarize: Callable[[Dict[str, Any], str], str],
+                    embed_documents: Callable[[List[str]], List[List[float]]],
+                    path: str) -> Dict[str, int]:
+    """
+    Summarize every node bottom-up and embed the summaries, reusing the ones
+    at path (summaries.json, plus vectors in summaries.npy) whose digest is
+    unchanged. summarize(node, content) returns the summary text.
+    """
+    previous: Dict[str, Dict[str, Any]] = {}
+    previous_vectors = None
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            previous = {entry["key"]: entry for entry in json.load(f)["entries"]}
+        vectors_path = os.path.splitext(path)[0] + ".npy"
+        if os.path.exists(vectors_path):
+            previous_vectors = np.load(vectors_path)
+
+    nodes = summary_tree(docs, resolver)
+    entries = []
+    vectors: List[Optional[np.ndarray]] = []
+    reused = 0
+    for key, node in nodes.items():
+        old = previous.get(key)
+        if old and old["digest"] == node["digest"] and previous_vectors is not None:
+            summary = old["summary"]
+            vectors.append(previous_vectors[old["row"]])
+            reused += 1
+        else:
+            if node["level"] == "section":
+                content = "\n\n".join(node["texts"])
+            else:
+                content = "\n\n".join(
+                    f"{nodes[child]['title']}: {nodes[child]['summary']}" for child in node["children"]
+                )
+            summary = summarize(node, content).strip()
+            vectors.append(None)
+        node["summary"] = summary
+        entries.append({
+            "key": key,
+            "row": len(entries),
+            **{field: node[field] for field in ("level", "state_id", "cert_id", "aid_id", "section_id",
+                                                "title", "digest")},
+            "summary": summary
+        })
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        embedded = embed_documents([entries[i]["summary"] for i in missing])
+        for i, vector in zip(missing, embedded):
+            vectors[i] = np.asarray(vector, dtype=np.float32)
+
+    matrix = np.vstack(vectors).astype(np.float32) if vectors else np.zeros((0, 0), dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1, norms)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    vectors_path = os.path.splitext(path)[0] + ".npy"
+    with open(vectors_path + ".tmp", "wb") as f:
+        np.save(f, matrix)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"entries": entries}, f, indent=1)
+    os.replace(vectors_path + ".tmp", vectors_path)
+    os.replace(path + ".tmp", path)
+
+    stats = {"nodes": len(entries), "summarized": len(missing), "reused": reused}
+    print(f"[*] Summaries: {stats}")
+    return stats
+
+
+class SummaryIndex:
+    """Summaries whose content still matches the chunks, searchable by level."""
+
+    def __init__(self, docs: List[Document], vectors: np.ndarray):
+        self.docs = docs
+        self.vectors = vectors
+        self.levels = {level: np.asarray([i for i, doc in enumerate(docs) if doc.metadata["level"] == level],
+                                         dtype=np.int64)
+                       for level in LEVELS}
+
+    @classmethod
+    def load(cls, path: str, chunks: List[Document], resolver: EntityResolver,
+             document_factory: Callable[..., Document]) -> Optional["SummaryIndex"]:
+        """The index at path, without stale summaries; None if nothing usable was built."""
+        vectors_path = os.path.splitext(path)[0] + ".npy"
+        if not (os.path.exists(path) and os.path.exists(vectors_path)):
+            return None
+        with open(path, encoding="utf-8") as f:
+            entries = json.load(f)["entries"]
+        all_vectors = np.load(vectors_path, mmap_mode="r")
+
+        current = summary_tree(chunks, resolver)
+        docs, rows, stale = [], [], 0
+        for entry in entries:
+            node = current.get(entry["key"])
+            if node is None or node["digest"] != entry["digest"]:
+                stale += 1
+                continue
+            state_title = resolver.value("state", entry["state_id"])
+            program_title = current[entry["key"].rsplit("/", 1)[0]]["title"] if entry["level"] == "section" else ""
+            docs.append(document_factory(
+                page_content=entry["summary"],
+                metadata={
+                    "level": entry["level"],
+                    "summary_of": entry["key"],
+                    "state": state_title,
+                    "certification": entry["title"] if entry["level"] == "program" else program_title,
+                    "section": entry["title"] if entry["level"] == "section" else "",
+                    "state_id": entry["state_id"],
+                    "cert_id": entry["cert_id"],
+                    "aid_id": entry["aid_id"],
+                    "section_id": entry["section_id"]
+                }
+            ))
+            rows.append(entry["row"])
+
+        if stale:
+            print(f"[*] Skipping {stale} stale summaries; run 'python build.py summaries' to refresh them")
+        if not docs:
+            return None
+        return cls(docs, np.asarray(all_vectors[rows], dtype=np.float32))
+
+    def search(self, query_vector: np.ndarray, level: str, k: int,
+               where: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """Top-k (summary document, cosine similarity) at one level."""
+        rows = [int(i) for i in self.levels[level] if matches_filter(self.docs[i].metadata, where)]
+        if not rows or k <= 0:
+            return []
+        scores = self.vectors[rows] @ query_vector
+        order = np.argsort(-scores)[:k]
+        return [(self.docs[rows[i]], float(scores[i])) for i in order]
+
+    def stats(self) -> Dict[str, int]:
+        return {level: len(rows) for level, rows in self.levels.items()}
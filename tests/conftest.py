@@ -0,0 +1,11 @@
+"""
+Tests import the app modules from the repository root and read its
+config.yaml, the way the server does, so they run from there.
+"""
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+sys.path.insert(0, REPO_ROOT)
+os.chdir(REPO_ROOT)
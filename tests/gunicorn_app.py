@@ -0,0 +1,46 @@
+"""
+Gunicorn entry point for test_gunicorn.py: the real app factory, with
+deterministic fake embeddings and a fake chat model so no API is called.
+
+    gunicorn 'gunicorn_app:create_app()' -c gunicorn.conf.py
+"""
+import json
+
+import app as rag_app
+from langchain_core.embeddings import DeterministicFakeEmbedding
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+# One reply that parses as the analyzer's, the generator's and the critique's output
+FAKE_REPLY = json.dumps({
+    "query_type": "requirements",
+    "entities": {"state": "Tennessee", "certification": "CNA"},
+    "search_queries": ["CNA certification requirements in Tennessee"],
+    "is_grounded": True,
+    "issues": [],
+    "missing_info": [],
+    "confidence_adjustment": 0.9
+})
+
+
+class FakeEmbeddings(DeterministicFakeEmbedding):
+    def __init__(self, **kwargs):
+        super().__init__(size=64)
+
+
+class FakeChatModel(GenericFakeChatModel):
+    def __init__(self, **kwargs):
+        super().__init__(messages=iter(lambda: AIMessage(content=FAKE_REPLY), None))
+
+    def bind(self, **kwargs):
+        return self
+
+
+rag_app.import_heavy_dependencies()
+rag_app.import_heavy_dependencies = lambda: None
+rag_app.OpenAIEmbeddings = FakeEmbeddings
+rag_app.ChatOpenAI = FakeChatModel
+
+
+def create_app():
+    return rag_app.create_app()
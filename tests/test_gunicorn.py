@@ -0,0 +1,129 @@
+"""
+The pre-fork design under a real gunicorn: the master preloads the
+knowledge base, two workers serve it, and each maps the vector shards from
+disk instead of holding its own copy.
+"""
+import http.client
+import json
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+import yaml
+
+from conftest import REPO_ROOT
+
+pytestmark = [
+    pytest.mark.skipif(shutil.which("gunicorn") is None, reason="gunicorn is not installed"),
+    pytest.mark.skipif(not os.path.exists("/proc/self/maps"), reason="needs /proc (Linux)"),
+]
+
+WORKERS = 2
+STARTUP_TIMEOUT_SECONDS = 120
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_json(connection: http.client.HTTPConnection, method: str, path: str, body=None):
+    connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                       headers={"Content-Type": "application/json"})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def mapped_shards(pid: int):
+    """Shard .npy files memory-mapped into process pid"""
+    with open(f"/proc/{pid}/maps") as f:
+        return {line.split()[-1] for line in f
+                if len(line.split()) >= 6 and "/shards/" in line and line.rstrip().endswith(".npy")}
+
+
+@pytest.fixture(scope="module")
+def server(tmp_path_factory):
+    work = tmp_path_factory.mktemp("gunicorn")
+    shutil.copytree(os.path.join(REPO_ROOT, "data"), work / "data")
+    with open(os.path.join(REPO_ROOT, "config.yaml")) as f:
+        config = yaml.safe_load(f)
+    config["cache"]["warmer"]["enabled"] = False
+    config["vector_index"]["quantization"] = {"mode": "none"}
+    with open(work / "config.yaml", "w") as f:
+        yaml.safe_dump(config, f)
+
+    port = free_port()
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(WORKERS),
+        "OPENAI_API_KEY": "test",
+        "PYTHONPATH": os.pathsep.join([os.path.join(REPO_ROOT, "tests"), REPO_ROOT]),
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "gunicorn_app:create_app()",
+         "-c", os.path.join(REPO_ROOT, "gunicorn.conf.py"), "--bind", f"127.0.0.1:{port}"],
+        cwd=work, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    try:
+        deadline = time.monotonic() + STARTUP_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                pytest.fail(f"gunicorn exited during startup:\n{process.stdout.read()}")
+            try:
+                status, _ = get_json(http.client.HTTPConnection("127.0.0.1", port, timeout=5), "GET", "/readyz")
+                if status == 200:
+                    break
+            except OSError:
+                pass
+            time.sleep(0.5)
+        else:
+            pytest.fail("gunicorn did not become ready")
+        yield process, port
+    finally:
+        process.send_signal(signal.SIGTERM)
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def connections_per_worker(port: int):
+    """{worker pid: keep-alive connection to that worker}, one per worker"""
+    connections = {}
+    for _ in range(200):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        status, body = get_json(connection, "GET", "/readyz")
+        assert status == 200, body
+        if body["pid"] in connections:
+            connection.close()
+        else:
+            connections[body["pid"]] = connection
+        if len(connections) == WORKERS:
+            return connections
+    pytest.fail(f"only reached workers {sorted(connections)}")
+
+
+def test_every_worker_is_ready_and_answers(server):
+    process, port = server
+    connections = connections_per_worker(port)
+    assert process.pid not in connections
+
+    for pid, connection in connections.items():
+        status, body = get_json(connection, "POST", "/api/query",
+                                {"question": "What are the CNA requirements in Tennessee?",
+                                 "filters": {"state": "Tennessee"}})
+        assert status == 200, body
+        assert body["answer"]
+        assert body["sources"]
+
+        # The shards a query touched are file mappings shared through the page cache, not private copies
+        shards = mapped_shards(pid)
+        assert any(path.endswith("/TN.npy") for path in shards), shards
+        connection.close()
@@ -0,0 +1,34 @@
+from app import entity_ids
+from sessions import ConversationSession, retrieval_key
+
+
+def test_retrieval_key_accepts_entity_lists():
+    key = retrieval_key("comparison", {"state": ["Tennessee", "West Virginia"], "certification": ["CNA"]},
+                        entity_ids)
+    assert key == ("comparison", ("TN", "WV"), ("cna",))
+
+
+def test_retrieval_key_compares_canonical_ids():
+    by_name = retrieval_key("requirements", {"state": "Tennessee", "certification": "CNA"}, entity_ids)
+    by_code = retrieval_key("requirements", {"state": "TN", "certification": "cna"}, entity_ids)
+    listed = retrieval_key("requirements", {"state": ["TN"], "certification": "CNA"}, entity_ids)
+    assert by_name == by_code == listed
+
+
+def test_retrieval_key_missing_entities():
+    assert retrieval_key("general", {}, entity_ids) == ("general", (), ())
+
+
+def test_record_turn_with_list_entities():
+    session = ConversationSession("s1")
+    result = {
+        "query_type": "comparison",
+        "extracted_entities": {"state": ["Tennessee", "West Virginia"], "certification": "CNA"},
+        "final_answer": "Both states require a state exam.",
+        "retrieved_docs": ["doc"],
+        "retrieval_scores": [0.5],
+        "retrieval_strategy": "fused"
+    }
+    session.record_turn("Compare CNA in TN and WV", result, "v1",
+                        lambda summary, question, answer: answer, entity_ids)
+    assert session.last_retrieval["key"] == ("comparison", ("TN", "WV"), ("cna",))
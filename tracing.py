@@ -0,0 +1,389 @@
+"""
+TEAI Tracing
+============
+Per-request span tracing without a tracing SDK.
+
+A span covers one timed piece of work (the request, a graph node, an LLM
+call, a query embedding, a vector search) and carries attributes such as
+the model, token counts, k, the filter and the number of documents. The
+current span lives in a contextvar, so nested span() blocks form a tree;
+work handed to a thread pool keeps its parent through bind().
+
+When the root span ends, its trace is handed to the exporters:
+
+- JsonlExporter: one JSON line per span in a local file
+- OtlpHttpExporter: OTLP/HTTP JSON to any OpenTelemetry collector
+  (POST <endpoint>/v1/traces), from a background thread
+
+and a root slower than the slow-query threshold is also written, as a
+nested span tree, to the slow-query log.
+
+The root span's trace id is the request id returned to clients.
+"""
+from __future__ import annotations
+
+import contextvars
+import json
+import os
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from uuid import UUID
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("teai_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns", "attributes",
+                 "status", "error", "children", "_mono_start", "_token")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, trace_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else (trace_id or uuid.uuid4().hex)
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start_ns = time.time_ns()
+        self._mono_start = time.perf_counter_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self.children: List["Span"] = []
+        self._token: Optional[contextvars.Token] = None
+        if parent:
+            parent.children.append(self)
+
+    @property
+    def duration_ms(self) -> float:
+        if self.end_ns is None:
+            return 0.0
+        return round((self.end_ns - self.start_ns) / 1e6, 3)
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def record_error(self, error: BaseException):
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}"
+
+    def finish(self):
+        # Wall-clock start, monotonic duration
+        self.end_ns = self.start_ns + (time.perf_counter_ns() - self._mono_start)
+
+    def walk(self) -> Iterator["Span"]:
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start_ns / 1e9,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes
+        }
+
+    def tree(self) -> Dict[str, Any]:
+        """This span and its descendants, nested, with offsets relative to this span's start."""
+        def node(span: "Span") -> Dict[str, Any]:
+            entry = {
+                "name": span.name,
+                "offset_ms": round((span.start_ns - self.start_ns) / 1e6, 3),
+                "duration_ms": span.duration_ms,
+                "attributes": span.attributes
+            }
+            if span.error:
+                entry["error"] = span.error
+            if span.children:
+                entry["children"] = [node(child) for child in span.children]
+            return entry
+        return node(self)
+
+
+class JsonlExporter:
+    """Appends every span of a trace as one JSON line; rotates to <path>.1 past max_bytes."""
+
+    def __init__(self, path: str, max_bytes: int = 50 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def write_lines(self, lines: List[str]):
+        data = "".join(line + "\n" for line in lines)
+        with self._lock:
+            try:
+                if self.max_bytes and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+            except OSError:
+                pass
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(data)
+
+    def export(self, root: Span):
+        self.write_lines([json.dumps(span.to_dict(), default=str) for span in root.walk()])
+
+
+class OtlpHttpExporter:
+    """
+    Sends traces as OTLP/HTTP JSON from a daemon thread; a full queue or an
+    unreachable collector drops traces rather than slowing requests.
+    """
+
+    def __init__(self, endpoint: str, service_name: str, max_queue: int = 1000, timeout: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.timeout = timeout
+        self.dropped = 0
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each worker process starts its own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name="otlp-exporter", daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            typed = {"boolValue": value}
+        elif isinstance(value, int):
+            typed = {"intValue": str(value)}
+        elif isinstance(value, float):
+            typed = {"doubleValue": value}
+        else:
+            typed = {"stringValue": str(value)}
+        return {"key": key, "value": typed}
+
+    def _payload(self, root: Span) -> bytes:
+        spans = []
+        for span in root.walk():
+            entry = {
+                "traceId": span.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 2 if span.parent_id is None else 1,  # SERVER for the request, INTERNAL below it
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns or span.start_ns),
+                "attributes": [self._attribute(k, v) for k, v in span.attributes.items() if v is not None],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1}
+            }
+            if span.parent_id:
+                entry["parentSpanId"] = span.parent_id
+            spans.append(entry)
+        return json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+            "scopeSpans": [{"scope": {"name": "teai.tracing"}, "spans": spans}]
+        }]}).encode("utf-8")
+
+    def _run(self):
+        while True:
+            root = self._queue.get()
+            try:
+                post = urllib.request.Request(self.url, data=self._payload(root),
+                                              headers={"Content-Type": "application/json"})
+                urllib.request.urlopen(post, timeout=self.timeout).close()
+            except Exception as e:
+                self.dropped += 1
+                print(f"[!] OTLP export failed: {e}")
+
+    def export(self, root: Span):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(root)
+        except queue.Full:
+            self.dropped += 1
+
+
+class Tracer:
+    def __init__(self, exporters: Optional[List[Any]] = None, slow_ms: Optional[float] = None,
+                 slow_log: Optional[JsonlExporter] = None, enabled: bool = True):
+        self.enabled = enabled
+        self.exporters = exporters or []
+        self.slow_ms = slow_ms
+        self.slow_log = slow_log
+        self.traces = 0
+        self.slow = 0
+
+    def start(self, name: str, trace_id: Optional[str] = None, **attributes: Any) -> Optional[Span]:
+        """Open a span as a child of the current one (a new trace if there is none) and make it current."""
+        if not self.enabled:
+            return None
+        span = Span(name, parent=_current.get(), trace_id=trace_id, attributes=attributes)
+        span._token = _current.set(span)
+        return span
+
+    def end(self, span: Optional[Span], error: Optional[BaseException] = None):
+        if span is None:
+            return
+        token, span._token = span._token, None
+        if error is not None:
+            span.record_error(error)
+        span.finish()
+        if token is not None:
+            try:
+                _current.reset(token)
+            except ValueError:
+                # Ended from a different context than it was started in
+                _current.set(None)
+        if span.parent_id is None:
+            self._export(span)
+
+    def _export(self, root: Span):
+        self.traces += 1
+        for exporter in self.exporters:
+            try:
+                exporter.export(root)
+            except Exception as e:
+                print(f"[!] Trace export failed: {e}")
+        if self.slow_log and self.slow_ms is not None and root.duration_ms >= self.slow_ms:
+            self.slow += 1
+            try:
+                self.slow_log.write_lines([json.dumps({
+                    "request_id": root.trace_id,
+                    "name": root.name,
+                    "start": root.start_ns / 1e9,
+                    "duration_ms": root.duration_ms,
+                    "tree": root.tree()
+                }, default=str)])
+            except Exception as e:
+                print(f"[!] Slow-query log write failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, "traces": self.traces, "slow": self.slow, "slow_ms": self.slow_ms}
+
+
+# Process-wide tracer; configure() replaces it from config.yaml
+tracer = Tracer(enabled=False)
+
+
+def configure(config: Dict[str, Any]) -> Tracer:
+    """Build the tracer from the tracing: section of config.yaml."""
+    global tracer
+    exporters: List[Any] = []
+    if config.get('jsonl_path'):
+        exporters.append(JsonlExporter(config['jsonl_path'], config.get('max_file_bytes', 50 * 1024 * 1024)))
+    endpoint = config.get('otlp_endpoint') or os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT")
+    if endpoint:
+        exporters.append(OtlpHttpExporter(endpoint, config.get('service_name', 'teai-rag')))
+    slow_log = JsonlExporter(config['slow_query_path']) if config.get('slow_query_path') else None
+    tracer = Tracer(exporters, config.get('slow_query_ms'), slow_log, enabled=config.get('enabled', True))
+    return tracer
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Span]]:
+    """Time the with-block as a child span of the current one."""
+    current = tracer.start(name, **attributes)
+    try:
+        yield current
+    except BaseException as e:
+        tracer.end(current, e)
+        raise
+    tracer.end(current)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def annotate(**attributes: Any):
+    """Set attributes on the current span, if any."""
+    current = _current.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+def record_error(error: BaseException):
+    """Mark the current span as failed (for errors that are handled, not raised)."""
+    current = _current.get()
+    if current is not None:
+        current.record_error(error)
+
+
+def bind(fn: Callable) -> Callable:
+    """fn bound to the caller's context, so spans it opens on another thread keep their parent."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def request_id() -> Optional[str]:
+    current = _current.get()
+    return current.trace_id if current else None
+
+
+def _llm_callback_handler():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class LLMSpanHandler(BaseCallbackHandler):
+        """LangChain callbacks that record every chat model call as a span."""
+
+        def __init__(self):
+            self.spans: Dict[UUID, Span] = {}
+            self.lock = threading.Lock()
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+            if not tracer.enabled:
+                return
+            params = kwargs.get("invocation_params") or {}
+            current = Span("llm", parent=_current.get(), attributes={
+                "model": params.get("model_name") or params.get("model") or (serialized or {}).get("name"),
+                "max_tokens": params.get("max_tokens"),
+                "timeout": params.get("timeout"),
+                "messages": sum(len(batch) for batch in messages)
+            })
+            with self.lock:
+                self.spans[run_id] = current
+
+        def _finish(self, run_id, error=None, response=None):
+            with self.lock:
+                current = self.spans.pop(run_id, None)
+            if current is None:
+                return
+            if response is not None:
+                usage = (response.llm_output or {}).get("token_usage") or {}
+                if not usage and response.generations and response.generations[0]:
+                    message = getattr(response.generations[0][0], "message", None)
+                    metadata = getattr(message, "usage_metadata", None) or {}
+                    usage = {"prompt_tokens": metadata.get("input_tokens"),
+                             "completion_tokens": metadata.get("output_tokens")}
+                current.set(prompt_tokens=usage.get("prompt_tokens"),
+                            completion_tokens=usage.get("completion_tokens"))
+            if error is not None:
+                current.record_error(error)
+            current.finish()
+
+        def on_llm_end(self, response, *, run_id, **kwargs):
+            self._finish(run_id, response=response)
+
+        def on_llm_error(self, error, *, run_id, **kwargs):
+            self._finish(run_id, error=error)
+
+    return LLMSpanHandler()
+
+
+_handler = None
+
+
+def llm_callbacks() -> List[Any]:
+    """Callbacks to pass in a LangChain config, e.g. graph.invoke(state, {"callbacks": llm_callbacks()})."""
+    global _handler
+    if not tracer.enabled:
+        return []
+    if _handler is None:
+        _handler = _llm_callback_handler()
+    return [_handler]
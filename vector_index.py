@@ -0,0 +1,753 @@
+"""
+TEAI Shared Vector Index
+========================
+Read-only, memory-mapped, per-state sharded copy of the embedding matrix
+used for serving.
+
+Chroma is the build-time store: it embeds and persists the chunks. It is not
+safe to share across fork() (SQLite handles), and every worker that opens it
+loads its own copy of the index. Instead the vectors are exported once to
+.npy files and every worker opens them with mmap_mode='r', so N workers read
+the same physical pages from the OS page cache.
+
+The matrix is split into one shard per state plus a shared "national" shard
+(chunks with no state, and financial aid program guides). A query with a
+known state searches only that state's shard and the national shard;
+comparisons and unknown-state queries fan out to the relevant shards in
+parallel and merge the per-shard top-k. Shards are mapped on first use and
+re-exported independently when their chunks change, so adding a state adds
+a shard without making queries about other states slower. A new
+knowledge-base version hard-links the shards whose chunks did not change
+from an earlier version instead of exporting them again.
+
+With vector_index.quantization, each shard also gets an int8 (4x smaller)
+or sign-bit (32x smaller) copy of its vectors. Searches scan the compact
+copy for the top max(k x rescore_factor, min_candidates) candidates and
+rescore only those against the float32 file, so the full-precision pages
+a query touches are a few rows, and the returned scores are exact cosine
+similarities.
+
+The index implements the subset of the LangChain VectorStore interface the
+agents and the visibility module use (similarity_search with a Chroma-style
+metadata filter), so it is a drop-in replacement for the Chroma handle.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import tracing
+from caches import LRUCache
+
+if TYPE_CHECKING:
+    from langchain_chroma import Chroma
+    from langchain_core.documents import Document
+    from langchain_core.embeddings import Embeddings
+    from chunk_store import ChunkTable
+
+
+# Metadata fields with a precomputed value -> rows index, so filters on them
+# only touch the matching partition instead of scanning every chunk
+PARTITION_FIELDS = ("state_id", "cert_id", "aid_id", "section_id")
+
+# Shard for content that is not specific to one state
+NATIONAL_SHARD = "national"
+
+# First-pass vector encodings (see quantize_vectors)
+QUANTIZATION_MODES = ("int8", "binary")
+
+# Rows per block when quantizing or scanning quantized vectors, bounding the float32 temporaries
+QUANTIZED_BLOCK_ROWS = 8192
+
+# Set bits per byte value, for numpy versions without bitwise_count
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def chunk_ids(n: int) -> List[str]:
+    """Stable Chroma ids for the chunk list, so rows map back to docs by position."""
+    return [f"chunk-{i:05d}" for i in range(n)]
+
+
+def shard_name(metadata: Dict[str, Any]) -> str:
+    """State shard for state-specific content; national for aid guides and unscoped chunks."""
+    if metadata.get("aid_id") or not metadata.get("state_id"):
+        return NATIONAL_SHARD
+    return metadata["state_id"]
+
+
+def matches_filter(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a Chroma-style where filter ($eq, $ne, $in, $nin, $and, $or) against metadata."""
+    if not where:
+        return True
+
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_filter(metadata, c) for c in condition):
+                return False
+        elif key == "$or":
+            if not any(matches_filter(metadata, c) for c in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            value = metadata.get(key)
+            for op, operand in condition.items():
+                if op == "$eq" and value != operand:
+                    return False
+                if op == "$ne" and value == operand:
+                    return False
+                if op == "$in" and value not in operand:
+                    return False
+                if op == "$nin" and value in operand:
+                    return False
+    return True
+
+
+def required_values(where: Optional[Dict[str, Any]], field: str) -> Optional[set]:
+    """
+    Values of field every match must have, when the filter pins it with $eq/$in
+    at the top level or inside a top-level $and. None if any value could match.
+    """
+    if not where:
+        return None
+    for key, condition in where.items():
+        if key == "$and":
+            for part in condition:
+                values = required_values(part, field)
+                if values is not None:
+                    return values
+        elif key == field and isinstance(condition, dict):
+            if "$eq" in condition:
+                return {condition["$eq"]}
+            if "$in" in condition:
+                return set(condition["$in"])
+    return None
+
+
+def mmr_select(query_vector: np.ndarray, vectors: np.ndarray, k: int, lambda_mult: float) -> List[int]:
+    """
+    Indices into vectors picked by maximal marginal relevance, in pick order.
+
+    One matrix product gives every pairwise similarity up front; each pick then
+    updates the running max similarity to the picked set with a vectorized
+    maximum, so selection is O(k * n) array work with no Python inner loop.
+    """
+    n = vectors.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    relevance = vectors @ query_vector
+    similarity = vectors @ vectors.T
+
+    first = int(np.argmax(relevance))
+    selected = [first]
+    redundancy = similarity[first].copy()
+    available = np.ones(n, dtype=bool)
+    available[first] = False
+    while len(selected) < min(k, n):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, similarity[best], out=redundancy)
+    return selected
+
+
+def adaptive_k(scores: List[float], min_score: float, relative_drop: float,
+               min_k: int, max_k: int) -> Tuple[int, int]:
+    """
+    Cutoff for descending similarity scores: hits must clear both min_score and
+    (1 - relative_drop) x the top score. Returns (k, passing): k is the number
+    of hits to keep, clamped to [min_k, max_k], and passing how many cleared
+    the cutoff (the candidate pool for re-ranking).
+    """
+    if not scores:
+        return 0, 0
+    floor = max(min_score, scores[0] * (1 - relative_drop))
+    passing = int(np.count_nonzero(np.asarray(scores) >= floor))
+    k = max(min(passing, max_k), min(min_k, len(scores)))
+    return k, max(passing, k)
+
+
+def build_partitions(docs: ChunkTable, rows: np.ndarray) -> Dict[str, Dict[str, np.ndarray]]:
+    """{field: {value: sorted shard positions}} for PARTITION_FIELDS over docs[rows]."""
+    partitions: Dict[str, Dict[str, np.ndarray]] = {}
+    for field in PARTITION_FIELDS:
+        codes = docs.column(field, rows)
+        partitions[field] = {
+            docs.vocab[field][code]: np.nonzero(codes == code)[0].astype(np.int64)
+            for code in np.unique(codes)
+        }
+    return partitions
+
+
+def shard_checksum(docs: ChunkTable, rows: np.ndarray) -> str:
+    """Fingerprint of a shard's chunk texts in order; a change means the shard is re-exported."""
+    digest = hashlib.sha256()
+    for row in rows:
+        digest.update(docs.text_bytes(row))
+        digest.update(b"\0")
+    return digest.hexdigest()[:16]
+
+
+def export_vectors(vs: Chroma, docs: ChunkTable, rows: np.ndarray, path: str) -> None:
+    """
+    Write the Chroma embeddings of docs[rows] to an L2-normalized float32 .npy
+    file whose row i is the vector of docs[rows[i]].
+    """
+    ids = chunk_ids(len(docs))
+    data = vs.get(ids=[ids[row] for row in rows], include=["embeddings", "documents"])
+    position_by_id = {ids[row]: i for i, row in enumerate(rows)}
+
+    vectors = None
+    found = 0
+    for cid, text, embedding in zip(data["ids"], data["documents"], data["embeddings"]):
+        position = position_by_id.get(cid)
+        if position is None or docs.text(rows[position]) != text:
+            continue
+        if vectors is None:
+            vectors = np.zeros((len(rows), len(embedding)), dtype=np.float32)
+        vectors[position] = embedding
+        found += 1
+
+    if found != len(rows):
+        raise ValueError(f"Vector store has {found} of {len(rows)} embeddings for {path}; rebuild the store")
+
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors /= np.where(norms == 0, 1, norms)
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, vectors)
+    os.replace(tmp_path, path)
+    print(f"[*] Exported {vectors.shape[0]} x {vectors.shape[1]} vectors to {path}")
+
+
+def link_or_copy(source: str, target: str):
+    """Replace target with a hard link to source (a copy across filesystems); mtimes are kept either way."""
+    tmp_path = target + ".tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copy2(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+def popcount(values: np.ndarray) -> np.ndarray:
+    """Set bits per uint8 element."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values)
+    return _POPCOUNT[values]
+
+
+def quantized_path(path: str, mode: str) -> str:
+    """Path of the quantized copy of a shard's float32 .npy file."""
+    return f"{os.path.splitext(path)[0]}.{mode}.npy"
+
+
+def scale_path(path: str) -> str:
+    """Path of the per-dimension scales of a shard's int8 copy."""
+    return f"{os.path.splitext(path)[0]}.int8-scale.npy"
+
+
+def quantize_vectors(path: str, mode: str) -> str:
+    """
+    Write the quantized copy of a float32 .npy shard, block by block:
+
+    - int8: each dimension scaled so its largest magnitude maps to 127, with
+      the per-dimension scales in a separate small file
+    - binary: the sign bit of each dimension, packed 8 per byte
+
+    Returns the path written.
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization {mode!r}; use one of {', '.join(QUANTIZATION_MODES)}")
+    vectors = np.load(path, mmap_mode="r")
+    rows, dims = vectors.shape
+    out_path = quantized_path(path, mode)
+    tmp_path = out_path + ".tmp"
+
+    if mode == "int8":
+        scale = np.zeros(dims, dtype=np.float32)
+        for start in range(0, rows, QUANTIZED_BLOCK_ROWS):
+            np.maximum(scale, np.abs(vectors[start:start + QUANTIZED_BLOCK_ROWS]).max(axis=0), out=scale)
+        scale = np.where(scale == 0, 1, scale / 127).astype(np.float32)
+        # Scales first: the codes file is replaced last, so its mtime marks a complete copy
+        with open(scale_path(path) + ".tmp", "wb") as f:
+            np.save(f, scale)
+        os.replace(scale_path(path) + ".tmp", scale_path(path))
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.int8, shape=(rows, dims))
+        for start in range(0, rows, QUANTIZED_BLOCK_ROWS):
+            block = np.rint(vectors[start:start + QUANTIZED_BLOCK_ROWS] / scale)
+            out[start:start + len(block)] = np.clip(block, -127, 127).astype(np.int8)
+    else:
+        out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(rows, (dims + 7) // 8))
+        for start in range(0, rows, QUANTIZED_BLOCK_ROWS):
+            out[start:start + QUANTIZED_BLOCK_ROWS] = np.packbits(
+                vectors[start:start + QUANTIZED_BLOCK_ROWS] > 0, axis=1
+            )
+    out.flush()
+    del out
+    os.replace(tmp_path, out_path)
+    print(f"[*] Wrote {mode} copy of {rows} x {dims} vectors to {out_path}")
+    return out_path
+
+
+class VectorShard:
+    """
+    Cosine search over one memory-mapped shard, mapped on first use: exact,
+    or a quantized first pass rescored exactly (see the module docstring).
+    """
+
+    def __init__(self, name: str, path: str, docs: ChunkTable, rows: np.ndarray,
+                 quantization: Optional[str] = None, rescore_factor: int = 4, min_candidates: int = 32):
+        self.name = name
+        self.path = path
+        self.docs = docs
+        self.rows = rows  # Global row (index into docs) of each shard position
+        self.partitions = build_partitions(docs, rows)
+        self.quantization = quantization
+        self.rescore_factor = rescore_factor
+        self.min_candidates = min_candidates
+        self._vectors = None
+        self._quantized = None
+        self._lock = threading.Lock()
+
+    @property
+    def vectors(self) -> np.ndarray:
+        if self._vectors is None:
+            with self._lock:
+                if self._vectors is None:
+                    vectors = np.load(self.path, mmap_mode="r")
+                    if vectors.shape[0] != len(self.rows):
+                        raise ValueError(
+                            f"{self.path} has {vectors.shape[0]} vectors for {len(self.rows)} chunks; "
+                            "delete it to re-export"
+                        )
+                    self._vectors = vectors
+        return self._vectors
+
+    @property
+    def quantized(self) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """(codes, per-dimension scales or None) of the quantized copy, mapped on first use."""
+        if self._quantized is None:
+            with self._lock:
+                if self._quantized is None:
+                    codes = np.load(quantized_path(self.path, self.quantization), mmap_mode="r")
+                    scale = np.load(scale_path(self.path)) if self.quantization == "int8" else None
+                    if codes.shape[0] != len(self.rows):
+                        raise ValueError(
+                            f"{quantized_path(self.path, self.quantization)} has {codes.shape[0]} vectors "
+                            f"for {len(self.rows)} chunks; delete it to re-quantize"
+                        )
+                    self._quantized = (codes, scale)
+        return self._quantized
+
+    def quantized_is_stale(self) -> bool:
+        path = quantized_path(self.path, self.quantization)
+        return not os.path.exists(path) or os.stat(path).st_mtime_ns < os.stat(self.path).st_mtime_ns
+
+    def ensure_quantized(self):
+        """(Re)write the quantized copy if quantization is on and the copy is missing or older than the vectors."""
+        if self.quantization and self.quantized_is_stale():
+            quantize_vectors(self.path, self.quantization)
+            with self._lock:
+                self._quantized = None
+
+    def map(self):
+        """Map the float32 file (and the quantized copy) now rather than on first search."""
+        _ = self.vectors
+        if self.quantization:
+            _ = self.quantized
+
+    @property
+    def loaded(self) -> bool:
+        return self._vectors is not None or self._quantized is not None
+
+    def unload(self):
+        with self._lock:
+            self._vectors = None
+            self._quantized = None
+
+    def approximate_scores(self, query_vector: np.ndarray, positions: Optional[np.ndarray]) -> np.ndarray:
+        """
+        First-pass scores from the quantized copy (higher is closer): the
+        scaled int8 dot product, or minus the Hamming distance of the sign bits.
+        """
+        codes, scale = self.quantized
+        if positions is not None:
+            codes = codes[positions]
+        if self.quantization == "int8":
+            query = query_vector * scale
+            score_block = lambda block: block.astype(np.float32) @ query
+        else:
+            query_bits = np.packbits(query_vector > 0)
+            score_block = lambda block: -popcount(block ^ query_bits).sum(axis=1, dtype=np.int32)
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], QUANTIZED_BLOCK_ROWS):
+            scores[start:start + QUANTIZED_BLOCK_ROWS] = score_block(codes[start:start + QUANTIZED_BLOCK_ROWS])
+        return scores
+
+    def vector_bytes(self) -> Dict[str, int]:
+        sizes = {"float32": os.path.getsize(self.path) if os.path.exists(self.path) else 0}
+        if self.quantization:
+            path = quantized_path(self.path, self.quantization)
+            sizes[self.quantization] = os.path.getsize(path) if os.path.exists(path) else 0
+        return sizes
+
+    def partition_positions(self, where: Dict[str, Any]) -> Optional[np.ndarray]:
+        """
+        Positions for a filter built only from $eq/$in on partitioned fields,
+        combined with $and/$or, using the precomputed partitions. None if not
+        expressible.
+        """
+        sets = []
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                parts = [self.partition_positions(c) for c in condition]
+                if any(p is None for p in parts):
+                    return None
+                combine = np.intersect1d if key == "$and" else np.union1d
+                positions = parts[0]
+                for part in parts[1:]:
+                    positions = combine(positions, part)
+                sets.append(positions)
+            elif key in self.partitions and isinstance(condition, dict) and len(condition) == 1:
+                op, operand = next(iter(condition.items()))
+                if op == "$eq":
+                    values = [operand]
+                elif op == "$in":
+                    values = list(operand)
+                else:
+                    return None
+                empty = np.empty(0, dtype=np.int64)
+                positions = empty
+                for value in values:
+                    positions = np.union1d(positions, self.partitions[key].get(value, empty))
+                sets.append(positions)
+            else:
+                return None
+
+        positions = sets[0]
+        for other in sets[1:]:
+            positions = np.intersect1d(positions, other)
+        return positions
+
+    def candidate_positions(self, where: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Shard positions that pass the filter, or None for all of them."""
+        if not where:
+            return None
+        positions = self.partition_positions(where)
+        if positions is not None:
+            return positions
+        return np.fromiter(
+            (i for i, row in enumerate(self.rows) if matches_filter(self.docs[row].metadata, where)),
+            dtype=np.int64
+        )
+
+    def search_vector(self, query_vector: np.ndarray, k: int,
+                      where: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """Top-k (global row, cosine similarity) pairs within this shard."""
+        positions = self.candidate_positions(where)
+        # An empty candidate set never touches the vectors, so the shard stays unmapped
+        if k <= 0 or (positions is not None and positions.shape[0] == 0):
+            return []
+
+        # Narrow to the best candidates by the quantized copy; only they are read at full precision
+        count = len(self.rows) if positions is None else positions.shape[0]
+        candidates = max(k * self.rescore_factor, self.min_candidates)
+        if self.quantization and candidates < count:
+            first = self.approximate_scores(query_vector, positions)
+            picked = np.argpartition(-first, candidates - 1)[:candidates]
+            # Sorted positions read the float32 file front to back
+            positions = np.sort(picked if positions is None else positions[picked])
+
+        matrix = self.vectors if positions is None else self.vectors[positions]
+        if matrix.shape[0] == 0:
+            return []
+
+        scores = matrix @ query_vector
+        k = min(k, scores.shape[0])
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        local = top if positions is None else positions[top]
+        return [(int(self.rows[p]), float(scores[i])) for p, i in zip(local, top)]
+
+
+class ShardedVectorIndex:
+    """Per-state shards plus a national shard behind a single-index interface."""
+
+    def __init__(self, persist_dir: str, docs: ChunkTable, embedding_factory: Callable[[], Embeddings],
+                 version: str = "", max_workers: int = 4, quantization: Optional[str] = None,
+                 rescore_factor: int = 4, min_candidates: int = 32, embedding_cache: Optional[LRUCache] = None):
+        if quantization and quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unknown quantization {quantization!r}; use one of {', '.join(QUANTIZATION_MODES)}")
+        self.quantization = quantization
+        self.shard_dir = os.path.join(persist_dir, "shards")
+        self.docs = docs
+        self.version = version  # Knowledge-base version; part of every retrieval cache key
+        self.max_workers = max_workers
+        self._embedding_factory = embedding_factory
+        self._embeddings = None
+        # Query text -> normalized vector; shared across knowledge-base versions (it depends only on the model)
+        self.embedding_cache = embedding_cache
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+
+        assignment: Dict[str, List[int]] = {}
+        for row in range(len(docs)):
+            metadata = {field: docs.value(field, row) for field in ("state_id", "aid_id")}
+            assignment.setdefault(shard_name(metadata), []).append(row)
+        self.shards: Dict[str, VectorShard] = {
+            name: VectorShard(name, os.path.join(self.shard_dir, f"{name}.npy"), docs,
+                              np.asarray(rows, dtype=np.int64), quantization, rescore_factor, min_candidates)
+            for name, rows in sorted(assignment.items())
+        }
+        # Global row -> (shard number, position in shard), for fetching stored vectors
+        self._shard_list = list(self.shards.values())
+        self._row_shard = np.zeros(len(docs), dtype=np.int64)
+        self._row_position = np.zeros(len(docs), dtype=np.int64)
+        for number, shard in enumerate(self._shard_list):
+            self._row_shard[shard.rows] = number
+            self._row_position[shard.rows] = np.arange(len(shard.rows))
+
+    @classmethod
+    def from_chroma(cls, vs: Chroma, docs: ChunkTable, persist_dir: str,
+                    embedding_factory: Callable[[], Embeddings], version: str = "",
+                    max_workers: int = 4, reuse_from: Iterable[str] = (),
+                    **options: Any) -> "ShardedVectorIndex":
+        """
+        Open the shards. A missing or stale shard is linked from the first
+        persist directory in reuse_from that has it with the same chunks, and
+        re-exported from Chroma otherwise. options are the constructor's
+        quantization and embedding_cache arguments.
+        """
+        index = cls(persist_dir, docs, embedding_factory, version, max_workers, **options)
+        os.makedirs(index.shard_dir, exist_ok=True)
+        reuse_from = list(reuse_from)
+        for name, shard in index.shards.items():
+            if index.shard_is_stale(name):
+                if not any(index.adopt_shard(name, other) for other in reuse_from):
+                    index.rebuild_shard(vs, name)
+            shard.ensure_quantized()
+        return index
+
+    def manifest_path(self, name: str) -> str:
+        return os.path.join(self.shard_dir, f"{name}.json")
+
+    def shard_is_stale(self, name: str) -> bool:
+        shard = self.shards[name]
+        try:
+            with open(self.manifest_path(name)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return True
+        return (
+            not os.path.exists(shard.path)
+            or manifest.get("rows") != len(shard.rows)
+            or manifest.get("checksum") != shard_checksum(self.docs, shard.rows)
+        )
+
+    def write_manifest(self, name: str):
+        shard = self.shards[name]
+        manifest = {"rows": len(shard.rows), "checksum": shard_checksum(self.docs, shard.rows)}
+        tmp_path = self.manifest_path(name) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path(name))
+
+    def adopt_shard(self, name: str, other_persist_dir: str) -> bool:
+        """
+        Link shard name's vectors (and quantized copy) from another version's
+        persist directory if its manifest there has the same chunks; True if it did.
+        """
+        shard = self.shards[name]
+        other_dir = os.path.join(other_persist_dir, "shards")
+        try:
+            with open(os.path.join(other_dir, f"{name}.json")) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if manifest.get("rows") != len(shard.rows) or manifest.get("checksum") != shard_checksum(self.docs, shard.rows):
+            return False
+
+        targets = [shard.path]
+        if self.quantization:
+            targets.append(quantized_path(shard.path, self.quantization))
+            if self.quantization == "int8":
+                targets.append(scale_path(shard.path))
+        try:
+            for target in targets:
+                source = os.path.join(other_dir, os.path.basename(target))
+                if os.path.exists(source):
+                    link_or_copy(source, target)
+                elif os.path.exists(target):
+                    # A leftover copy could look newer than the linked vectors
+                    os.remove(target)
+        except OSError as e:
+            # e.g. the other version was pruned meanwhile; export instead
+            print(f"[!] Could not reuse shard {name} from {other_dir}: {e}")
+            return False
+        self.write_manifest(name)
+        shard.unload()
+        print(f"[*] Reused unchanged shard {name} ({len(shard.rows)} vectors) from {other_dir}")
+        return True
+
+    def rebuild_shard(self, vs: Chroma, name: str):
+        """Re-export one shard's vectors from Chroma without touching the others."""
+        shard = self.shards[name]
+        export_vectors(vs, self.docs, shard.rows, shard.path)
+        self.write_manifest(name)
+        shard.unload()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        # Created on first use so each forked worker gets its own HTTP client
+        if self._embeddings is None:
+            self._embeddings = self._embedding_factory()
+        return self._embeddings
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive fork(), so each process starts its own pool
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix="shard-search")
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def embed_query(self, query: str) -> np.ndarray:
+        model = getattr(self.embeddings, "model", type(self.embeddings).__name__)
+        key = (model, query)
+        if self.embedding_cache is not None:
+            cached = self.embedding_cache.get(key)
+            if cached is not None:
+                return cached
+        with tracing.span("embed_query", chars=len(query), model=model):
+            vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        vector = vector / norm if norm else vector
+        if self.embedding_cache is not None:
+            # Shared between requests, so callers must not modify it
+            vector.setflags(write=False)
+            self.embedding_cache.put(key, vector)
+        return vector
+
+    def route(self, where: Optional[Dict[str, Any]]) -> List[VectorShard]:
+        """Shards that can hold matches: the filtered states plus national, else every shard."""
+        states = required_values(where, "state_id")
+        if states is None:
+            return list(self.shards.values())
+        names = [name for name in sorted(states) if name in self.shards]
+        if NATIONAL_SHARD in self.shards:
+            names.append(NATIONAL_SHARD)
+        return [self.shards[name] for name in names]
+
+    def search_vector(self, query_vector: np.ndarray, k: int,
+                      where: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """Top-k (row, cosine similarity) pairs, merged from the per-shard top-k of each routed shard."""
+        shards = self.route(where)
+        with tracing.span("vector_search", k=k, filter=json.dumps(where, sort_keys=True) if where else None,
+                          shards=",".join(shard.name for shard in shards)) as span:
+            if len(shards) == 1:
+                hits = self._search_shard(shards[0], query_vector, k, where)
+            else:
+                # Each shard search runs on a pool thread, under this span
+                futures = [self.executor.submit(tracing.bind(self._search_shard), shard, query_vector, k, where)
+                           for shard in shards]
+                hits = [hit for future in futures for hit in future.result()]
+                hits.sort(key=lambda hit: hit[1], reverse=True)
+                hits = hits[:k]
+            if span:
+                span.set(hits=len(hits))
+            return hits
+
+    @staticmethod
+    def _search_shard(shard: VectorShard, query_vector: np.ndarray, k: int,
+                      where: Optional[Dict[str, Any]]) -> List[Tuple[int, float]]:
+        with tracing.span("shard_search", shard=shard.name, mapped=shard.loaded) as span:
+            hits = shard.search_vector(query_vector, k, where)
+            if span:
+                span.set(hits=len(hits))
+            return hits
+
+    def search(self, query: str, k: int, where: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """Top-k (row, cosine similarity) pairs for a query string."""
+        return self.search_vector(self.embed_query(query), k, where)
+
+    def vectors_for(self, rows: List[int]) -> np.ndarray:
+        """Stored (normalized) vectors of global rows, in the given order."""
+        rows = np.asarray(rows, dtype=np.int64)
+        shard_numbers = self._row_shard[rows]
+        positions = self._row_position[rows]
+        out = None
+        for number in np.unique(shard_numbers):
+            mask = shard_numbers == number
+            vectors = self._shard_list[number].vectors[positions[mask]]
+            if out is None:
+                out = np.empty((len(rows), vectors.shape[1]), dtype=np.float32)
+            out[mask] = vectors
+        return out if out is not None else np.empty((0, 0), dtype=np.float32)
+
+    def search_mmr(self, query: str, k: int, fetch_k: int, lambda_mult: float,
+                   where: Optional[Dict[str, Any]] = None) -> List[Tuple[int, float]]:
+        """
+        k (row, cosine similarity) pairs re-ranked by maximal marginal relevance
+        from the top fetch_k candidates, in MMR order.
+        """
+        query_vector = self.embed_query(query)
+        candidates = self.search_vector(query_vector, max(fetch_k, k), where)
+        return self.rerank_mmr(query_vector, candidates, k, lambda_mult)
+
+    def rerank_mmr(self, query_vector: np.ndarray, candidates: List[Tuple[int, float]], k: int,
+                   lambda_mult: float) -> List[Tuple[int, float]]:
+        if len(candidates) <= 1:
+            return candidates[:k]
+        vectors = self.vectors_for([row for row, _ in candidates])
+        return [candidates[i] for i in mmr_select(query_vector, vectors, k, lambda_mult)]
+
+    def search_adaptive(self, query: str, min_score: float, relative_drop: float, min_k: int, max_k: int,
+                        where: Optional[Dict[str, Any]] = None, fetch_k: int = 0,
+                        lambda_mult: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        (row, cosine similarity) pairs kept by the adaptive_k score cutoff; with
+        lambda_mult, the kept k are picked by MMR among the hits that passed.
+        """
+        query_vector = self.embed_query(query)
+        pool = self.search_vector(query_vector, max(max_k, fetch_k), where)
+        k, passing = adaptive_k([score for _, score in pool], min_score, relative_drop, min_k, max_k)
+        if lambda_mult is None:
+            return pool[:k]
+        return self.rerank_mmr(query_vector, pool[:passing], k, lambda_mult)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            name: {"chunks": len(shard.rows), "loaded": shard.loaded, "bytes": shard.vector_bytes()}
+            for name, shard in self.shards.items()
+        }
+
+    def similarity_search_with_relevance_scores(self, query: str, k: int = 4,
+                                                filter: Optional[Dict[str, Any]] = None,
+                                                **kwargs) -> List[Tuple[Document, float]]:
+        hits = self.search(query, k, filter)
+        return [(self.docs.document(row), score) for row, score in hits]
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict[str, Any]] = None, **kwargs) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_relevance_scores(query, k, filter)]
+
+    def max_marginal_relevance_search(self, query: str, k: int = 4, fetch_k: int = 20,
+                                      lambda_mult: float = 0.5, filter: Optional[Dict[str, Any]] = None,
+                                      **kwargs) -> List[Document]:
+        return [self.docs.document(row) for row, _ in self.search_mmr(query, k, fetch_k, lambda_mult, filter)]
@@ -19,12 +19,11 @@ from __future__ import annotations
 import os
 import json
 import random
-from typing import List, Dict, Any, Optional
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 from flask import Blueprint, jsonify, request
 
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
 
 # Create Blueprint for visibility API routes
 visibility_bp = Blueprint('visibility', __name__, url_prefix='/api/visibility')
@@ -41,6 +40,19 @@ def init_visibility(vector_store, llm: ChatOpenAI):
     _llm = llm
 
 
+def run_json_chain(messages: List[tuple], inputs: Dict[str, Any]) -> Any:
+    """Build prompt | llm | JSON parser for a prompt spec and invoke it.
+
+    LangChain is imported here rather than at module load so the blueprint can
+    be registered before the heavy dependencies have been imported.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import JsonOutputParser
+
+    chain = ChatPromptTemplate.from_messages(messages) | _llm | JsonOutputParser()
+    return chain.invoke(inputs)
+
+
 def get_sample_chunks(n: int = 20, where_filter: Dict = None) -> List[str]:
     """Get random sample chunks from vector store."""
     if not _vector_store:
@@ -66,7 +78,7 @@ def get_sample_chunks(n: int = 20, where_filter: Dict = None) -> List[str]:
 # MODE 1: CORPUS PROFILER
 # ============================================================
 
-PROFILE_PROMPT = ChatPromptTemplate.from_messages([
+PROFILE_PROMPT = [
     ("system", """You are a data profiler analyzing a knowledge base about healthcare and trade certifications.
 
 Analyze the sample chunks and provide a comprehensive profile:
@@ -86,7 +98,7 @@ Respond in JSON format."""),
     ("user", """Profile these {n_samples} sample chunks:
 
 {chunks}""")
-])
+]
 
 
 @visibility_bp.route('/profile', methods=['POST'])
@@ -111,8 +123,7 @@ def profile_corpus():
     chunks_text = "\n\n---\n\n".join(chunks)
     
     try:
-        chain = PROFILE_PROMPT | _llm | JsonOutputParser()
-        result = chain.invoke({
+        result = run_json_chain(PROFILE_PROMPT, {
             "n_samples": len(chunks),
             "chunks": chunks_text
         })
@@ -129,7 +140,7 @@ def profile_corpus():
 # MODE 2: FIELD CATALOG
 # ============================================================
 
-FIELD_PROMPT = ChatPromptTemplate.from_messages([
+FIELD_PROMPT = [
     ("system", """You are a schema extractor analyzing healthcare certification content.
 
 Extract ALL important fields/data points. For each field provide:
@@ -164,7 +175,7 @@ Respond in JSON:
     ("user", """Extract fields from this content about: {focus_area}
 
 {chunks}""")
-])
+]
 
 
 @visibility_bp.route('/fields', methods=['POST'])
@@ -185,8 +196,7 @@ def extract_fields():
     chunks_text = "\n\n---\n\n".join(chunks)
     
     try:
-        chain = FIELD_PROMPT | _llm | JsonOutputParser()
-        result = chain.invoke({
+        result = run_json_chain(FIELD_PROMPT, {
             "focus_area": focus_area,
             "chunks": chunks_text
         })
@@ -203,7 +213,7 @@ def extract_fields():
 # MODE 3: WORKFLOW RECONSTRUCTOR
 # ============================================================
 
-WORKFLOW_PROMPT = ChatPromptTemplate.from_messages([
+WORKFLOW_PROMPT = [
     ("system", """You are reconstructing a step-by-step certification process from documentation.
 
 Create a COMPLETE workflow including:
@@ -248,7 +258,7 @@ State: {state}
 
 Content:
 {chunks}""")
-])
+]
 
 
 @visibility_bp.route('/workflow', methods=['POST'])
@@ -272,8 +282,7 @@ def reconstruct_workflow():
     chunks_text = "\n\n---\n\n".join(chunks)
     
     try:
-        chain = WORKFLOW_PROMPT | _llm | JsonOutputParser()
-        result = chain.invoke({
+        result = run_json_chain(WORKFLOW_PROMPT, {
             "process_name": process_name,
             "state": state,
             "chunks": chunks_text
@@ -292,7 +301,7 @@ def reconstruct_workflow():
 # MODE 4: CROSS-DOMAIN LINKER
 # ============================================================
 
-CROSSREF_PROMPT = ChatPromptTemplate.from_messages([
+CROSSREF_PROMPT = [
     ("system", """You are finding connections between different certifications and programs.
 
 Identify:
@@ -342,7 +351,7 @@ Respond in JSON:
     ("user", """Find cross-domain connections in this content:
 
 {chunks}""")
-])
+]
 
 
 @visibility_bp.route('/crossref', methods=['POST'])
@@ -360,8 +369,7 @@ def find_cross_references():
     chunks_text = "\n\n---\n\n".join(chunks)
     
     try:
-        chain = CROSSREF_PROMPT | _llm | JsonOutputParser()
-        result = chain.invoke({"chunks": chunks_text})
+        result = run_json_chain(CROSSREF_PROMPT, {"chunks": chunks_text})
         return jsonify({
             "status": "success",
             "connections": result
@@ -374,7 +382,7 @@ def find_cross_references():
 # MODE 5: QUESTION GENERATOR
 # ============================================================
 
-QUESTION_PROMPT = ChatPromptTemplate.from_messages([
+QUESTION_PROMPT = [
     ("system", """You are generating realistic user questions for a healthcare certification guidance system.
 
 Generate questions that REAL users would ask. These should be specific, practical questions
@@ -401,7 +409,7 @@ Focus: {focus_area}
 
 Content:
 {chunks}""")
-])
+]
 
 
 @visibility_bp.route('/questions', methods=['POST'])
@@ -421,8 +429,7 @@ def generate_questions():
     chunks_text = "\n\n---\n\n".join(chunks)
     
     try:
-        chain = QUESTION_PROMPT | _llm | JsonOutputParser()
-        result = chain.invoke({
+        result = run_json_chain(QUESTION_PROMPT, {
             "focus_area": focus_area,
             "chunks": chunks_text
         })
@@ -439,7 +446,7 @@ def generate_questions():
 # MODE 6: SQL SCHEMA GENERATOR
 # ============================================================
 
-SCHEMA_PROMPT = ChatPromptTemplate.from_messages([
+SCHEMA_PROMPT = [
     ("system", """You are a database architect designing a SQL Server schema for healthcare certification data.
 
 Based on the content, design a NORMALIZED schema that captures:
@@ -481,7 +488,7 @@ Respond in JSON:
     ("user", """Design a SQL Server schema for this content:
 
 {chunks}""")
-])
+]
 
 
 @visibility_bp.route('/schema', methods=['POST'])
@@ -498,8 +505,7 @@ def generate_schema():
     chunks_text = "\n\n---\n\n".join(chunks)
     
     try:
-        chain = SCHEMA_PROMPT | _llm | JsonOutputParser()
-        result = chain.invoke({"chunks": chunks_text})
+        result = run_json_chain(SCHEMA_PROMPT, {"chunks": chunks_text})
         return jsonify({
             "status": "success",
             "schema": result